@@ -0,0 +1,265 @@
+"""
+Rating analytics for IKW Store.
+
+Reports are computed over column arrays instead of per-product loops:
+
+- ``RatingColumns``: product ids, vote counts, vote totals and 5-bucket
+  histograms of every rated product, one array each, taken from the rating
+  store's aggregates
+- ``RatingEvents``: recent individual votes (product id, score, timestamp)
+  in typed arrays, fed by the rating store, for time-windowed trends
+
+With NumPy installed, grouped aggregates, smoothed scores, rankings and
+trend buckets are vectorized; without it, plain-Python fallbacks return the
+same results.
+
+Smoothed scores are Bayesian averages: each product's votes are combined
+with ``PRIOR_VOTES`` phantom votes at the store-wide mean, so one 5-star
+vote does not outrank two hundred votes averaging 4.8. They drive the "Top
+rated" product sort. The report is served as JSON, protected by
+``ANALYTICS_TOKEN`` (404 while unset):
+
+    curl -H "Authorization: Bearer $ANALYTICS_TOKEN" \\
+        "http://localhost:5001/admin/analytics/ratings?limit=10&window=86400&buckets=24"
+
+Events are kept per process (its last ``RATING_EVENTS_MAX`` votes), so with
+several workers a trend covers the votes the answering worker received;
+the aggregates come from the shared store.
+"""
+
+from array import array
+import hmac
+import os
+import threading
+import time
+
+from flask import abort, current_app, jsonify, request
+
+from catalog import get_product
+from ratings import MAX_RATING, get_rating_store
+
+try:
+    import numpy as np
+except ImportError:  # Optional: the plain-Python fallbacks give the same results
+    np = None
+
+PRIOR_VOTES = 5
+DEFAULT_MAX_EVENTS = 1000000
+
+
+def _to_numpy(column):
+    return np.frombuffer(column, dtype=column.typecode) if np is not None else column
+
+
+class RatingEvents:
+    """Recent votes as product id, score and timestamp column arrays"""
+
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS):
+        self.max_events = max_events
+        self.product_ids = array('q')
+        self.scores = array('B')
+        self.timestamps = array('d')
+        self._lock = threading.Lock()
+
+    def append(self, product_id, score, timestamp=None):
+        """Record one vote"""
+        with self._lock:
+            self.product_ids.append(product_id)
+            self.scores.append(score)
+            self.timestamps.append(time.time() if timestamp is None else timestamp)
+            if len(self.scores) > self.max_events:
+                # Drop the oldest quarter at once, so trimming costs O(1) per vote
+                drop = len(self.scores) - self.max_events * 3 // 4
+                del self.product_ids[:drop], self.scores[:drop], self.timestamps[:drop]
+
+    def columns(self):
+        """Copies of the (product ids, scores, timestamps) columns, as NumPy arrays when available"""
+        with self._lock:
+            columns = self.product_ids[:], self.scores[:], self.timestamps[:]
+        return tuple(_to_numpy(column) for column in columns)
+
+    def __len__(self):
+        return len(self.scores)
+
+
+class RatingColumns:
+    """Aggregates of every rated product as column arrays"""
+
+    __slots__ = ('product_ids', 'counts', 'totals', 'histograms')
+
+    def __init__(self, rated):
+        aggregates = list(rated.values())
+        if np is not None:
+            size = len(aggregates)
+            self.product_ids = np.fromiter(rated, dtype=np.int64, count=size)
+            self.counts = np.fromiter((a.count for a in aggregates), dtype=np.int64, count=size)
+            self.totals = np.fromiter((a.total for a in aggregates), dtype=np.int64, count=size)
+            self.histograms = np.frombuffer(b''.join(a.histogram.tobytes() for a in aggregates),
+                                            dtype='I').reshape(size, MAX_RATING).astype(np.int64)
+        else:
+            self.product_ids = list(rated)
+            self.counts = [a.count for a in aggregates]
+            self.totals = [a.total for a in aggregates]
+            self.histograms = [list(a.histogram) for a in aggregates]
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(store.rated())
+
+    def __len__(self):
+        return len(self.product_ids)
+
+
+def vote_summary(columns):
+    """(total votes, store-wide mean score or None, votes per score 1-5)"""
+    if np is not None:
+        votes = int(columns.counts.sum())
+        distribution = columns.histograms.sum(axis=0).tolist() if len(columns) else [0] * MAX_RATING
+        total = int(columns.totals.sum())
+    else:
+        votes = sum(columns.counts)
+        distribution = [sum(column) for column in zip(*columns.histograms)] or [0] * MAX_RATING
+        total = sum(columns.totals)
+    return votes, (total / votes if votes else None), distribution
+
+
+def smoothed_scores(columns, prior_votes=PRIOR_VOTES):
+    """Bayesian average of each product: (prior_votes * mean + total) / (prior_votes + count)"""
+    _, mean, _ = vote_summary(columns)
+    if mean is None:
+        return np.zeros(0) if np is not None else []
+    prior = prior_votes * mean
+    if np is not None:
+        return (prior + columns.totals) / (prior_votes + columns.counts)
+    return [(prior + total) / (prior_votes + count) for total, count in zip(columns.totals, columns.counts)]
+
+
+def rating_scores(store, prior_votes=PRIOR_VOTES):
+    """{product_id: (smoothed score, votes)} for every rated product in ``store``"""
+    columns = RatingColumns.from_store(store)
+    scores = smoothed_scores(columns, prior_votes)
+    if np is not None:
+        return dict(zip(columns.product_ids.tolist(), zip(scores.tolist(), columns.counts.tolist())))
+    return dict(zip(columns.product_ids, zip(scores, columns.counts)))
+
+
+def top_rated(columns, limit=10, prior_votes=PRIOR_VOTES):
+    """Best products by smoothed score, then votes: [{product_id, votes, average, smoothed}]"""
+    scores = smoothed_scores(columns, prior_votes)
+    if np is not None:
+        order = np.lexsort((columns.product_ids, -columns.counts, -scores))[:limit].tolist()
+        rows = zip(columns.product_ids[order].tolist(), columns.counts[order].tolist(),
+                   columns.totals[order].tolist(), scores[order].tolist())
+    else:
+        order = sorted(range(len(columns)), key=lambda i: (-scores[i], -columns.counts[i], columns.product_ids[i]))
+        rows = ((columns.product_ids[i], columns.counts[i], columns.totals[i], scores[i]) for i in order[:limit])
+    return [{'product_id': product_id, 'votes': count, 'average': round(total / count, 2),
+             'smoothed': round(score, 3)} for product_id, count, total, score in rows]
+
+
+def _in_window(events, start, end):
+    product_ids, scores, timestamps = events
+    if np is not None:
+        mask = (timestamps >= start) & (timestamps < end)
+        return product_ids[mask], scores[mask].astype(np.int64), timestamps[mask]
+    selected = [i for i, timestamp in enumerate(timestamps) if start <= timestamp < end]
+    return ([product_ids[i] for i in selected], [scores[i] for i in selected],
+            [timestamps[i] for i in selected])
+
+
+def vote_trend(events, window, buckets, now=None):
+    """Votes and average score in ``buckets`` equal slices of the last ``window`` seconds, oldest first"""
+    end = time.time() if now is None else now
+    start, width = end - window, window / buckets
+    _, scores, timestamps = _in_window(events, start, end)
+    if np is not None:
+        slots = np.minimum(((timestamps - start) // width).astype(np.int64), buckets - 1)
+        counts = np.bincount(slots, minlength=buckets).tolist()
+        sums = np.bincount(slots, weights=scores, minlength=buckets).tolist()
+    else:
+        counts, sums = [0] * buckets, [0] * buckets
+        for score, timestamp in zip(scores, timestamps):
+            slot = min(int((timestamp - start) // width), buckets - 1)
+            counts[slot] += 1
+            sums[slot] += score
+    return [{'start': round(start + n * width, 3), 'votes': count,
+             'average': round(total / count, 2) if count else None}
+            for n, (count, total) in enumerate(zip(counts, sums))]
+
+
+def trending(events, window, limit=10, now=None):
+    """Most-voted products of the last ``window`` seconds: [{product_id, votes, average}]"""
+    end = time.time() if now is None else now
+    product_ids, scores, _ = _in_window(events, end - window, end)
+    if np is not None:
+        ids, groups = np.unique(product_ids, return_inverse=True)
+        counts = np.bincount(groups, minlength=len(ids))
+        sums = np.bincount(groups, weights=scores, minlength=len(ids))
+        order = np.lexsort((ids, -counts))[:limit].tolist()
+        rows = zip(ids[order].tolist(), counts[order].tolist(), sums[order].tolist())
+    else:
+        grouped = {}
+        for product_id, score in zip(product_ids, scores):
+            group = grouped.setdefault(product_id, [0, 0])
+            group[0] += 1
+            group[1] += score
+        order = sorted(grouped, key=lambda product_id: (-grouped[product_id][0], product_id))[:limit]
+        rows = ((product_id, *grouped[product_id]) for product_id in order)
+    return [{'product_id': product_id, 'votes': count, 'average': round(total / count, 2)}
+            for product_id, count, total in rows]
+
+
+def rating_report(store, events, limit=10, window=86400, buckets=24, now=None):
+    """Aggregates, smoothed ranking, vote trend and trending products as a JSON-ready dict"""
+    columns = RatingColumns.from_store(store)
+    votes, mean, distribution = vote_summary(columns)
+    event_columns = (events if events is not None else RatingEvents()).columns()
+    return {
+        'backend': 'numpy' if np is not None else 'python',
+        'products_rated': len(columns),
+        'votes': votes,
+        'mean': round(mean, 3) if mean is not None else None,
+        'distribution': dict(zip(range(1, MAX_RATING + 1), distribution)),
+        'prior_votes': PRIOR_VOTES,
+        'top_rated': top_rated(columns, limit),
+        'trend': {'window': window, 'buckets': vote_trend(event_columns, window, buckets, now)},
+        'trending': trending(event_columns, window, limit, now),
+    }
+
+
+def _int_arg(name, default, minimum, maximum):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        abort(400)
+    if not minimum <= value <= maximum:
+        abort(400)
+    return value
+
+
+def ratings_report_view():
+    """Rating analytics (?limit=10&window=86400&buckets=24)"""
+    token = current_app.config.get('ANALYTICS_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        abort(401)
+    report = rating_report(get_rating_store(), current_app.extensions.get('rating_events'),
+                           limit=_int_arg('limit', 10, 1, 100),
+                           window=_int_arg('window', 86400, 60, 90 * 86400),
+                           buckets=_int_arg('buckets', 24, 1, 500))
+    for row in report['top_rated'] + report['trending']:
+        product = get_product(row['product_id'])
+        row['name'] = product.name if product else None
+    response = jsonify(report)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def init_analytics(app):
+    """Attach the vote event log to the rating store and add the report endpoint"""
+    app.config.setdefault('ANALYTICS_TOKEN', os.environ.get('ANALYTICS_TOKEN'))
+    app.config.setdefault('RATING_EVENTS_MAX', DEFAULT_MAX_EVENTS)
+    events = app.extensions['rating_events'] = RatingEvents(app.config['RATING_EVENTS_MAX'])
+    app.extensions['ratings'].events = events
+    app.add_url_rule('/admin/analytics/ratings', 'rating_analytics', ratings_report_view)
@@ -0,0 +1,302 @@
+"""
+JSON API for IKW Store (``/api/v1``).
+
+Gives mobile and single-page clients one request per user action: cart
+mutations and ratings return the updated state directly instead of a redirect
+plus a full page render. ``POST /api/v1/cart/batch`` applies many cart line
+changes at once and returns the new totals.
+
+The parsing, cart and response-building helpers here are plain functions
+over dicts, so the async handlers in ``asgi.py`` share them with these Flask
+views and only the request/response plumbing differs.
+"""
+
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request, session
+
+from catalog import get_catalog, get_product
+from enquiries import submit_enquiry as queue_enquiry
+from inventory import get_inventory
+from ratings import MIN_RATING, MAX_RATING, get_rating_store, submit_rating
+from shopping_cart import (MAX_QUANTITY, get_cart, save_cart, set_quantity, get_cart_summary,
+                           cart_holder)
+from validation import sanitize_input, validate_enquiry
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_LINES = 500
+
+
+class APIError(Exception):
+    """Error reported to the client as {"error": message} with an HTTP status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@api.errorhandler(APIError)
+def handle_api_error(error):
+    return jsonify(error=error.message), error.status
+
+
+def product_json(product):
+    """Product fields plus its rating summary"""
+    ratings = get_rating_store()
+    data = product.to_dict()
+    data['rating'] = {'average': ratings.average(product.id), 'count': ratings.count(product.id)}
+    return data
+
+
+def cart_json(cart=None):
+    """Cart lines, item count and total for ``cart`` (default: the session cart)"""
+    summary = get_cart_summary(cart)
+    return {
+        'lines': [{
+            'product_id': line.product.id,
+            'name': line.product.name,
+            'unit_price': line.product.price,
+            'quantity': line.quantity,
+            'subtotal': line.subtotal,
+        } for line in summary.lines],
+        'count': summary.count,
+        'total': summary.total,
+    }
+
+
+def int_arg(args, name, default, minimum, maximum):
+    """Read a bounded integer query parameter"""
+    value = args.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise APIError(f'{name} must be an integer')
+    if not minimum <= value <= maximum:
+        raise APIError(f'{name} must be between {minimum} and {maximum}')
+    return value
+
+
+def page_args(args):
+    """Read (offset, limit) pagination parameters"""
+    return (int_arg(args, 'offset', 0, 0, 10 ** 9),
+            int_arg(args, 'limit', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE))
+
+
+def json_object(data):
+    """Check that a decoded request body is a JSON object"""
+    if not isinstance(data, dict):
+        raise APIError('Request body must be a JSON object')
+    return data
+
+
+def _json_body():
+    return json_object(request.get_json(silent=True))
+
+
+def require_product(product_id):
+    """Resolve a product id or fail with 404"""
+    product = get_product(product_id)
+    if product is None:
+        raise APIError(f'Product {product_id} not found', 404)
+    return product
+
+
+def parse_quantity(value, minimum=0):
+    """Validate a JSON quantity value"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise APIError('quantity must be an integer')
+    if not minimum <= value <= MAX_QUANTITY:
+        raise APIError(f'quantity must be between {minimum} and {MAX_QUANTITY}')
+    return value
+
+
+def parse_rating(value):
+    """Validate a JSON rating value"""
+    if isinstance(value, bool) or not isinstance(value, int) or not MIN_RATING <= value <= MAX_RATING:
+        raise APIError(f'rating must be an integer between {MIN_RATING} and {MAX_RATING}')
+    return value
+
+
+def reserve(holder, product_id, quantity):
+    """Hold stock for a cart line of ``quantity`` (0 releases it) or fail with 409"""
+    if not get_inventory().reserve(holder, product_id, quantity):
+        raise APIError(f'Not enough stock for product {product_id}', 409)
+
+
+def add_to_cart(cart, data, holder):
+    """Apply an "add item" request body to ``cart``, reserving stock for ``holder``"""
+    product = require_product(data.get('product_id'))
+    quantity = parse_quantity(data.get('quantity', 1), minimum=1)
+    current = cart.get(str(product.id), 0)
+    quantity = min(current + quantity, MAX_QUANTITY)
+    reserve(holder, product.id, quantity)
+    set_quantity(cart, product.id, quantity)
+
+
+def update_cart_line(cart, product_id, quantity, holder):
+    """Set the quantity of a cart line (0 removes it), reserving stock for ``holder``"""
+    reserve(holder, product_id, quantity)
+    set_quantity(cart, product_id, quantity)
+
+
+def apply_cart_batch(cart, data, holder):
+    """
+    Apply a batch of line changes to ``cart``.
+
+    Body: {"lines": [{"product_id": 1, "quantity": 3}, {"product_id": 2, "quantity": 0}]}.
+    Each quantity replaces the line's quantity (0 removes the line). The
+    batch is validated and its stock reserved as a whole first, so either
+    every change is applied or none is.
+    """
+    lines = data.get('lines')
+    if not isinstance(lines, list) or not lines:
+        raise APIError('lines must be a non-empty list')
+    if len(lines) > MAX_BATCH_LINES:
+        raise APIError(f'At most {MAX_BATCH_LINES} lines per batch')
+
+    changes = []
+    for index, line in enumerate(lines):
+        if not isinstance(line, dict):
+            raise APIError(f'lines[{index}] must be an object')
+        try:
+            product = require_product(line.get('product_id'))
+            quantity = parse_quantity(line.get('quantity'))
+        except APIError as error:
+            raise APIError(f'lines[{index}]: {error.message}', error.status)
+        changes.append((product.id, quantity))
+
+    inventory = get_inventory()
+    for index, (product_id, quantity) in enumerate(changes):
+        if not inventory.reserve(holder, product_id, quantity):
+            for undo_id, _ in reversed(changes[:index]):  # Back to the cart's own quantities
+                inventory.reserve(holder, undo_id, cart.get(str(undo_id), 0))
+            raise APIError(f'lines[{index}]: Not enough stock for product {product_id}', 409)
+
+    for product_id, quantity in changes:
+        set_quantity(cart, product_id, quantity)
+
+
+def build_enquiry(data):
+    """Validate and sanitize an enquiry; returns the record or raises APIError"""
+    values, errors = validate_enquiry(data)
+    if errors:
+        raise APIError('; '.join(errors))
+    record = {field: sanitize_input(value) for field, value in values.items()}
+    record['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return record
+
+
+def products_page_json(args):
+    """A page of the catalog in catalog order (``?offset=&limit=``)"""
+    offset, limit = page_args(args)
+    catalog = get_catalog()
+    page = catalog.products[offset:offset + limit]
+    return {'products': [product_json(p) for p in page], 'total': len(catalog), 'offset': offset, 'limit': limit}
+
+
+def product_detail_json(product_id):
+    """A single product with its rating distribution"""
+    product = require_product(product_id)
+    data = product_json(product)
+    data['rating']['distribution'] = get_rating_store().distribution(product.id)
+    return data
+
+
+def search_json(args):
+    """Ranked full-text search results (``?q=&offset=&limit=``)"""
+    query = args.get('q', '')
+    offset, limit = page_args(args)
+    results, total = get_catalog().search(query, offset, limit)
+    return {'query': query, 'products': [product_json(p) for p in results], 'total': total,
+            'offset': offset, 'limit': limit}
+
+
+def rate_product(product_id, data, current_session=None):
+    """Record the visitor's rating ``data`` of a product; returns its updated rating summary"""
+    product = require_product(product_id)
+    score = parse_rating(data.get('rating'))
+    submit_rating(product.id, score, current_session)
+    ratings = get_rating_store()
+    return {'product_id': product.id, 'your_rating': score,
+            'average': ratings.average(product.id), 'count': ratings.count(product.id)}
+
+
+@api.route('/products')
+def list_products():
+    """Catalog listing in catalog order"""
+    return jsonify(products_page_json(request.args))
+
+
+@api.route('/products/<int:product_id>')
+def show_product(product_id):
+    """A single product with its rating distribution"""
+    return jsonify(product_detail_json(product_id))
+
+
+@api.route('/search')
+def search_products():
+    """Ranked full-text search"""
+    return jsonify(search_json(request.args))
+
+
+@api.route('/cart')
+def show_cart():
+    """Current cart lines and totals"""
+    return jsonify(cart_json())
+
+
+@api.route('/cart/items', methods=['POST'])
+def add_cart_item():
+    """Add ``quantity`` (default 1) of a product to the cart"""
+    cart = get_cart()
+    add_to_cart(cart, _json_body(), cart_holder())
+    save_cart(cart)
+    return jsonify(cart_json())
+
+
+@api.route('/cart/items/<int:product_id>', methods=['PUT'])
+def update_cart_item(product_id):
+    """Set the quantity of a cart line (0 removes it)"""
+    require_product(product_id)
+    quantity = parse_quantity(_json_body().get('quantity'))
+    cart = get_cart()
+    update_cart_line(cart, product_id, quantity, cart_holder())
+    save_cart(cart)
+    return jsonify(cart_json())
+
+
+@api.route('/cart/items/<int:product_id>', methods=['DELETE'])
+def delete_cart_item(product_id):
+    """Remove a line from the cart"""
+    cart = get_cart()
+    update_cart_line(cart, product_id, 0, cart_holder())
+    save_cart(cart)
+    return jsonify(cart_json())
+
+
+@api.route('/cart/batch', methods=['POST'])
+def batch_update_cart():
+    """Apply many cart line changes in one request (see apply_cart_batch)"""
+    cart = get_cart()
+    apply_cart_batch(cart, _json_body(), cart_holder())
+    save_cart(cart)
+    return jsonify(cart_json())
+
+
+@api.route('/products/<int:product_id>/ratings', methods=['POST'])
+def rate(product_id):
+    """Rate a product 1-5 and return its updated rating summary"""
+    return jsonify(rate_product(product_id, _json_body()))
+
+
+@api.route('/enquiries', methods=['POST'])
+def submit_enquiry():
+    """Validate an enquiry (same rules as the enquiry form) and queue it for delivery"""
+    record = build_enquiry(_json_body())
+    queue_enquiry(record)
+    session['enquiry_data'] = record
+    return jsonify(enquiry=record), 201
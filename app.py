@@ -1,13 +1,61 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, stream_template, request, redirect, url_for, session, flash
+from markupsafe import Markup
 from datetime import datetime
+import os
 import random
-import re
+import sys
+
+from analytics import init_analytics
+from api import api
+from assets import init_assets
+from catalog import Catalog, install_catalog, get_catalog, get_product
+from catalog_loader import init_catalog_source
+from config import load_config
+from enquiries import init_enquiry_queue, submit_enquiry
+from fragment_cache import FragmentCache
+from http_cache import init_http_cache, conditional
+from instrumentation import init_instrumentation, phase
+from inventory import get_inventory, init_inventory
+from listing import SORT_ORDERS, paginate
+from orders import init_order_log, record_order
+from ratelimit import init_rate_limiter
+from ratings import create_rating_store, install_rating_store, submit_rating
+from recommendations import get_recommender, init_recommendations
+from sessions import init_session_store
+from templating import init_templating, product_urls, placeholder_image_url
+from shopping_cart import (get_cart, save_cart, add_item, set_quantity, remove_item,
+                           get_cart_summary, cart_holder)
+from validation import validate_enquiry, sanitize_input
 
 app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-in-production'
+# SECRET_KEY and cookie settings per profile: APP_CONFIG=development (default) or production
+load_config(app)
+
+# Filesystem bytecode cache for compiled templates (set before the Jinja environment exists)
+init_templating(app)
+
+# Enquiries are appended to a durable queue and delivered by background workers
+init_enquiry_queue(app)
+
+# Keep session data server-side (only an opaque id in the cookie) when
+# SESSION_STORE=sqlite:///path/to/sessions.db; signed-cookie sessions otherwise
+init_session_store(app, os.environ.get('SESSION_STORE'))
+
+# Token buckets for rating and enquiry POSTs, checked before the form is parsed:
+# per-process by default, shared by all workers with RATELIMIT_STORE=sqlite:///path/to/ratelimit.db
+init_rate_limiter(app, os.environ.get('RATELIMIT_STORE'))
+
+# Fingerprinted static URLs and precompressed variants (built by `flask --app app assets build`)
+init_assets(app)
 
-# Global storage for product ratings (in production, use a database)
-PRODUCT_RATINGS = {}  # {product_id: [list of ratings]}
+# Global storage for product ratings: per-process memory by default, or a SQLite
+# database shared by all workers when RATING_STORE=sqlite:///path/to/ratings.db
+PRODUCT_RATINGS = create_rating_store(os.environ.get('RATING_STORE'))  # {product_id: running count/sum/histogram}
+install_rating_store(app, PRODUCT_RATINGS)
+
+# Vote log for trends, smoothed scores for the "Top rated" sort and
+# /admin/analytics/ratings (ANALYTICS_TOKEN); vectorized when NumPy is installed
+init_analytics(app)
 
 # Product data - 20 computer accessories
 PRODUCTS = [
@@ -33,119 +81,129 @@ PRODUCTS = [
     {"id": 20, "name": "Docking Station", "description": "Thunderbolt 3 docking station with dual 4K support", "price": 13500, "image": "dock.svg"},
 ]
 
-def get_cart():
-    """Get current cart from session"""
-    return session.get('cart', {})
+# Stock levels and cart reservations (INVENTORY_STORE=sqlite:///... to share between workers)
+init_inventory(app, os.environ.get('INVENTORY_STORE'))
+
+# Indexed catalog built from the product data above (id -> product lookups are O(1)),
+# or from the CATALOG_SOURCE file (CSV, JSONL or SQLite, with an optional stock column
+# seeding the inventory), reloaded when it changes
+install_catalog(app, Catalog(PRODUCTS))
+init_catalog_source(app, os.environ.get('CATALOG_SOURCE'))
+
+# Append-only log of completed orders, exported via /admin/orders/export (ORDERS_TOKEN)
+init_order_log(app)
+
+# "Customers also bought": item-to-item top-k table learned from orders and ratings
+init_recommendations(app)
+
+# Rendered HTML (product cards, product grids, anonymous pages), keyed by the
+# catalog and rating versions it was rendered from
+FRAGMENT_CACHE = FragmentCache(max_bytes=int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 8 * 1024 * 1024)))
+app.extensions['fragment_cache'] = FRAGMENT_CACHE
 
-def get_ratings():
-    """Get current ratings from session"""
-    return session.get('ratings', {})
+# ETag salt and per-route Cache-Control policies (app.config['CACHE_CONTROL'])
+init_http_cache(app)
+
+# JSON API for mobile/SPA clients (/api/v1)
+app.register_blueprint(api)
+
+# Per-route latency, phase timings, /metrics and cProfile sampling (INSTRUMENTATION=1)
+init_instrumentation(app)
 
 def get_average_rating(product_id):
     """Calculate average rating for a product"""
-    ratings = PRODUCT_RATINGS.get(product_id, [])
-    if not ratings:
-        return None
-    return round(sum(ratings) / len(ratings), 1)
+    return PRODUCT_RATINGS.average(product_id)
 
 def get_rating_count(product_id):
     """Get total number of ratings for a product"""
-    return len(PRODUCT_RATINGS.get(product_id, []))
+    return PRODUCT_RATINGS.count(product_id)
 
-def get_cart_total():
-    """Calculate total price of items in cart"""
-    cart = get_cart()
-    total = 0
-    for product_id, quantity in cart.items():
-        product = next((p for p in PRODUCTS if p['id'] == int(product_id)), None)
-        if product:
-            total += product['price'] * quantity
-    return total
-
-def validate_email(email):
-    """Validate email format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
-
-def validate_input_security(text):
-    """Validate input for potentially dangerous patterns - returns (is_valid, error_message)"""
-    if not text:
-        return True, None
-    
-    import re
-    
-    # Check for script tags
-    if re.search(r'<script[^>]*>', text, re.IGNORECASE):
-        return False, "Input contains script tags which are not allowed"
-    
-    # Check for javascript: protocol
-    if re.search(r'javascript:', text, re.IGNORECASE):
-        return False, "Javascript protocol is not allowed"
-    
-    # Check for on* event handlers (e.g., onclick, onerror, etc.)
-    if re.search(r'on\w+\s*=', text, re.IGNORECASE):
-        return False, "Event handlers are not allowed"
-    
-    # Check for data: protocol
-    if re.search(r'data:\s*text/html', text, re.IGNORECASE):
-        return False, "Data URIs are not allowed"
-    
-    # Check for common SQL injection patterns
-    sql_patterns = [r'(\bOR\b|\bAND\b)\s+\d+\s*=\s*\d+', r';\s*DROP\s+TABLE', r'UNION\s+SELECT', r'/\*.*?\*/']
-    for pattern in sql_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            return False, "Potentially malicious SQL patterns detected"
-    
-    # Check for HTML tags (basic check)
-    if re.search(r'<[^>]+>', text):
-        return False, "HTML tags are not allowed"
-    
-    return True, None
+def render_product_card(product):
+    """Render one product card - cached until the product or its ratings change"""
+    aggregate = PRODUCT_RATINGS.get(product.id)
+    count, average = (aggregate.count, aggregate.average) if aggregate else (0, None)
+    key = ('card', get_catalog().version, product.id, count, average)
+    return FRAGMENT_CACHE.get_or_render(key, lambda: Markup(render_template(
+        '_product_card.html', product=product, urls=product_urls(product),
+        placeholder_url=placeholder_image_url(), average=average, count=count)))
 
-def sanitize_input(text):
-    """Sanitize user input to prevent injection attacks (fallback - should not be needed if validation works)"""
-    if not text:
-        return ""
-    
-    # Import html for proper escaping
-    from html import escape
+def get_listing_page(search_query, sort, cursor):
+    """One page of the product listing; an invalid or stale cursor starts from the first page"""
+    catalog = get_catalog()
+    per_page = app.config['PRODUCTS_PER_PAGE']
+    # Ranked lookup in the catalog's inverted index, or a presorted index for the whole catalog
+    with phase('catalog'):
+        try:
+            return paginate(catalog, PRODUCT_RATINGS, search_query, sort, cursor, per_page)
+        except ValueError:
+            return paginate(catalog, PRODUCT_RATINGS, search_query, sort, None, per_page)
+
+def render_product_listing(search_query, sort, cursor):
+    """Render one page of product cards and its pager - cached per catalog and rating version"""
+    catalog = get_catalog()
+    key = ('listing', search_query, sort, cursor, app.config['PRODUCTS_PER_PAGE'],
+           catalog.version, PRODUCT_RATINGS.version)
     
-    # Escape HTML special characters to prevent XSS attacks
-    text = escape(text, quote=True)
+    def render():
+        page = get_listing_page(search_query, sort, cursor)
+        return Markup(render_template(
+            '_product_page.html', page=page, search_query=search_query,
+            cards=(render_product_card(product) for product in page.products)))
     
-    return text
+    return FRAGMENT_CACHE.get_or_render(key, render)
+
+def listing_args():
+    """Normalized search query, sort order and cursor of a product listing request"""
+    sort = request.args.get('sort', '')
+    return (request.args.get('search', '').lower(), sort if sort in SORT_ORDERS else '',
+            request.args.get('cursor', ''))
+
+def cart_recommendations(limit=4):
+    """Products often bought with the ones in this visitor's cart"""
+    cart = session.get('cart')
+    if not cart:
+        return []
+    recommended = (get_product(product_id) for product_id in get_recommender().for_basket(map(int, cart), limit))
+    return [product for product in recommended if product]
+
+def recommendations_key():
+    """ETag part for the cart's recommendations (none without a cart, so shared pages keep their ETag)"""
+    cart = session.get('cart')
+    return (get_recommender().version, tuple(sorted(cart))) if cart else ()
+
+def render_cached_page(key, render):
+    """Serve a whole page from the fragment cache when it has no per-visitor content"""
+    if session.get('cart') or session.get('_flashes'):
+        # Cart badge and flash messages differ per visitor
+        return render()
+    return FRAGMENT_CACHE.get_or_render(('page',) + key, render)
 
 @app.route('/')
+@conditional(lambda: ('home',), per_process=False)
 def home():
     """Home page with shop information"""
-    return render_template('home.html')
+    return render_cached_page(('home',), lambda: render_template('home.html'))
 
 @app.route('/products')
+@conditional(lambda: ('products',) + listing_args() + (get_catalog().version, PRODUCT_RATINGS.version)
+             + recommendations_key())
 def products():
-    """Product list page with search functionality"""
-    search_query = request.args.get('search', '').lower()
-    
-    if search_query:
-        filtered_products = [p for p in PRODUCTS if search_query in p['name'].lower()]
-    else:
-        filtered_products = PRODUCTS
+    """Product list page with search, sorting and cursor pagination"""
+    search_query, sort, cursor = listing_args()
+    recommended = cart_recommendations()
     
-    # Get user's ratings from session
-    user_ratings = get_ratings()
-    
-    # Calculate average ratings for all products
-    product_averages = {}
-    for product in filtered_products:
-        product_averages[product['id']] = {
-            'average': get_average_rating(product['id']),
-            'count': get_rating_count(product['id'])
-        }
+    if app.config['STREAM_PRODUCT_LIST']:
+        # Send the page head and the first cards while the rest are still rendering
+        page = get_listing_page(search_query, sort, cursor)
+        return stream_template(
+            'products.html', page=page, search_query=search_query, sort=sort, sort_orders=SORT_ORDERS,
+            recommended=recommended, cards=(render_product_card(product) for product in page.products))
     
-    return render_template('products.html', 
-                         products=filtered_products, 
-                         search_query=search_query, 
-                         user_ratings=user_ratings,
-                         product_averages=product_averages)
+    key = ('products', search_query, sort, cursor, get_catalog().version, PRODUCT_RATINGS.version)
+    return render_cached_page(key, lambda: render_template(
+        'products.html',
+        product_listing=render_product_listing(search_query, sort, cursor),
+        search_query=search_query, sort=sort, sort_orders=SORT_ORDERS, recommended=recommended))
 
 @app.route('/rate_product/<int:product_id>', methods=['POST'])
 def rate_product(product_id):
@@ -154,21 +212,15 @@ def rate_product(product_id):
     if rating and 1 <= int(rating) <= 5:
         rating_value = int(rating)
         
-        # Add rating to global storage
-        if product_id not in PRODUCT_RATINGS:
-            PRODUCT_RATINGS[product_id] = []
-        PRODUCT_RATINGS[product_id].append(rating_value)
-        
-        # Store user's rating in session
-        user_ratings = get_ratings()
-        user_ratings[str(product_id)] = rating_value
-        session['ratings'] = user_ratings
+        # Add rating to global storage and store user's rating in session
+        submit_rating(product_id, rating_value)
         
         # Calculate new average
         average = get_average_rating(product_id)
         count = get_rating_count(product_id)
         
-        product_name = next((p['name'] for p in PRODUCTS if p['id'] == product_id), 'this product')
+        product = get_product(product_id)
+        product_name = product.name if product else 'this product'
         flash(f'Thank you for rating {product_name} {rating} stars! (Average: {average}/5 from {count} ratings)', 'success')
     return redirect(url_for('products'))
 
@@ -176,27 +228,21 @@ def rate_product(product_id):
 def add_to_cart(product_id):
     """Add product to shopping cart"""
     cart = get_cart()
-    cart[str(product_id)] = cart.get(str(product_id), 0) + 1
-    session['cart'] = cart
+    if not get_inventory().reserve(cart_holder(), product_id, cart.get(str(product_id), 0) + 1):
+        flash('Sorry, this product is out of stock', 'warning')
+        return redirect(url_for('products'))
+    add_item(cart, product_id)
+    save_cart(cart)
     flash('Product added to cart!', 'success')
     return redirect(url_for('products'))
 
 @app.route('/cart')
 def cart():
     """Shopping cart page"""
-    cart = get_cart()
-    cart_items = []
-    for product_id, quantity in cart.items():
-        product = next((p for p in PRODUCTS if p['id'] == int(product_id)), None)
-        if product:
-            cart_items.append({
-                'product': product,
-                'quantity': quantity,
-                'subtotal': product['price'] * quantity
-            })
-    
-    total = get_cart_total()
-    return render_template('cart.html', cart_items=cart_items, total=total)
+    with phase('catalog'):
+        summary = get_cart_summary()
+    return render_template('cart.html', cart_items=summary.lines, total=summary.total,
+                           recommended=cart_recommendations())
 
 @app.route('/update_cart/<int:product_id>', methods=['POST'])
 def update_cart(product_id):
@@ -204,22 +250,25 @@ def update_cart(product_id):
     quantity = int(request.form.get('quantity', 1))
     cart = get_cart()
     
+    if not get_inventory().reserve(cart_holder(), product_id, max(quantity, 0)):
+        flash('Sorry, there is not enough stock for that quantity', 'warning')
+        return redirect(url_for('cart'))
+    set_quantity(cart, product_id, quantity)
     if quantity <= 0:
-        cart.pop(str(product_id), None)
         flash('Item removed from cart', 'info')
     else:
-        cart[str(product_id)] = quantity
         flash('Cart updated!', 'success')
     
-    session['cart'] = cart
+    save_cart(cart)
     return redirect(url_for('cart'))
 
 @app.route('/remove_from_cart/<int:product_id>')
 def remove_from_cart(product_id):
     """Remove item from cart"""
     cart = get_cart()
-    cart.pop(str(product_id), None)
-    session['cart'] = cart
+    get_inventory().reserve(cart_holder(), product_id, 0)
+    remove_item(cart, product_id)
+    save_cart(cart)
     flash('Item removed from cart', 'info')
     return redirect(url_for('cart'))
 
@@ -227,54 +276,9 @@ def remove_from_cart(product_id):
 def enquiry():
     """Enquiry form page"""
     if request.method == 'POST':
-        name = request.form.get('name', '').strip()
-        email = request.form.get('email', '').strip()
-        subject = request.form.get('subject', '').strip()
-        message = request.form.get('message', '').strip()
-        
-        # Validation
-        errors = []
-        if not name:
-            errors.append('Name is required')
-        elif len(name) > 100:
-            errors.append('Name must be less than 100 characters')
-        else:
-            # Security validation for name
-            is_valid, error_msg = validate_input_security(name)
-            if not is_valid:
-                errors.append(f'Name: {error_msg}')
-            
-        if not email:
-            errors.append('Email is required')
-        elif len(email) > 255:
-            errors.append('Email must be less than 255 characters')
-        elif not validate_email(email):
-            errors.append('Invalid email format')
-        else:
-            # Security validation for email
-            is_valid, error_msg = validate_input_security(email)
-            if not is_valid:
-                errors.append(f'Email: {error_msg}')
-            
-        if not subject:
-            errors.append('Subject is required')
-        elif len(subject) > 200:
-            errors.append('Subject must be less than 200 characters')
-        else:
-            # Security validation for subject
-            is_valid, error_msg = validate_input_security(subject)
-            if not is_valid:
-                errors.append(f'Subject: {error_msg}')
-            
-        if not message:
-            errors.append('Message is required')
-        elif len(message) > 2000:
-            errors.append('Message must be less than 2000 characters')
-        else:
-            # Security validation for message
-            is_valid, error_msg = validate_input_security(message)
-            if not is_valid:
-                errors.append(f'Message: {error_msg}')
+        # Required, length, email format and security checks for all fields at once
+        with phase('validation'):
+            values, errors = validate_enquiry(request.form)
         
         if errors:
             for error in errors:
@@ -282,13 +286,12 @@ def enquiry():
             return render_template('enquiry.html')
         
         # Sanitize inputs (as a final safety measure)
-        name = sanitize_input(name)
-        email = sanitize_input(email)
-        subject = sanitize_input(subject)
-        message = sanitize_input(message)
+        name = sanitize_input(values['name'])
+        email = sanitize_input(values['email'])
+        subject = sanitize_input(values['subject'])
+        message = sanitize_input(values['message'])
         
-        # Store in session for confirmation page
-        session['enquiry_data'] = {
+        record = {
             'name': name,
             'email': email,
             'subject': subject,
@@ -296,6 +299,10 @@ def enquiry():
             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         
+        # Queue for background delivery, and store in session for confirmation page
+        submit_enquiry(record)
+        session['enquiry_data'] = record
+        
         return redirect(url_for('enquiry_confirmation'))
     
     return render_template('enquiry.html')
@@ -312,29 +319,35 @@ def enquiry_confirmation():
 @app.route('/checkout')
 def checkout():
     """Checkout page (demo only - no payment processing)"""
-    cart = get_cart()
-    if not cart:
+    if not get_cart():
         flash('Your cart is empty', 'warning')
         return redirect(url_for('cart'))
     
-    cart_items = []
-    for product_id, quantity in cart.items():
-        product = next((p for p in PRODUCTS if p['id'] == int(product_id)), None)
-        if product:
-            cart_items.append({
-                'product': product,
-                'quantity': quantity,
-                'subtotal': product['price'] * quantity
-            })
+    with phase('catalog'):
+        summary = get_cart_summary()
     
-    total = get_cart_total()
+    # Sell every line or none; the cart is kept if anything ran out
+    short = get_inventory().commit(cart_holder(), {line.product.id: line.quantity for line in summary})
+    if short:
+        names = ', '.join(get_product(product_id).name for product_id in short)
+        flash(f'Sorry, not enough stock left for: {names}. Please update your cart.', 'error')
+        return redirect(url_for('cart'))
+    
+    order = record_order(summary)
+    get_recommender().record(line.product.id for line in summary)
     
     # Clear the cart after checkout
-    session['cart'] = {}
+    save_cart({})
     flash('Thank you for your order! Your cart has been cleared.', 'success')
     
-    return render_template('checkout.html', cart_items=cart_items, total=total)
+    return render_template('checkout.html', cart_items=summary.lines, total=summary.total, order=order)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
+    if sys.argv[1:2] == ['serve']:
+        # Production server: `python -m app serve --workers 4 --threads 8`. Start it in a fresh
+        # process that has not imported the app, so the app is loaded by import like any other
+        # module - once in the master, or in every worker with --no-preload
+        os.execv(sys.executable, [sys.executable, '-m', 'serve'] + sys.argv[2:])
+    else:
+        app.run(debug=True, port=5001)
 
@@ -0,0 +1,407 @@
+"""
+ASGI entry point for IKW Store.
+
+Run with any ASGI server, e.g.::
+
+    uvicorn asgi:application --workers 4
+
+The JSON catalog, cart, rating and enquiry endpoints (``/api/v1/...``) and
+the enquiry form submission are handled natively on the event loop: the
+request body is received asynchronously, the in-memory work (catalog
+lookups, validation, cart arithmetic) runs inline, and calls that touch
+SQLite (server-side sessions, the shared rating store) run in the default
+thread pool, so a slow client or a busy database never ties up a worker
+thread; enquiry submissions, which always append to the SQLite queue, run
+there too. Every other path is passed to the Flask WSGI app in a worker thread,
+with the response buffered before it is sent - except streamed responses
+(order exports, streamed product listings), which are sent chunk by chunk.
+
+Handlers reuse the Flask app's session interface, URL rules, rate limits and
+the request parsing and response-building helpers in ``api.py``, so both
+entry points behave identically. Flask's ``before_request`` hooks and the
+WSGI middleware do not run for them: the rate limit is checked by the
+handler, the per-process background threads (recommender, catalog watcher)
+are started for every request, and with ``INSTRUMENTATION`` on the request
+is counted and timed under its Flask endpoint - without phase timings or
+``X-Profile`` profiling, which only apply to requests served by Flask. A
+client that disconnects before its body has arrived gets no response.
+"""
+
+import asyncio
+import contextvars
+import io
+import sys
+import time
+
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from werkzeug.wrappers import Request
+
+from api import (APIError, add_to_cart, apply_cart_batch, build_enquiry, cart_json, json_object,
+                 parse_quantity, product_detail_json, products_page_json, rate_product, require_product,
+                 search_json, update_cart_line)
+from app import app
+from enquiries import submit_enquiry as queue_enquiry
+from inventory import SQLiteInventory
+from ratelimit import SQLiteTokenBucketLimiter, check_rate_limit
+from ratings import SQLiteRatingStore
+from shopping_cart import cart_holder
+from validation import validate_enquiry
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+def _json_response(data, status=200):
+    return app.response_class(app.json.dumps(data), status=status, mimetype='application/json')
+
+
+def _blocking_storage():
+    """True when sessions, ratings, rate limit buckets or stock are backed by SQLite rather than memory"""
+    interface = getattr(app.session_interface, 'wrapped', app.session_interface)  # Unwrap timing
+    return (not isinstance(interface, SecureCookieSessionInterface)
+            or isinstance(app.extensions['ratings'], SQLiteRatingStore)
+            or isinstance(app.extensions['ratelimit'], SQLiteTokenBucketLimiter)
+            or isinstance(app.extensions['inventory'], SQLiteInventory))
+
+
+async def _run(func, *args, **kwargs):
+    """Call ``func`` inline for in-memory storage, in a worker thread otherwise"""
+    if getattr(func, 'blocking', False) or _blocking_storage():
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
+def _with_session(handler):
+    """
+    Open the session, run ``handler(request, session, **args)`` and save the
+    session. A handler returning None defers the request to the WSGI app.
+    """
+    def run(request, **args):
+        with app.app_context():
+            session = app.session_interface.open_session(app, request)
+            try:
+                response = handler(request, session, **args)
+            except APIError as error:
+                response = _json_response({'error': error.message}, error.status)
+            if response is not None:
+                app.session_interface.save_session(app, session, response)
+            return response
+    return run
+
+
+def _rate_limited(endpoint):
+    """Apply the Flask endpoint's rate limit (Flask's before_request hooks do not run here)"""
+    def decorator(handler):
+        def limited(request, session, **args):
+            return check_rate_limit(endpoint, request, session) or handler(request, session, **args)
+        return limited
+    return decorator
+
+
+def _stateless(handler):
+    """Run ``handler(request, **args)`` inside an app context"""
+    def run(request, **args):
+        with app.app_context():
+            try:
+                return handler(request, **args)
+            except APIError as error:
+                return _json_response({'error': error.message}, error.status)
+    return run
+
+
+def _json_body(request):
+    return json_object(request.get_json(silent=True))
+
+
+@_stateless
+def list_products(request):
+    return _json_response(products_page_json(request.args))
+
+
+@_stateless
+def show_product(request, product_id):
+    return _json_response(product_detail_json(product_id))
+
+
+@_stateless
+def search_products(request):
+    return _json_response(search_json(request.args))
+
+
+@_with_session
+def show_cart(request, session):
+    return _json_response(cart_json(session.get('cart', {})))
+
+
+@_with_session
+def add_cart_item(request, session):
+    cart = session.get('cart', {})
+    add_to_cart(cart, _json_body(request), cart_holder(session))
+    session['cart'] = cart
+    return _json_response(cart_json(cart))
+
+
+@_with_session
+def update_cart_item(request, session, product_id):
+    require_product(product_id)
+    quantity = parse_quantity(_json_body(request).get('quantity'))
+    cart = session.get('cart', {})
+    update_cart_line(cart, product_id, quantity, cart_holder(session))
+    session['cart'] = cart
+    return _json_response(cart_json(cart))
+
+
+@_with_session
+def delete_cart_item(request, session, product_id):
+    cart = session.get('cart', {})
+    update_cart_line(cart, product_id, 0, cart_holder(session))
+    session['cart'] = cart
+    return _json_response(cart_json(cart))
+
+
+@_with_session
+def batch_update_cart(request, session):
+    cart = session.get('cart', {})
+    apply_cart_batch(cart, _json_body(request), cart_holder(session))
+    session['cart'] = cart
+    return _json_response(cart_json(cart))
+
+
+@_with_session
+@_rate_limited('api.rate')
+def rate(request, session, product_id):
+    return _json_response(rate_product(product_id, _json_body(request), session))
+
+
+def _writes_queue(handler):
+    """Mark a handler that always writes to SQLite (the enquiry queue)"""
+    handler.blocking = True
+    return handler
+
+
+@_writes_queue
+@_with_session
+@_rate_limited('api.submit_enquiry')
+def submit_enquiry(request, session):
+    record = build_enquiry(_json_body(request))
+    queue_enquiry(record)
+    session['enquiry_data'] = record
+    return _json_response({'enquiry': record}, 201)
+
+
+@_writes_queue
+@_with_session
+@_rate_limited('enquiry')
+def submit_enquiry_form(request, session):
+    """HTML enquiry form: redirect on success, let Flask render the errors otherwise"""
+    _, errors = validate_enquiry(request.form)
+    if errors:
+        return None
+    record = build_enquiry(request.form)
+    queue_enquiry(record)
+    session['enquiry_data'] = record
+    location = app.url_map.bind_to_environ(request.environ).build('enquiry_confirmation')
+    return app.response_class(status=302, headers={'Location': location})
+
+
+url_map = Map([
+    Rule('/api/v1/products', endpoint=list_products, methods=['GET']),
+    Rule('/api/v1/products/<int:product_id>', endpoint=show_product, methods=['GET']),
+    Rule('/api/v1/search', endpoint=search_products, methods=['GET']),
+    Rule('/api/v1/cart', endpoint=show_cart, methods=['GET']),
+    Rule('/api/v1/cart/items', endpoint=add_cart_item, methods=['POST']),
+    Rule('/api/v1/cart/items/<int:product_id>', endpoint=update_cart_item, methods=['PUT']),
+    Rule('/api/v1/cart/items/<int:product_id>', endpoint=delete_cart_item, methods=['DELETE']),
+    Rule('/api/v1/cart/batch', endpoint=batch_update_cart, methods=['POST']),
+    Rule('/api/v1/products/<int:product_id>/ratings', endpoint=rate, methods=['POST']),
+    Rule('/api/v1/enquiries', endpoint=submit_enquiry, methods=['POST']),
+    Rule('/enquiry', endpoint=submit_enquiry_form, methods=['POST']),
+])
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope and its (already received) body"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': (scope.get('client') or ('127.0.0.1', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """
+    Run the Flask WSGI app; returns (status, headers, body, stream). Bodies
+    with a Content-Length are read completely; streamed responses (exports,
+    ``stream_template``) come back unread as ``stream``, to be sent chunk by
+    chunk.
+    """
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    result = app(environ, start_response)
+    if not any(name.lower() == 'content-length' for name, _ in started['headers']):
+        return started['status'], started['headers'], b'', result
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started['status'], started['headers'], body, None
+
+
+async def _send_stream(send, status, headers, result, context):
+    """
+    Send a streamed WSGI body, producing each chunk in a worker thread.
+
+    Every chunk is produced in ``context``, the one the response was created
+    in: ``stream_with_context`` generators keep Flask's request context there.
+    """
+    loop = asyncio.get_running_loop()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers],
+    })
+    chunks = iter(result)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, context.run, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(None, context.run, result.close)
+
+
+class ClientDisconnected(Exception):
+    """The client went away before sending its whole request body"""
+
+
+async def _receive_body(receive):
+    """Read the whole request body; returns None if it exceeds MAX_BODY_BYTES"""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def _send(send, status, headers, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _start_background_work():
+    """Start this process's background threads, as Flask's before_request hooks do"""
+    for name in ('recommendations', 'catalog_watcher'):
+        worker = app.extensions.get(name)
+        if worker is not None:
+            worker.start()
+
+
+def _record_metrics(environ, status, elapsed):
+    """Count a natively handled request under its Flask endpoint (the WSGI middleware does the rest)"""
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint = 'unmatched'
+    app.extensions['instrumentation'].record(endpoint, environ['REQUEST_METHOD'], str(status), elapsed, {})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        raise RuntimeError(f'Unsupported ASGI scope type: {scope["type"]}')
+
+    try:
+        body = await _receive_body(receive)
+    except ClientDisconnected:
+        return  # Nobody to answer, and a truncated body must not be acted on
+    if body is None:
+        await _send(send, 413, [('Content-Type', 'application/json')],
+                    b'{"error": "Request body too large"}')
+        return
+    environ = build_environ(scope, body)
+
+    try:
+        handler, args = url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        handler = None
+
+    _start_background_work()
+    response = None
+    if handler is not None:
+        started = time.perf_counter()
+        response = await _run(handler, Request(environ), **args)
+        if response is not None and app.config['INSTRUMENTATION']:
+            _record_metrics(environ, response.status_code, time.perf_counter() - started)
+    if response is None:
+        environ['wsgi.input'].seek(0)
+        context = contextvars.copy_context()
+        status, headers, content, stream = await asyncio.get_running_loop().run_in_executor(
+            None, context.run, call_wsgi, environ)
+        if stream is not None:
+            await _send_stream(send, status, headers, stream, context)
+            return
+    else:
+        status, headers, content = response.status_code, response.headers.to_wsgi_list(), response.get_data()
+        if scope['method'] == 'HEAD':
+            content = b''
+    await _send(send, status, headers, content)
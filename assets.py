@@ -0,0 +1,199 @@
+"""
+Static asset pipeline for IKW Store.
+
+``flask --app app assets build`` walks ``static/``, content-hashes every
+file and writes a manifest plus optimised variants under ``static/build/``:
+
+- gzip (and brotli, when the ``brotli`` package is installed) copies of
+  text assets such as CSS and SVG
+- WebP copies and downscaled versions of raster images (PNG/JPEG), when
+  Pillow is installed
+
+At runtime ``url_for('static', ...)`` appends the content hash (``?v=...``)
+to every file in the manifest. Requests carrying the current hash are
+served with far-future immutable caching, from the brotli or gzip variant
+when the client accepts it. Templates offer the WebP variants through
+``static_srcset()`` in a ``<picture>`` element.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:  # Optional: only gzip variants are written without it
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # Optional: raster images are not re-encoded without it
+    Image = None
+
+BUILD_DIR = 'build'
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+RASTER_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+IMAGE_WIDTHS = (80, 160, 320)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def file_hash(path):
+    """Short content hash of a file"""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as target:
+        target.write(data)
+
+
+def _raster_variants(source_path, build_root, name):
+    """Write WebP and downscaled copies of a raster image; returns manifest fields"""
+    try:
+        image = Image.open(source_path)
+        image.load()
+    except (OSError, ValueError):
+        # Not actually a raster image (some .jpg files here are SVG)
+        return {}
+
+    stem, ext = os.path.splitext(name)
+    fields = {'width': image.width}
+    webp_name = f'{stem}.webp'
+    image.save(os.path.join(build_root, webp_name), 'WEBP', quality=85, method=6)
+    fields['webp'] = f'{BUILD_DIR}/{webp_name}'
+
+    sizes = {}
+    for width in IMAGE_WIDTHS:
+        if width >= image.width:
+            continue
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+        resized_name = f'{stem}.{width}w.webp'
+        resized.save(os.path.join(build_root, resized_name), 'WEBP', quality=85, method=6)
+        sizes[width] = f'{BUILD_DIR}/{resized_name}'
+    fields['sizes'] = sizes
+    return fields
+
+
+def build_assets(static_folder):
+    """Fingerprint and precompress everything under ``static_folder``; returns the manifest"""
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        if os.path.abspath(dirpath) == os.path.abspath(static_folder):
+            dirnames[:] = [d for d in dirnames if d != BUILD_DIR]
+        for filename in sorted(filenames):
+            source_path = os.path.join(dirpath, filename)
+            name = os.path.relpath(source_path, static_folder).replace(os.sep, '/')
+            entry = {'hash': file_hash(source_path)}
+            ext = os.path.splitext(filename)[1].lower()
+
+            if ext in COMPRESSIBLE_EXTENSIONS:
+                with open(source_path, 'rb') as source:
+                    data = source.read()
+                _write(os.path.join(build_root, name + '.gz'), gzip.compress(data, 9, mtime=0))
+                entry['gzip'] = f'{BUILD_DIR}/{name}.gz'
+                if brotli is not None:
+                    _write(os.path.join(build_root, name + '.br'), brotli.compress(data, quality=11))
+                    entry['br'] = f'{BUILD_DIR}/{name}.br'
+            elif ext in RASTER_EXTENSIONS and Image is not None:
+                os.makedirs(os.path.dirname(os.path.join(build_root, name)), exist_ok=True)
+                entry.update(_raster_variants(source_path, build_root, name))
+
+            manifest[name] = entry
+
+    _write(os.path.join(build_root, MANIFEST_NAME),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest(static_folder):
+    """Read the asset manifest, or return an empty one if assets were never built"""
+    try:
+        with open(os.path.join(static_folder, BUILD_DIR, MANIFEST_NAME)) as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        return {}
+
+
+def static_srcset(filename):
+    """``srcset`` value listing the WebP variants of an image, or '' if none were built"""
+    entry = current_app.extensions['assets'].get(filename, {})
+    if 'webp' not in entry:
+        return ''
+    candidates = [(int(width), path) for width, path in entry.get('sizes', {}).items()]
+    candidates.append((entry['width'], entry['webp']))
+    return ', '.join(f'{url_for("static", filename=path, v=entry["hash"])} {width}w'
+                     for width, path in sorted(candidates))
+
+
+def serve_static(filename):
+    """Static handler serving fingerprinted requests from optimised variants"""
+    app = current_app
+    entry = app.extensions['assets'].get(filename)
+    if entry is None or request.args.get('v') != entry['hash']:
+        return app.send_static_file(filename)
+
+    path, encoding, mimetype = filename, None, None
+    if entry.get('br') and request.accept_encodings['br']:
+        path, encoding = entry['br'], 'br'
+    elif entry.get('gzip') and request.accept_encodings['gzip']:
+        path, encoding = entry['gzip'], 'gzip'
+    if encoding:
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    response = send_from_directory(app.static_folder, path, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Disposition', None)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@click.group('assets')
+def assets_cli():
+    """Static asset pipeline"""
+
+
+@assets_cli.command('build')
+@with_appcontext
+def build_command():
+    """Fingerprint and precompress files under static/"""
+    manifest = build_assets(current_app.static_folder)
+    current_app.extensions['assets'] = manifest
+    variants = sum(len([k for k in entry if k in ('gzip', 'br', 'webp')]) + len(entry.get('sizes', {}))
+                   for entry in manifest.values())
+    click.echo(f'Fingerprinted {len(manifest)} files, wrote {variants} variants to '
+               f'{os.path.join(current_app.static_folder, BUILD_DIR)}')
+    if brotli is None:
+        click.echo('brotli not installed - skipped .br variants')
+    if Image is None:
+        click.echo('Pillow not installed - skipped WebP/resized images')
+
+
+def init_assets(app):
+    """Load the manifest and hook fingerprinted URLs and serving into ``app``"""
+    app.extensions['assets'] = load_manifest(app.static_folder)
+    app.view_functions['static'] = serve_static
+    app.cli.add_command(assets_cli)
+    app.jinja_env.globals['static_srcset'] = static_srcset
+
+    @app.url_defaults
+    def add_asset_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            entry = app.extensions['assets'].get(values.get('filename'))
+            if entry is not None:
+                values['v'] = entry['hash']
@@ -0,0 +1,192 @@
+"""
+Load test: threaded WSGI server vs the ASGI entry point.
+
+Starts the app under Werkzeug's threaded server (what ``app.run`` uses) and
+under uvicorn (``asgi:application``, skipped if uvicorn is not installed),
+each in its own process with its order log and enquiry queue in a
+temporary directory, then drives both with the same asyncio client: N
+concurrent virtual users, each with its own session cookie, looping over
+catalog listing, add-to-cart, view-cart and rating requests. Reports
+throughput and latency percentiles per concurrency level.
+
+Usage:
+    python benchmarks/bench_asgi.py [--concurrency 10,100,500] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+JOURNEY = (
+    ('GET', '/api/v1/products?limit=20', None),
+    ('POST', '/api/v1/cart/items', {'product_id': 1}),
+    ('GET', '/api/v1/cart', None),
+    ('POST', '/api/v1/products/2/ratings', {'rating': 4}),
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(server, port):
+    """Run one server in this process (used by the child processes)"""
+    if server == 'wsgi':
+        from werkzeug.serving import run_simple
+        from app import app
+        run_simple('127.0.0.1', port, app, threaded=True)
+    else:
+        import uvicorn
+        uvicorn.run('asgi:application', host='127.0.0.1', port=port, log_level='warning')
+
+
+def start_server(server, port, directory):
+    """Start a server whose order log and enquiry queue live in ``directory``"""
+    env = dict(os.environ, ORDER_LOG=os.path.join(directory, 'orders.jsonl'),
+               ENQUIRY_QUEUE=os.path.join(directory, 'enquiries.db'))
+    process = subprocess.Popen([sys.executable, __file__, '--serve', server, '--port', str(port)],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{server} server did not start')
+
+
+class Connection:
+    """Minimal HTTP/1.1 client connection with keep-alive and a cookie"""
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+        self.cookie = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = [f'{method} {path} HTTP/1.1', 'Host: 127.0.0.1', f'Content-Length: {len(body)}']
+        if payload is not None:
+            head.append('Content-Type: application/json')
+        if self.cookie:
+            head.append(f'Cookie: {self.cookie}')
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        version, status = status_line.split()[:2]
+        length, keep_alive = None, version == b'HTTP/1.1'
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection':
+                keep_alive = value.lower() == 'keep-alive'
+            elif name == 'set-cookie':
+                self.cookie = value.split(';', 1)[0]
+        if length is None:
+            await self.reader.read()
+            keep_alive = False
+        else:
+            await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return int(status)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def virtual_user(port, deadline, latencies, errors):
+    connection = Connection(port)
+    step = random.randrange(len(JOURNEY))
+    while time.perf_counter() < deadline:
+        method, path, payload = JOURNEY[step % len(JOURNEY)]
+        step += 1
+        start = time.perf_counter()
+        try:
+            status = await connection.request(method, path, payload)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            connection.close()
+            errors.append(1)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        if status >= 400:
+            errors.append(status)
+    connection.close()
+
+
+async def run_load(port, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(virtual_user(port, deadline, latencies, errors) for _ in range(concurrency)))
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', default='10,100,500', help='comma-separated virtual user counts')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per measurement')
+    parser.add_argument('--serve', choices=('wsgi', 'asgi'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    servers = ['wsgi']
+    try:
+        import uvicorn  # noqa: F401
+        servers.append('asgi')
+    except ImportError:
+        print('uvicorn not installed - measuring the WSGI server only (pip install uvicorn)\n')
+
+    print(f'{"server":>6} {"users":>6} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for server in servers:
+        port = free_port()
+        scratch = tempfile.TemporaryDirectory(prefix='bench-asgi-')
+        process = start_server(server, port, scratch.name)
+        try:
+            for concurrency in (int(c) for c in args.concurrency.split(',')):
+                latencies, errors = asyncio.run(run_load(port, concurrency, args.duration))
+                latencies.sort()
+                print(f'{server:>6} {concurrency:>6} {len(latencies) / args.duration:>9.1f} '
+                      f'{percentile(latencies, 0.50):>8.2f} {percentile(latencies, 0.95):>8.2f} '
+                      f'{percentile(latencies, 0.99):>8.2f} {len(errors):>7}')
+        finally:
+            process.terminate()
+            process.wait()
+            scratch.cleanup()
+
+
+if __name__ == '__main__':
+    main()
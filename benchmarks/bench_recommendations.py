@@ -0,0 +1,79 @@
+"""
+Benchmark: "customers also bought" model at catalog scale.
+
+Generates orders over ``--products`` products with Zipf-like popularity
+(a few best-sellers, a long tail) and measures:
+
+    rebuild      full recompute of co-occurrence counts and every top-k row
+    incremental  applying a batch of new orders to the built model
+    lookup       recommend() for one product and for_basket() for a cart
+
+Lookups read the precomputed top-k table, so their cost stays flat as the
+catalog and order history grow.
+
+Usage:
+    python benchmarks/bench_recommendations.py [--products 100000] [--orders 200000] [--batch 1000]
+"""
+
+import argparse
+from itertools import accumulate
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recommendations import Recommender  # noqa: E402
+
+
+def make_orders(products, orders, seed=1):
+    """``orders`` lists of 2-6 product ids, popularity ~ 1 / rank"""
+    rng = random.Random(seed)
+    ids = list(range(1, products + 1))
+    rng.shuffle(ids)
+    weights = list(accumulate(1 / rank for rank in range(1, products + 1)))
+    return [rng.choices(ids, cum_weights=weights, k=rng.randint(2, 6)) for _ in range(orders)]
+
+
+def per_call_us(function, arguments):
+    start = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    return (time.perf_counter() - start) / len(arguments) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000, help='catalog size')
+    parser.add_argument('--orders', type=int, default=200000, help='orders in the history')
+    parser.add_argument('--batch', type=int, default=1000, help='new orders per incremental update')
+    parser.add_argument('--k', type=int, default=8, help='recommendations kept per product')
+    args = parser.parse_args()
+
+    orders = make_orders(args.products, args.orders + args.batch)
+    history, new = orders[:args.orders], orders[args.orders:]
+    recommender = Recommender(k=args.k, interval=None)
+
+    start = time.perf_counter()
+    rows = recommender.rebuild(history)
+    rebuild = time.perf_counter() - start
+    pairs = sum(len(row) for row in recommender._pairs.values())
+    print(f'rebuild      {args.orders} orders, {rows} products, {pairs} pairs: {rebuild:.2f} s')
+
+    recommender.interval = 5.0  # Queue only, like the background thread
+    for order in new:
+        recommender.record(order)
+    start = time.perf_counter()
+    rows = recommender.update()
+    print(f'incremental  {args.batch} orders, {rows} rows refreshed: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    rng = random.Random(2)
+    products = [rng.randint(1, args.products) for _ in range(100000)]
+    carts = [rng.sample(range(1, args.products + 1), 3) for _ in range(20000)]
+    print(f'lookup       recommend: {per_call_us(recommender.recommend, products):.2f} us, '
+          f'3-line cart: {per_call_us(recommender.for_basket, carts):.2f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: signed-cookie sessions vs server-side SQLite sessions.
+
+Fills the cart with 1, 50 and 500 lines and measures the latency of
+``GET /cart`` under each session interface, along with the size of the
+session cookie the browser has to send.
+
+Usage:
+    python benchmarks/bench_sessions.py [--requests 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+
+from app import app  # noqa: E402
+from catalog import Catalog, install_catalog  # noqa: E402
+from sessions import ServerSideSessionInterface, SQLiteSessionStore  # noqa: E402
+
+CART_SIZES = (1, 50, 500)
+
+
+def synthetic_catalog(size):
+    """Catalog large enough to hold the biggest cart"""
+    return Catalog({'id': i, 'name': f'Product {i}', 'description': f'Synthetic product {i}',
+                    'price': 1000 + i, 'image': 'placeholder.svg'} for i in range(1, size + 1))
+
+
+def measure(interface, cart_size, requests):
+    """Return (median ms, p95 ms, cookie bytes) for GET /cart"""
+    app.session_interface = interface
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['cart'] = {str(i): 1 for i in range(1, cart_size + 1)}
+        cookie = client.get_cookie('session')
+        client.get('/cart')  # Warm up
+
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            client.get('/cart')
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1], len(cookie.value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='requests per measurement')
+    args = parser.parse_args()
+
+    app.config['TESTING'] = True
+    install_catalog(app, synthetic_catalog(max(CART_SIZES)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        interfaces = {
+            'cookie': SecureCookieSessionInterface(),
+            'sqlite': ServerSideSessionInterface(SQLiteSessionStore(os.path.join(tmp, 'sessions.db'))),
+        }
+        print(f'{"cart lines":>10} {"session":>8} {"median ms":>10} {"p95 ms":>8} {"cookie B":>9}')
+        for cart_size in CART_SIZES:
+            for name, interface in interfaces.items():
+                median, p95, cookie = measure(interface, cart_size, args.requests)
+                print(f'{cart_size:>10} {name:>8} {median:>10.3f} {p95:>8.3f} {cookie:>9}')
+    print('\nNote: browsers reject cookies over 4096 bytes; server-side sessions stay constant size.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+Load generator: weighted user journeys against a locally started server.
+
+Each virtual user keeps its own cookie jar (so its cart, ratings and flash
+messages live in its own session) and loops over journeys picked by weight:
+
+    browse 40%   home, product list, product list again
+    search 25%   two product searches
+    shop   20%   product list, add two products, view cart
+    rate   10%   product list, rate a product
+    checkout 5%  add a product, view cart, check out
+
+For each concurrency level the report gives throughput, p50/p95/p99
+latency and the error rate (``--detail`` adds a per-step breakdown), so
+deployments can be sized from one machine. The server is started in a
+child process: ``wsgi`` (Werkzeug threaded, as ``python app.py``),
+``gunicorn`` (``python -m app serve``) or ``asgi`` (uvicorn), with its
+order log, enquiry queue and stock in a temporary directory, or use
+``--url`` to target one that is already running.
+
+Usage:
+    python benchmarks/loadgen.py [--server gunicorn --workers 4] [--concurrency 1,10,50,100]
+                                 [--duration 10] [--think-ms 0] [--json report.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRODUCT_IDS = range(1, 21)
+SEARCH_TERMS = ('mouse', 'usb', 'keyboard', 'monitor', 'wireless', 'laptop stand', 'cable', 'dock')
+
+
+def browse(user):
+    yield 'home', 'GET', '/', None
+    yield 'products', 'GET', '/products', None
+    yield 'products', 'GET', '/products', None
+
+
+def search(user):
+    for term in random.sample(SEARCH_TERMS, 2):
+        yield 'search', 'GET', '/products?' + urlencode({'search': term}), None
+
+
+def shop(user):
+    yield 'products', 'GET', '/products', None
+    for product_id in random.sample(PRODUCT_IDS, 2):
+        yield 'add_to_cart', 'GET', f'/add_to_cart/{product_id}', None
+    yield 'cart', 'GET', '/cart', None
+
+
+def rate(user):
+    yield 'products', 'GET', '/products', None
+    yield 'rate', 'POST', f'/rate_product/{random.choice(PRODUCT_IDS)}', {'rating': random.randint(1, 5)}
+
+
+def checkout(user):
+    yield 'add_to_cart', 'GET', f'/add_to_cart/{random.choice(PRODUCT_IDS)}', None
+    yield 'cart', 'GET', '/cart', None
+    yield 'checkout', 'GET', '/checkout', None
+
+
+JOURNEYS = ((browse, 40), (search, 25), (shop, 20), (rate, 10), (checkout, 5))
+
+
+class HTTPClient:
+    """Minimal asyncio HTTP/1.1 client with keep-alive and a cookie jar"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+        self.reader = self.writer = None
+
+    async def request(self, method, path, json_body=None, form=None):
+        """Send one request; returns the status code (the body is read and discarded)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body, content_type = b'', None
+        if json_body is not None:
+            body, content_type = json.dumps(json_body).encode(), 'application/json'
+        elif form is not None:
+            body, content_type = urlencode(form).encode(), 'application/x-www-form-urlencoded'
+        head = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                f'Content-Length: {len(body)}', 'Accept-Encoding: identity']
+        if content_type:
+            head.append(f'Content-Type: {content_type}')
+        if self.cookies:
+            head.append('Cookie: ' + '; '.join(f'{k}={v}' for k, v in self.cookies.items()))
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        version, status = status_line.split()[:2]
+        length, keep_alive = None, version == b'HTTP/1.1'
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection':
+                keep_alive = value.lower() == 'keep-alive'
+            elif name == 'set-cookie':
+                cookie, _, attributes = value.partition(';')
+                cookie_name, _, cookie_value = cookie.partition('=')
+                if 'expires=thu, 01 jan 1970' in attributes.lower() or 'max-age=0' in attributes.lower():
+                    self.cookies.pop(cookie_name.strip(), None)
+                else:
+                    self.cookies[cookie_name.strip()] = cookie_value.strip()
+        if method == 'HEAD' or int(status) in (204, 304):
+            length = 0
+        if length is None:
+            await self.reader.read()
+            keep_alive = False
+        else:
+            await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return int(status)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def virtual_user(host, port, deadline, think, samples, warmup_end):
+    """Run journeys until ``deadline``, appending (step, seconds, ok) to ``samples``"""
+    client = HTTPClient(host, port)
+    journeys, weights = zip(*JOURNEYS)
+    while time.perf_counter() < deadline:
+        journey = random.choices(journeys, weights)[0]
+        for step, method, path, form in journey(client):
+            if time.perf_counter() >= deadline:
+                break
+            start = time.perf_counter()
+            try:
+                status = await client.request(method, path, form=form)
+                ok = status < 400
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+                client.close()
+                ok = False
+            if start >= warmup_end:
+                samples.append((step, time.perf_counter() - start, ok))
+            if think:
+                await asyncio.sleep(random.expovariate(1.0 / think))
+    client.close()
+
+
+async def run_level(host, port, concurrency, duration, warmup, think):
+    samples = []
+    start = time.perf_counter()
+    warmup_end, deadline = start + warmup, start + warmup + duration
+    await asyncio.gather(*(virtual_user(host, port, deadline, think, samples, warmup_end)
+                           for _ in range(concurrency)))
+    return samples
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(samples, duration):
+    latencies = sorted(seconds for _, seconds, _ in samples)
+    errors = sum(1 for _, _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'throughput': len(samples) / duration,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'error_rate': errors / len(samples) if samples else 0.0,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(server, port, workers, threads):
+    if server == 'wsgi':
+        return [sys.executable, '-c', 'from werkzeug.serving import run_simple; from app import app; '
+                f'run_simple("127.0.0.1", {port}, app, threaded=True)']
+    if server == 'gunicorn':
+        return [sys.executable, '-m', 'app', 'serve', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(workers), '--threads', str(threads), '--config', 'development']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+            '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+
+
+def scratch_env(directory):
+    """Server environment keeping its orders, enquiries and stock in ``directory``, not ``instance/``"""
+    return dict(os.environ,
+                SECRET_KEY=os.environ.get('SECRET_KEY') or secrets.token_hex(16),
+                ORDER_LOG=os.path.join(directory, 'orders.jsonl'),
+                ENQUIRY_QUEUE=os.path.join(directory, 'enquiries.db'),
+                INVENTORY_STORE='sqlite:///' + os.path.join(directory, 'inventory.db'))
+
+
+def start_server(command, port, env=None):
+    """Start a server process and wait until it accepts connections"""
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with code {process.returncode}: {" ".join(command)}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--server', choices=('wsgi', 'gunicorn', 'asgi'), default='wsgi',
+                        help='server to start locally (default: wsgi)')
+    parser.add_argument('--url', help='target an already running server instead, e.g. http://127.0.0.1:5001')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='server worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--concurrency', default='1,10,50,100', help='comma-separated virtual user counts')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each level')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='mean think time between steps')
+    parser.add_argument('--detail', action='store_true', help='print a per-step breakdown')
+    parser.add_argument('--json', metavar='FILE', help='also write the report as JSON')
+    args = parser.parse_args()
+
+    process = scratch = None
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        scratch = tempfile.TemporaryDirectory(prefix='loadgen-')
+        process = start_server(server_command(args.server, port, args.workers, args.threads), port,
+                               scratch_env(scratch.name))
+
+    report = {'server': args.url or args.server, 'workers': args.workers, 'levels': []}
+    print(f'Target: {report["server"]} ({host}:{port})')
+    print(f'{"users":>6} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            samples = asyncio.run(run_level(host, port, concurrency, args.duration, args.warmup,
+                                            args.think_ms / 1000))
+            level = dict(summarize(samples, args.duration), users=concurrency)
+            steps = {}
+            for step, seconds, ok in samples:
+                steps.setdefault(step, []).append((step, seconds, ok))
+            level['steps'] = {step: summarize(step_samples, args.duration) for step, step_samples in steps.items()}
+            report['levels'].append(level)
+            print(f'{concurrency:>6} {level["throughput"]:>9.1f} {level["p50_ms"]:>8.2f} '
+                  f'{level["p95_ms"]:>8.2f} {level["p99_ms"]:>8.2f} {level["error_rate"]:>7.2%}')
+            if args.detail:
+                for step, stats in sorted(level['steps'].items()):
+                    print(f'{"":>6}   {step:<12} {stats["throughput"]:>7.1f}/s p50 {stats["p50_ms"]:.2f} '
+                          f'p95 {stats["p95_ms"]:.2f} p99 {stats["p99_ms"]:.2f} errors {stats["error_rate"]:.2%}')
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            scratch.cleanup()
+
+    if args.json:
+        with open(args.json, 'w') as target:
+            json.dump(report, target, indent=2)
+        print(f'Report written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Cart page and checkout benchmarks at 1, 50 and 500 cart lines"""
+
+import pytest
+
+from app import app
+from catalog import Catalog, install_catalog
+from conftest import synthetic_products
+from orders import OrderLog
+from recommendations import Recommender
+
+CART_LINES = (1, 50, 500)
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    original = app.extensions['catalog']
+    install_catalog(app, Catalog(synthetic_products(max(CART_LINES)), version=original.version + 1))
+    # Checkouts go to a throwaway order log and recommender, not the real ones
+    extensions = {name: app.extensions[name] for name in ('orders', 'recommendations')}
+    app.extensions['orders'] = OrderLog(str(tmp_path_factory.mktemp('orders') / 'orders.jsonl'))
+    app.extensions['recommendations'] = Recommender()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+    install_catalog(app, original)
+    app.extensions.update(extensions)
+
+
+def fill_cart(client, lines):
+    with client.session_transaction() as session:
+        session['cart'] = {str(product_id): 2 for product_id in range(1, lines + 1)}
+        session.pop('_flashes', None)
+
+
+@pytest.mark.parametrize('lines', CART_LINES, ids=[f'{n}lines' for n in CART_LINES])
+def test_cart_page(bench, client, lines):
+    """Render the cart page"""
+    fill_cart(client, lines)
+    response = bench(client.get, '/cart')
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('lines', CART_LINES, ids=[f'{n}lines' for n in CART_LINES])
+def test_api_cart(bench, client, lines):
+    """Cart lines and totals through the JSON API"""
+    fill_cart(client, lines)
+    assert bench(client.get, '/api/v1/cart').status_code == 200
+
+
+@pytest.mark.parametrize('lines', CART_LINES, ids=[f'{n}lines' for n in CART_LINES])
+def test_checkout(bench, client, lines):
+    """Checkout (order summary render and cart reset)"""
+    response = bench(client.get, '/checkout', setup=lambda: fill_cart(client, lines))
+    assert response.status_code == 200
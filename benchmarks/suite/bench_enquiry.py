@@ -0,0 +1,40 @@
+"""Enquiry validation and submission benchmarks"""
+
+import pytest
+
+from app import app
+from enquiries import EnquiryProcessor, SQLiteEnquiryQueue
+from validation import validate_enquiry
+
+BENIGN = {
+    'name': 'Ann Example',
+    'email': 'ann@example.com',
+    'subject': 'Delivery to Osaka',
+    'message': ('Hello, I would like to ask about the wireless mouse and whether it ships '
+                'to Osaka before the end of the month. Thanks! ') * 15,
+}
+HOSTILE = dict(BENIGN, message=BENIGN['message'][:1500] + '<img src=x onerror="alert(1)">',
+               subject="x' OR 1=1 --")
+
+
+@pytest.fixture
+def client(tmp_path):
+    original = app.extensions['enquiries']
+    app.extensions['enquiries'] = EnquiryProcessor(SQLiteEnquiryQueue(str(tmp_path / 'queue.db')),
+                                                   handler=lambda record: None)
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+    app.extensions['enquiries'] = original
+
+
+@pytest.mark.parametrize('form', [BENIGN, HOSTILE], ids=['benign', 'hostile'])
+def test_validate_enquiry(bench, form):
+    """Required, length, email and security checks on all four fields"""
+    bench(validate_enquiry, form)
+
+
+def test_enquiry_submission(bench, client):
+    """POST /enquiry: validation, sanitizing and the durable queue append"""
+    response = bench(client.post, '/enquiry', data=BENIGN)
+    assert response.status_code == 302
@@ -0,0 +1,63 @@
+"""Catalog page benchmarks over synthetic catalogs of 20, 10k and 100k products"""
+
+from urllib.parse import quote
+
+import pytest
+
+from app import FRAGMENT_CACHE, PRODUCT_RATINGS
+from listing import encode_cursor, ordered_products
+
+
+@pytest.fixture(scope='module')
+def client(app_with_catalog):
+    with app_with_catalog.test_client() as client:
+        yield client
+
+
+def test_products_page_cold(bench, client):
+    """Full product grid render with an empty fragment cache"""
+    response = bench(client.get, '/products', setup=FRAGMENT_CACHE.clear)
+    assert response.status_code == 200
+
+
+def test_products_page_cached(bench, client):
+    """Product list served from the page cache"""
+    assert bench(client.get, '/products').status_code == 200
+
+
+def test_products_sorted_cold(bench, client):
+    """First page sorted by price (presorted index), nothing cached"""
+    response = bench(client.get, '/products?sort=price', setup=FRAGMENT_CACHE.clear)
+    assert response.status_code == 200
+
+
+def test_products_deep_page_cold(bench, client, app_with_catalog):
+    """A page from the middle of the price order via its cursor, nothing cached"""
+    _, keys = ordered_products(app_with_catalog.extensions['catalog'], PRODUCT_RATINGS, 'price')
+    cursor = quote(encode_cursor('price', keys[len(keys) // 2]))
+    response = bench(client.get, f'/products?sort=price&cursor={cursor}', setup=FRAGMENT_CACHE.clear)
+    assert response.status_code == 200
+
+
+def test_products_search_cold(bench, client):
+    """Search plus render of the matching cards, nothing cached"""
+    response = bench(client.get, '/products?search=wireless+mouse', setup=FRAGMENT_CACHE.clear)
+    assert response.status_code == 200
+
+
+def test_products_search_cached(bench, client):
+    """Repeated search served from the page cache"""
+    assert bench(client.get, '/products?search=wireless+mouse').status_code == 200
+
+
+def test_products_not_modified(bench, client):
+    """Revalidation of an unchanged product list (304)"""
+    etag = client.get('/products').headers['ETag']
+    response = bench(client.get, '/products', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_api_search(bench, client):
+    """Ranked index search through the JSON API (first page)"""
+    response = bench(client.get, '/api/v1/search?q=usb+cable&limit=20')
+    assert response.status_code == 200
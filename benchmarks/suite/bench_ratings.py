@@ -0,0 +1,58 @@
+"""Rating burst benchmarks"""
+
+import pytest
+
+from app import app
+from ratelimit import TokenBucketLimiter
+from ratings import RatingStore
+
+BURST = 100
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def test_rating_store_burst(bench):
+    """1000 votes recorded directly in the in-memory aggregate store"""
+    store = RatingStore()
+
+    def burst():
+        for vote in range(1000):
+            store.add(vote % 20 + 1, vote % 5 + 1)
+    bench(burst)
+
+
+def test_rating_form_burst(bench):
+    """A visitor posting the rating form 100 times"""
+    def burst():
+        with app.test_client() as client:
+            for vote in range(BURST):
+                client.post(f'/rate_product/{vote % 20 + 1}', data={'rating': str(vote % 5 + 1)})
+    app.config['TESTING'] = True
+    bench(burst)
+
+
+def test_rating_api_burst(bench, client):
+    """100 ratings through the JSON API"""
+    def burst():
+        for vote in range(BURST):
+            client.post(f'/api/v1/products/{vote % 20 + 1}/ratings', json={'rating': vote % 5 + 1})
+    bench(burst)
+
+
+def test_rating_flood_rejected(bench, client, monkeypatch):
+    """A flood of rating posts over the rate limit (429 before the form is parsed)"""
+    monkeypatch.setitem(app.config, 'RATELIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'rate_product': (1, 3600.0)})
+    monkeypatch.setitem(app.extensions, 'ratelimit', TokenBucketLimiter())
+    client.post('/rate_product/1', data={'rating': '5'})  # Drains the bucket
+
+    def flood():
+        for _ in range(BURST):
+            client.post('/rate_product/1', data={'rating': '5'})
+    bench(flood)
+    assert client.post('/rate_product/1', data={'rating': '5'}).status_code == 429
@@ -0,0 +1,270 @@
+"""
+Benchmark suite fixtures.
+
+The ``bench`` fixture times a callable pytest-benchmark style: it calibrates
+the number of iterations per round, runs warm-up and timed rounds, and
+records the per-iteration time of each round. At the end of the session a
+summary table is printed and, with ``--bench-save FILE``, the samples are
+written as JSON. With ``--bench-compare FILE`` each benchmark is checked
+against that baseline with a one-sided Welch t-test and fails when it is
+both significantly (``--bench-alpha``) and materially
+(``--bench-threshold``, on the median) slower. Baselines are only
+meaningful on the machine, and under the load, they were recorded with.
+
+    python -m pytest benchmarks/suite --bench-save baseline.json
+    python -m pytest benchmarks/suite --bench-compare baseline.json
+"""
+
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from catalog import Catalog, install_catalog  # noqa: E402
+
+CATALOG_SIZES = (20, 10_000, 100_000)
+MIN_ROUND_TIME = 0.005  # Seconds; iterations per round are calibrated to at least this
+WORDS = ('wireless', 'mechanical', 'usb', 'portable', 'ergonomic', 'rgb', 'hd', 'aluminum',
+         'gaming', 'bluetooth', 'compact', 'braided', 'adjustable', 'noise-cancelling', 'dual')
+NOUNS = ('mouse', 'keyboard', 'hub', 'stand', 'webcam', 'headphones', 'drive', 'speaker',
+         'monitor', 'lamp', 'cable', 'dock', 'microphone', 'sleeve', 'pad')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('bench', 'IKW Store benchmarks')
+    group.addoption('--bench-save', metavar='FILE', help='write results to FILE as JSON')
+    group.addoption('--bench-compare', metavar='FILE', help='fail on regressions against a saved baseline')
+    group.addoption('--bench-threshold', type=float, default=0.20,
+                    help='minimum median slowdown treated as a regression (default: 0.20 = 20%%)')
+    group.addoption('--bench-alpha', type=float, default=0.01,
+                    help='significance level of the Welch t-test (default: 0.01)')
+    group.addoption('--bench-max-time', type=float, default=1.0,
+                    help='target seconds of timed rounds per benchmark (default: 1.0)')
+    group.addoption('--bench-sizes', default=','.join(map(str, CATALOG_SIZES)),
+                    help='comma-separated synthetic catalog sizes (default: 20,10000,100000)')
+
+
+def pytest_generate_tests(metafunc):
+    if 'catalog_size' in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption('--bench-sizes').split(',')]
+        metafunc.parametrize('catalog_size', sizes, ids=[f'{size}p' for size in sizes], scope='module')
+
+
+def _betacf(a, b, x):
+    """Continued fraction for the regularized incomplete beta function"""
+    tiny = 1e-300
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return h
+
+
+def _incomplete_beta(a, b, x):
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                     + a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def welch_slower_p_value(baseline, current):
+    """One-sided Welch t-test p-value for "current is slower than baseline" """
+    n1, n2 = len(baseline), len(current)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    m1, m2 = statistics.fmean(baseline), statistics.fmean(current)
+    v1, v2 = statistics.variance(baseline) / n1, statistics.variance(current) / n2
+    if v1 + v2 == 0:
+        return 0.0 if m2 > m1 else 1.0
+    t = (m2 - m1) / math.sqrt(v1 + v2)
+    df = (v1 + v2) ** 2 / ((v1 ** 2 / (n1 - 1) if v1 else 0) + (v2 ** 2 / (n2 - 1) if v2 else 0))
+    tail = 0.5 * _incomplete_beta(df / 2.0, 0.5, df / (df + t * t))
+    return tail if t > 0 else 1.0 - tail
+
+
+class BenchmarkSession:
+    """Results of every benchmark in the run, and the baseline they are compared with"""
+
+    def __init__(self, config):
+        self.config = config
+        self.results = {}
+        self.baseline = {}
+        compare = config.getoption('--bench-compare')
+        if compare:
+            with open(compare) as source:
+                self.baseline = json.load(source)['benchmarks']
+
+    def record(self, name, samples, iterations):
+        result = {
+            'samples': samples,
+            'iterations': iterations,
+            'min': min(samples),
+            'median': statistics.median(samples),
+            'mean': statistics.fmean(samples),
+            'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            'rounds': len(samples),
+        }
+        self.results[name] = result
+        reference = self.baseline.get(name)
+        if reference is not None:
+            change = result['median'] / reference['median'] - 1.0
+            p_value = welch_slower_p_value(reference['samples'], samples)
+            result['change'] = change
+            result['p_value'] = p_value
+            if change > self.config.getoption('--bench-threshold') and \
+                    p_value < self.config.getoption('--bench-alpha'):
+                pytest.fail(f'{name} regressed: median {_ms(reference["median"])} -> {_ms(result["median"])} '
+                            f'(+{change:.0%}, p={p_value:.2g})', pytrace=False)
+        return result
+
+    def save(self, path):
+        data = {
+            'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'processor': platform.processor(), 'cpus': os.cpu_count()},
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'benchmarks': self.results,
+        }
+        with open(path, 'w') as target:
+            json.dump(data, target, indent=1, sort_keys=True)
+
+
+def _ms(seconds):
+    return f'{seconds * 1000:.3f}ms'
+
+
+class Bench:
+    """Callable fixture: ``bench(func, *args, setup=None, **kwargs)`` times ``func(*args, **kwargs)``"""
+
+    def __init__(self, session, name, max_time):
+        self.session = session
+        self.name = name
+        self.max_time = max_time
+        self.result = None
+
+    def __call__(self, func, *args, setup=None, min_rounds=5, max_rounds=200, **kwargs):
+        if setup is not None:
+            # Per-call setup: one timed call per round, setup excluded
+            iterations = 1
+        else:
+            iterations = self._calibrate(func, args, kwargs)
+        samples = []
+        gc.collect()
+        budget_end = time.perf_counter() + self.max_time
+        for round_number in range(max_rounds):
+            if setup is not None:
+                setup()
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    value = func(*args, **kwargs)
+                elapsed = time.perf_counter() - start
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+            samples.append(elapsed / iterations)
+            if round_number + 1 >= min_rounds and time.perf_counter() >= budget_end:
+                break
+        self.result = self.session.record(self.name, samples, iterations)
+        return value
+
+    @staticmethod
+    def _calibrate(func, args, kwargs):
+        func(*args, **kwargs)  # Warm-up
+        iterations = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func(*args, **kwargs)
+            if time.perf_counter() - start >= MIN_ROUND_TIME or iterations >= 1 << 20:
+                return iterations
+            iterations *= 2
+
+
+@pytest.fixture(scope='session')
+def bench_session(request):
+    session = BenchmarkSession(request.config)
+    request.config._bench_session = session
+    return session
+
+
+@pytest.fixture
+def bench(bench_session, request):
+    """Time a callable and compare it with the baseline"""
+    return Bench(bench_session, request.node.nodeid.split('::', 1)[-1],
+                 request.config.getoption('--bench-max-time'))
+
+
+def synthetic_products(size):
+    """Deterministic product dicts with a searchable vocabulary"""
+    for index in range(1, size + 1):
+        adjective, noun = WORDS[index % len(WORDS)], NOUNS[(index // len(WORDS)) % len(NOUNS)]
+        yield {'id': index, 'name': f'{adjective.title()} {noun.title()} {index}',
+               'description': f'{adjective} {noun} with {WORDS[(index * 7) % len(WORDS)]} design, model {index}',
+               'price': 500 + (index * 37) % 20000, 'image': 'placeholder.svg'}
+
+
+@pytest.fixture(scope='module')
+def app_with_catalog(catalog_size):
+    """The app serving a synthetic catalog of ``catalog_size`` products"""
+    from app import app, FRAGMENT_CACHE
+    original = app.extensions['catalog']
+    install_catalog(app, Catalog(synthetic_products(catalog_size), version=original.version + 1))
+    app.config['TESTING'] = True
+    FRAGMENT_CACHE.clear()
+    yield app
+    install_catalog(app, original)
+    FRAGMENT_CACHE.clear()
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    session = getattr(config, '_bench_session', None)
+    if session is None or not session.results:
+        return
+    write = terminalreporter.write_line
+    terminalreporter.section('benchmarks')
+    compared = bool(session.baseline)
+    header = f'{"benchmark":<60} {"min":>11} {"median":>11} {"mean":>11} {"stdev":>10} {"rounds":>6}'
+    write(header + ('  change   p-value' if compared else ''))
+    for name, result in sorted(session.results.items()):
+        line = (f'{name[:60]:<60} {_ms(result["min"]):>11} {_ms(result["median"]):>11} '
+                f'{_ms(result["mean"]):>11} {_ms(result["stdev"]):>10} {result["rounds"]:>6}')
+        if 'change' in result:
+            line += f'  {result["change"]:+6.1%}  {result["p_value"]:8.2g}'
+        write(line)
+    path = config.getoption('--bench-save')
+    if path:
+        session.save(path)
+        write(f'Saved {len(session.results)} benchmarks to {path}')
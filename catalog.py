@@ -0,0 +1,122 @@
+"""
+Product catalog for IKW Store.
+
+Products are held in compact ``__slots__`` records and indexed by id in a
+hash map, so resolving a cart line or a rating target is O(1) regardless of
+catalog size. A full-text search index is built alongside the id index
+when the catalog loads, and sorted orderings (by price, name, ...) are
+built on first use and kept for the life of the snapshot.
+"""
+
+from flask import current_app
+
+from search import SearchIndex
+
+
+class Product:
+    """Immutable-by-convention product record"""
+
+    __slots__ = ('id', 'name', 'description', 'price', 'image')
+
+    def __init__(self, id, name, description, price, image):
+        self.id = int(id)
+        self.name = name
+        self.description = description
+        self.price = int(price)
+        self.image = image
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a product from a plain dict record"""
+        return cls(data['id'], data['name'], data.get('description', ''),
+                   data['price'], data.get('image', 'placeholder.svg'))
+
+    def to_dict(self):
+        """Return the product as a plain dict"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __getitem__(self, key):
+        # Allow dict-style access (product['price']) used by older call sites
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __eq__(self, other):
+        if not isinstance(other, Product):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'Product(id={self.id!r}, name={self.name!r}, price={self.price!r})'
+
+
+class Catalog:
+    """Ordered collection of products with an id -> product hash index"""
+
+    def __init__(self, products, version=1):
+        self._products = tuple(
+            p if isinstance(p, Product) else Product.from_dict(p) for p in products
+        )
+        self._by_id = {p.id: p for p in self._products}
+        self.search_index = SearchIndex(self._products)
+        self.version = version
+        self._sorted = {}  # order name -> (version, products, sort keys)
+
+    def get(self, product_id, default=None):
+        """Look up a product by id (int or numeric string) in O(1)"""
+        try:
+            return self._by_id.get(int(product_id), default)
+        except (TypeError, ValueError):
+            return default
+
+    def search(self, query, offset=0, limit=None):
+        """Return (ranked matching products, total matches) for ``query``"""
+        ids, total = self.search_index.search(query, offset, limit)
+        return [self._by_id[pid] for pid in ids], total
+
+    def sorted_index(self, name, key, version=None):
+        """
+        (products, ascending sort keys) ordered by ``key``.
+
+        Built once per snapshot, or again whenever ``version`` changes for
+        orderings that depend on data outside the catalog.
+        """
+        index = self._sorted.get(name)
+        if index is None or index[0] != version:
+            keyed = sorted((key(product), product) for product in self._products)
+            index = self._sorted[name] = (version, tuple(product for _, product in keyed),
+                                          [sort_key for sort_key, _ in keyed])
+        return index[1], index[2]
+
+    def __contains__(self, product_id):
+        return self.get(product_id) is not None
+
+    def __iter__(self):
+        return iter(self._products)
+
+    def __len__(self):
+        return len(self._products)
+
+    @property
+    def products(self):
+        """All products in catalog order"""
+        return self._products
+
+
+def install_catalog(app, catalog):
+    """Make ``catalog`` the snapshot served by ``app``"""
+    app.extensions['catalog'] = catalog
+
+
+def get_catalog():
+    """Return the catalog snapshot installed on the current app"""
+    return current_app.extensions['catalog']
+
+
+def get_product(product_id):
+    """Resolve a product id against the current catalog - the single lookup API"""
+    return get_catalog().get(product_id)
@@ -0,0 +1,243 @@
+"""
+Catalog loading from data files for IKW Store.
+
+``CATALOG_SOURCE`` points the app at a product file instead of the built-in
+``PRODUCTS`` list:
+
+- ``.csv`` with an ``id,name,description,price,image`` header
+- ``.jsonl`` / ``.ndjson`` with one product object per line
+- ``.db`` / ``.sqlite`` / ``.sqlite3`` with a ``products`` table of those columns
+
+An optional ``stock`` column (blank for unlimited) seeds the inventory:
+products it does not track yet start with that many units on hand.
+
+Records are read one at a time (a 100k-product file is never held in
+memory as text) and become an immutable ``Catalog`` snapshot with its id
+and search indexes built once. A watcher thread in each worker polls the
+file (every ``CATALOG_RELOAD_INTERVAL`` seconds, 0 to disable) and, once a
+change has settled for one interval, loads a new snapshot in the
+background and swaps it in with a single assignment under the next version
+number, so caches keyed on the version are invalidated and in-flight
+requests finish on the snapshot they started with. A file that fails to
+load is logged and the current snapshot stays in place. Replacing the file
+with an atomic rename is the safest way to publish a new catalog.
+
+    flask --app app catalog check products.csv
+"""
+
+import csv
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from catalog import Catalog, Product, get_catalog, install_catalog
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('id', 'name', 'description', 'price', 'image')
+
+
+def read_csv(path):
+    """Yield product records from a CSV file with a header row"""
+    with open(path, newline='', encoding='utf-8') as source:
+        yield from csv.DictReader(source)
+
+
+def read_jsonl(path):
+    """Yield product records from a JSON-lines file (blank lines are skipped)"""
+    with open(path, encoding='utf-8') as source:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_sqlite(path):
+    """Yield product records from the ``products`` table of a SQLite database"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        conn.row_factory = sqlite3.Row
+        available = {row['name'] for row in conn.execute('PRAGMA table_info(products)')}
+        columns = COLUMNS + (('stock',) if 'stock' in available else ())
+        for row in conn.execute(f'SELECT {", ".join(columns)} FROM products'):
+            yield dict(row)
+    finally:
+        conn.close()
+
+
+READERS = {
+    '.csv': read_csv,
+    '.jsonl': read_jsonl,
+    '.ndjson': read_jsonl,
+    '.db': read_sqlite,
+    '.sqlite': read_sqlite,
+    '.sqlite3': read_sqlite,
+}
+
+
+def _products(path, reader, stock):
+    seen = set()
+    for number, record in enumerate(reader(path), start=1):
+        try:
+            product = Product.from_dict(record)
+            if stock is not None and record.get('stock') not in (None, ''):
+                stock[product.id] = int(record['stock'])
+                if stock[product.id] < 0:
+                    raise ValueError('negative stock')
+        except (KeyError, TypeError, ValueError) as error:
+            raise ValueError(f'{path}: record {number}: invalid product ({error!r})') from None
+        if product.id in seen:
+            raise ValueError(f'{path}: record {number}: duplicate product id {product.id}')
+        seen.add(product.id)
+        yield product
+
+
+def load_catalog(path, version=1, stock=None):
+    """
+    Build a catalog snapshot from ``path``; raises ValueError on unknown formats or bad records.
+
+    The ``stock`` column, where given, is collected into the ``stock`` dict {product_id: on_hand}.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    reader = READERS.get(extension)
+    if reader is None:
+        raise ValueError(f'Unsupported catalog file type: {extension or path}')
+    return Catalog(_products(path, reader, stock), version=version)
+
+
+def _install(app, catalog, stock):
+    # Stock first, so a new product is never served without its stock level
+    inventory = app.extensions.get('inventory')
+    if stock and inventory is not None:
+        seeded = inventory.seed_stock(stock)
+        if seeded:
+            logger.info('Stock seeded for %d products from the catalog', seeded)
+    install_catalog(app, catalog)
+
+
+def source_stamp(path):
+    """Modification stamp of ``path`` (and a SQLite write-ahead log), or None if missing"""
+    stamp = []
+    for name in (path, path + '-wal'):
+        try:
+            info = os.stat(name)
+        except FileNotFoundError:
+            if name == path:
+                return None
+            continue
+        stamp.append((info.st_mtime_ns, info.st_size))
+    return tuple(stamp)
+
+
+class CatalogWatcher:
+    """Reload the app's catalog when its source file changes"""
+
+    def __init__(self, app, path, interval=2.0):
+        self.app = app
+        self.path = path
+        self.interval = interval
+        self.loaded_stamp = source_stamp(path)
+        self._seen_stamp = self.loaded_stamp
+        self._lock = threading.Lock()  # Guards start-up and reloads
+        self._pid = None
+        self.reloads = 0
+        self.failures = 0
+
+    def start(self):
+        """Start the polling thread (once per process; threads do not survive fork)"""
+        if self._pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='catalog-watcher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def check(self, settle=True):
+        """
+        Reload if the source changed; returns True if a new snapshot was installed.
+
+        With ``settle``, a change is only loaded once the stamp is unchanged
+        since the previous check, so a file still being written is not read.
+        """
+        stamp = source_stamp(self.path)
+        seen, self._seen_stamp = self._seen_stamp, stamp
+        if stamp is None or stamp == self.loaded_stamp or (settle and stamp != seen):
+            return False
+        return self.reload(stamp)
+
+    def reload(self, stamp=None):
+        """Load the source into a new snapshot and install it; returns True on success"""
+        with self._lock:
+            stamp = stamp or source_stamp(self.path)
+            current = self.app.extensions['catalog']
+            stock = {}
+            try:
+                catalog = load_catalog(self.path, version=current.version + 1, stock=stock)
+            except (OSError, ValueError, sqlite3.Error):
+                self.failures += 1
+                self.loaded_stamp = stamp  # Not retried until the file changes again
+                logger.exception('Catalog reload from %s failed; keeping version %s', self.path, current.version)
+                return False
+            _install(self.app, catalog, stock)
+            self.loaded_stamp = stamp
+            self.reloads += 1
+            logger.info('Catalog reloaded from %s: %d products (version %s)', self.path, len(catalog), catalog.version)
+            return True
+
+
+@click.group('catalog')
+def catalog_cli():
+    """Product catalog"""
+
+
+@catalog_cli.command('check')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def check_command(path):
+    """Load a catalog file and report what it contains"""
+    start = time.perf_counter()
+    stock = {}
+    try:
+        catalog = load_catalog(path, stock=stock)
+    except (ValueError, sqlite3.Error) as error:
+        raise click.ClickException(str(error))
+    click.echo(f'{len(catalog)} products loaded in {time.perf_counter() - start:.2f} s'
+               f' ({len(stock)} with a stock level)')
+
+
+@catalog_cli.command('status')
+@with_appcontext
+def status_command():
+    """Show the catalog snapshot being served"""
+    catalog = get_catalog()
+    source = current_app.config.get('CATALOG_SOURCE') or 'built-in PRODUCTS'
+    click.echo(f'{len(catalog)} products from {source} (version {catalog.version})')
+
+
+def init_catalog_source(app, path=None):
+    """Serve the catalog from ``path`` (if given), watched for changes, seeding stock; adds the CLI"""
+    app.cli.add_command(catalog_cli)
+    app.config.setdefault('CATALOG_SOURCE', path)
+    app.config.setdefault('CATALOG_RELOAD_INTERVAL', float(os.environ.get('CATALOG_RELOAD_INTERVAL', 2.0)))
+    if not app.config['CATALOG_SOURCE']:
+        return None
+    path = app.config['CATALOG_SOURCE']
+    # Stamped before loading, so a change made during the load is picked up
+    watcher = app.extensions['catalog_watcher'] = CatalogWatcher(app, path, app.config['CATALOG_RELOAD_INTERVAL'])
+    current = app.extensions.get('catalog')
+    stock = {}
+    catalog = load_catalog(path, version=current.version + 1 if current else 1, stock=stock)
+    _install(app, catalog, stock)
+    app.before_request(watcher.start)
+    return watcher
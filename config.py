@@ -0,0 +1,71 @@
+"""
+Configuration profiles for IKW Store.
+
+``APP_CONFIG=production`` selects ``ProductionConfig``, which requires
+``SECRET_KEY`` to come from the environment and only sends the session
+cookie over HTTPS; the default ``development`` profile keeps the local
+settings. The debugger is only ever enabled by ``python app.py``, never by
+the production server (``python -m app serve``).
+
+``PROXY_FIX_HOPS`` is the number of reverse proxies in front of the app
+whose ``X-Forwarded-For``/``X-Forwarded-Proto`` headers are trusted (one in
+production, none in development; ``PROXY_FIX_HOPS`` in the environment
+overrides it). Client IPs - and so rate limit buckets - come from there.
+"""
+
+import os
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+DEV_SECRET_KEY = 'your-secret-key-change-in-production'
+
+
+class Config:
+    """Settings shared by every profile"""
+    SECRET_KEY = DEV_SECRET_KEY
+    SESSION_COOKIE_HTTPONLY = True
+    SESSION_COOKIE_SAMESITE = 'Lax'
+    PRODUCTS_PER_PAGE = 24
+    STREAM_PRODUCT_LIST = False  # Flush product cards as they render (stream_template)
+    RATELIMIT_ENABLED = True  # Token buckets on rating and enquiry POSTs (ratelimit.py)
+    PROXY_FIX_HOPS = 0  # Trusted reverse proxies setting X-Forwarded-For/-Proto
+
+
+class DevelopmentConfig(Config):
+    """Local development over plain HTTP with a fixed secret key"""
+    SESSION_COOKIE_SECURE = False
+    RATELIMIT_ENABLED = False
+
+
+class ProductionConfig(Config):
+    """Multi-worker deployment behind a pre-fork server"""
+    SECRET_KEY = None  # Must come from the environment
+    SESSION_COOKIE_SECURE = True
+    PREFERRED_URL_SCHEME = 'https'
+    PROXY_FIX_HOPS = 1  # Served behind one reverse proxy (nginx, a load balancer)
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
+
+
+def load_config(app, name=None):
+    """Apply the named profile (default: ``APP_CONFIG`` or development) to ``app``"""
+    name = name or os.environ.get('APP_CONFIG', 'development')
+    try:
+        config = CONFIGS[name]
+    except KeyError:
+        raise ValueError(f'Unknown configuration profile: {name}')
+    app.config.from_object(config)
+    if os.environ.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+    if not app.config.get('SECRET_KEY'):
+        raise RuntimeError(f'SECRET_KEY must be set in the environment for the {name} profile')
+    if os.environ.get('PROXY_FIX_HOPS'):
+        app.config['PROXY_FIX_HOPS'] = int(os.environ['PROXY_FIX_HOPS'])
+    hops = app.config['PROXY_FIX_HOPS']
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+    return config
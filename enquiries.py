@@ -0,0 +1,308 @@
+"""
+Durable enquiry pipeline for IKW Store.
+
+A submitted enquiry is appended to a local SQLite queue and the request
+returns straight away; delivery (logging by default, or any handler set in
+``app.config['ENQUIRY_HANDLER']``) happens in a background worker pool:
+
+- workers claim pending enquiries in batches; a claim is a lease, so work
+  held by a crashed process is picked up again once the lease expires
+- a failed delivery is retried with exponential backoff and moved to the
+  dead-letter state after ``ENQUIRY_MAX_ATTEMPTS`` attempts
+- ``metrics()`` reports queue depth, dead letters and processing latency
+  (``flask --app app enquiries stats``)
+
+The queue file defaults to ``instance/enquiries.db`` (``ENQUIRY_QUEUE``).
+With ``ENQUIRY_WORKERS = 0`` no threads are started and enquiries wait for
+``flask --app app enquiries drain``.
+"""
+
+from collections import deque
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from sqlite_store import SQLiteDatabase
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+DEAD = 'dead'
+
+logger = logging.getLogger(__name__)
+
+
+def log_enquiry(record):
+    """Default delivery: write the enquiry to the application log"""
+    logger.info('Enquiry from %s <%s>: %s', record['name'], record['email'], record['subject'])
+
+
+class SQLiteEnquiryQueue:
+    """Append-only enquiry queue with leased claims, retries and dead letters"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS enquiries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            available_at REAL NOT NULL,
+            claimed_by TEXT,
+            processed_at REAL,
+            last_error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS enquiries_ready ON enquiries (status, available_at);
+    """
+
+    def __init__(self, path, lease=60.0):
+        self.path = path
+        self.lease = lease
+        self._db = SQLiteDatabase(path, self.SCHEMA)
+
+    def enqueue(self, record):
+        """Append an enquiry; returns its id"""
+        now = time.time()
+        return self._db.connect().execute(
+            'INSERT INTO enquiries (payload, status, enqueued_at, available_at) VALUES (?, ?, ?, ?)',
+            (json.dumps(record), PENDING, now, now)).lastrowid
+
+    def claim(self, limit, worker):
+        """Lease up to ``limit`` ready enquiries to ``worker``; returns [(id, record, attempts, enqueued_at)]"""
+        now = time.time()
+        conn = self._db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT id, payload, attempts, enqueued_at FROM enquiries '
+                'WHERE status IN (?, ?) AND available_at <= ? ORDER BY id LIMIT ?',
+                (PENDING, PROCESSING, now, limit)).fetchall()
+            conn.executemany(
+                'UPDATE enquiries SET status = ?, claimed_by = ?, available_at = ? WHERE id = ?',
+                [(PROCESSING, worker, now + self.lease, row[0]) for row in rows])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return [(row[0], json.loads(row[1]), row[2], row[3]) for row in rows]
+
+    def complete(self, ids):
+        """Mark delivered enquiries as done"""
+        now = time.time()
+        self._db.connect().executemany(
+            'UPDATE enquiries SET status = ?, processed_at = ?, claimed_by = NULL WHERE id = ?',
+            [(DONE, now, enquiry_id) for enquiry_id in ids])
+
+    def fail(self, enquiry_id, error, retry_at=None):
+        """Record a failed attempt; retry at ``retry_at`` or dead-letter when None"""
+        now = time.time()
+        self._db.connect().execute(
+            'UPDATE enquiries SET status = ?, attempts = attempts + 1, available_at = ?, '
+            'last_error = ?, claimed_by = NULL, processed_at = ? WHERE id = ?',
+            (PENDING if retry_at is not None else DEAD, retry_at if retry_at is not None else now,
+             error, None if retry_at is not None else now, enquiry_id))
+
+    def requeue_dead(self):
+        """Move every dead-lettered enquiry back to the queue; returns the count"""
+        return self._db.connect().execute(
+            'UPDATE enquiries SET status = ?, attempts = 0, available_at = ? WHERE status = ?',
+            (PENDING, time.time(), DEAD)).rowcount
+
+    def counts(self):
+        """Number of enquiries in each state"""
+        counts = dict.fromkeys((PENDING, PROCESSING, DONE, DEAD), 0)
+        counts.update(self._db.connect().execute(
+            'SELECT status, COUNT(*) FROM enquiries GROUP BY status').fetchall())
+        return counts
+
+    def oldest_pending_age(self):
+        """Seconds the oldest undelivered enquiry has been waiting (0 if none)"""
+        oldest = self._db.connect().execute(
+            'SELECT MIN(enqueued_at) FROM enquiries WHERE status IN (?, ?)',
+            (PENDING, PROCESSING)).fetchone()[0]
+        return time.time() - oldest if oldest is not None else 0.0
+
+
+class EnquiryProcessor:
+    """Worker pool draining an enquiry queue in batches"""
+
+    def __init__(self, queue, handler=log_enquiry, workers=2, batch_size=50, max_attempts=5,
+                 backoff=1.0, poll_interval=1.0):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()  # Guards worker start-up and the counters
+        self._threads = []
+        self._stopping = None  # Event set to stop the current threads
+        self._pid = None
+        self._latencies = deque(maxlen=1000)  # Seconds from enqueue to delivery
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    def submit(self, record):
+        """Enqueue an enquiry and make sure workers are running to deliver it"""
+        enquiry_id = self.queue.enqueue(record)
+        self.start()
+        self._wakeup.set()
+        return enquiry_id
+
+    def start(self):
+        """Start the worker threads (once per process; threads do not survive fork)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = threading.Event()
+            self._threads = [threading.Thread(target=self._run, args=(self._stopping,),
+                                              name=f'enquiry-worker-{n}', daemon=True)
+                             for n in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the worker threads once their current batch is done"""
+        with self._lock:
+            threads, self._threads, self._pid = self._threads, [], None
+            if self._stopping is not None:
+                self._stopping.set()
+        self._wakeup.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def _run(self, stopping):
+        worker = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        while not stopping.is_set():
+            try:
+                handled = self.run_once(worker)
+            except sqlite3.Error:
+                logger.exception('Enquiry queue unavailable')
+                handled = 0
+            if not handled:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self, worker='inline'):
+        """Claim and deliver one batch; returns the number of enquiries handled"""
+        batch = self.queue.claim(self.batch_size, worker)
+        delivered = []
+        for enquiry_id, record, attempts, enqueued_at in batch:
+            try:
+                self.handler(record)
+            except Exception as error:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    self.queue.fail(enquiry_id, repr(error))
+                    logger.error('Enquiry %s dead-lettered after %s attempts: %r', enquiry_id, attempts, error)
+                    with self._lock:
+                        self.dead_lettered += 1
+                else:
+                    self.queue.fail(enquiry_id, repr(error), time.time() + self.backoff * 2 ** (attempts - 1))
+                    with self._lock:
+                        self.retried += 1
+                continue
+            delivered.append(enquiry_id)
+            self._latencies.append(time.time() - enqueued_at)
+        if delivered:
+            self.queue.complete(delivered)
+            with self._lock:
+                self.processed += len(delivered)
+        return len(batch)
+
+    def metrics(self):
+        """Queue depth, dead letters, retry counts and delivery latency percentiles"""
+        counts = self.queue.counts()
+        latencies = sorted(self._latencies)
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] if latencies else 0.0
+
+        return {
+            'depth': counts[PENDING] + counts[PROCESSING],
+            'dead': counts[DEAD],
+            'delivered_total': counts[DONE],
+            'oldest_pending_seconds': self.queue.oldest_pending_age(),
+            'processed': self.processed,
+            'retried': self.retried,
+            'dead_lettered': self.dead_lettered,
+            'latency_p50_seconds': percentile(0.5),
+            'latency_p95_seconds': percentile(0.95),
+            'latency_max_seconds': latencies[-1] if latencies else 0.0,
+        }
+
+
+def init_enquiry_queue(app):
+    """Create the enquiry queue and (not yet started) worker pool for ``app``"""
+    app.config.setdefault('ENQUIRY_QUEUE', os.environ.get('ENQUIRY_QUEUE')
+                          or os.path.join(app.instance_path, 'enquiries.db'))
+    app.config.setdefault('ENQUIRY_HANDLER', log_enquiry)
+    app.config.setdefault('ENQUIRY_WORKERS', 2)
+    app.config.setdefault('ENQUIRY_BATCH_SIZE', 50)
+    app.config.setdefault('ENQUIRY_MAX_ATTEMPTS', 5)
+    app.config.setdefault('ENQUIRY_RETRY_BACKOFF', 1.0)
+    app.extensions['enquiries'] = EnquiryProcessor(
+        SQLiteEnquiryQueue(app.config['ENQUIRY_QUEUE']),
+        handler=lambda record: app.config['ENQUIRY_HANDLER'](record),  # Looked up per delivery
+        workers=app.config['ENQUIRY_WORKERS'],
+        batch_size=app.config['ENQUIRY_BATCH_SIZE'],
+        max_attempts=app.config['ENQUIRY_MAX_ATTEMPTS'],
+        backoff=app.config['ENQUIRY_RETRY_BACKOFF'],
+    )
+    app.cli.add_command(enquiries_cli)
+
+
+def get_enquiry_processor():
+    """Enquiry worker pool of the current app"""
+    return current_app.extensions['enquiries']
+
+
+def submit_enquiry(record):
+    """Queue a validated, sanitized enquiry for background delivery"""
+    return get_enquiry_processor().submit(record)
+
+
+@click.group('enquiries')
+def enquiries_cli():
+    """Enquiry queue administration"""
+
+
+@enquiries_cli.command('stats')
+@with_appcontext
+def stats_command():
+    """Show queue depth, dead letters and delivery latency"""
+    for name, value in get_enquiry_processor().metrics().items():
+        click.echo(f'{name}: {value:.3f}' if isinstance(value, float) else f'{name}: {value}')
+
+
+@enquiries_cli.command('drain')
+@with_appcontext
+def drain_command():
+    """Deliver every ready enquiry in the foreground"""
+    processor = get_enquiry_processor()
+    total = 0
+    while True:
+        handled = processor.run_once()
+        if not handled:
+            break
+        total += handled
+    click.echo(f'Handled {total} enquiries')
+
+
+@enquiries_cli.command('requeue-dead')
+@with_appcontext
+def requeue_dead_command():
+    """Move dead-lettered enquiries back onto the queue"""
+    click.echo(f'Requeued {get_enquiry_processor().queue.requeue_dead()} enquiries')
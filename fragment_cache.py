@@ -0,0 +1,82 @@
+"""
+Rendered-fragment cache for IKW Store.
+
+Holds rendered HTML (product cards, product grids, whole anonymous pages) in
+an LRU map with a memory budget. Keys carry the catalog and rating versions
+they were rendered from, so stale entries are never served; they simply age
+out of the LRU order.
+"""
+
+from collections import OrderedDict
+import sys
+import threading
+
+
+class FragmentCache:
+    """Thread-safe LRU cache of rendered fragments with a byte budget"""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, max_entries=10000):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, size in bytes)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached fragment for ``key``, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """Store a fragment, evicting least recently used entries as needed"""
+        size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_render(self, key, render):
+        """Return the cached fragment for ``key``, calling ``render()`` on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,98 @@
+"""
+HTTP conditional responses for IKW Store catalog pages.
+
+``conditional`` computes a weak ETag from a few cheap version numbers (catalog
+version, rating version, search query, the visitor's cart badge) before the
+view runs, and answers a matching ``If-None-Match`` with ``304 Not Modified``
+without rendering any template. ``Cache-Control`` policies are configured per
+endpoint in ``app.config['CACHE_CONTROL']``.
+
+Those version numbers are counters kept by each worker process, so two
+workers can have equal counters for different content; ETags of pages built
+from them also carry a random id of the process that rendered them, and a
+client only gets a 304 from the worker its copy came from.
+"""
+
+import functools
+import hashlib
+import os
+import secrets
+
+from flask import current_app, request, session
+
+DEFAULT_CACHE_CONTROL = 'private, no-cache'
+
+
+def template_fingerprint(app):
+    """Hash of the template sources, so a deploy with new templates changes every ETag"""
+    digest = hashlib.blake2b(digest_size=8)
+    for root in sorted(app.jinja_loader.searchpath):
+        for dirpath, _, filenames in sorted(os.walk(os.path.join(app.root_path, root))):
+            for filename in sorted(filenames):
+                with open(os.path.join(dirpath, filename), 'rb') as source:
+                    digest.update(filename.encode())
+                    digest.update(source.read())
+    return digest.hexdigest()
+
+
+def init_http_cache(app):
+    """Install default Cache-Control policies and the ETag salt"""
+    app.config.setdefault('CACHE_CONTROL', {
+        'home': DEFAULT_CACHE_CONTROL,
+        'products': DEFAULT_CACHE_CONTROL,
+    })
+    app.config.setdefault('ETAG_SALT', template_fingerprint(app))
+
+
+_instance = (None, None)  # (pid, random id) of this worker process
+
+
+def instance_id():
+    """Random id of this worker process, drawn again after a fork"""
+    global _instance
+    pid = os.getpid()
+    if _instance[0] != pid:
+        _instance = (pid, secrets.token_hex(8))
+    return _instance[1]
+
+
+def compute_etag(*parts):
+    """Short digest identifying one version of a page"""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def cache_control_for(endpoint):
+    """Configured Cache-Control value for an endpoint"""
+    return current_app.config.get('CACHE_CONTROL', {}).get(endpoint, DEFAULT_CACHE_CONTROL)
+
+
+def conditional(version_parts, per_process=True):
+    """
+    Answer If-None-Match with 304 before the view renders anything.
+
+    ``version_parts`` is called per request and returns the values the page
+    depends on; the visitor's cart badge and the template fingerprint are
+    added automatically, and the worker's ``instance_id`` unless the page
+    depends on no per-process state (``per_process=False``). Requests with
+    pending flash messages always render, since showing the messages is what
+    consumes them.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get('_flashes'):
+                response = current_app.make_response(view(*args, **kwargs))
+                response.headers['Cache-Control'] = 'no-store'
+                return response
+
+            etag = compute_etag(current_app.config['ETAG_SALT'], per_process and instance_id(),
+                                len(session.get('cart') or ()), *version_parts())
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = cache_control_for(request.endpoint)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,309 @@
+"""
+Opt-in request instrumentation for IKW Store.
+
+Enabled with ``INSTRUMENTATION=1`` (``app.config['INSTRUMENTATION']``). When on:
+
+- every request is timed into a per-endpoint latency histogram, with a
+  request counter by status code
+- time spent in template rendering, session load/save, form validation and
+  catalog lookups is recorded per endpoint as phase histograms
+- ``GET /metrics`` returns everything in the Prometheus text format, plus
+  fragment cache and enquiry queue gauges (protected by ``METRICS_TOKEN``
+  when that is set)
+- requests can be profiled with cProfile: those sent with an ``X-Profile``
+  header equal to ``METRICS_TOKEN`` (ignored when no token is set), and a
+  random ``PROFILE_SAMPLE_RATE`` fraction of all requests.
+  Dumps are written to ``PROFILE_DIR`` (``instance/profiles``) for
+  ``python -m pstats``, and named in the ``X-Profile-Dump`` response header
+
+Metrics are kept per process; with several workers each reports its own.
+When disabled the hooks return immediately and ``/metrics`` is a 404.
+"""
+
+import contextlib
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+
+from flask import Response, abort, current_app, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_PHASES_KEY = 'ikw.phases'
+_ENDPOINT_KEY = 'ikw.endpoint'
+_TEMPLATE_STACK_KEY = 'ikw.template_stack'
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def buckets(self):
+        """(upper bound, cumulative count) pairs, ending with +Inf"""
+        running = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            running += count
+            yield _format_value(bound), running
+        yield '+Inf', self.count
+
+
+class Metrics:
+    """Per-process request and phase metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (endpoint, method) -> Histogram
+        self.statuses = {}  # (endpoint, method, status) -> count
+        self.phases = {}  # (endpoint, phase) -> Histogram
+
+    def record(self, endpoint, method, status, seconds, phases):
+        with self._lock:
+            histogram = self.requests.get((endpoint, method))
+            if histogram is None:
+                histogram = self.requests[(endpoint, method)] = Histogram()
+            histogram.observe(seconds)
+            key = (endpoint, method, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            for phase, elapsed in phases.items():
+                histogram = self.phases.get((endpoint, phase))
+                if histogram is None:
+                    histogram = self.phases[(endpoint, phase)] = Histogram()
+                histogram.observe(elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.statuses.clear()
+            self.phases.clear()
+
+    def exposition(self, gauges=()):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += ['# HELP ikw_request_duration_seconds Request latency by endpoint',
+                      '# TYPE ikw_request_duration_seconds histogram']
+            for (endpoint, method), histogram in sorted(self.requests.items()):
+                lines += _histogram_lines('ikw_request_duration_seconds', histogram,
+                                          endpoint=endpoint, method=method)
+            lines += ['# HELP ikw_requests_total Requests by endpoint and status',
+                      '# TYPE ikw_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.statuses.items()):
+                lines.append(f'ikw_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+            lines += ['# HELP ikw_phase_duration_seconds Time per request spent in a processing phase',
+                      '# TYPE ikw_phase_duration_seconds histogram']
+            for (endpoint, phase), histogram in sorted(self.phases.items()):
+                lines += _histogram_lines('ikw_phase_duration_seconds', histogram,
+                                          endpoint=endpoint, phase=phase)
+        for name, kind, help_text, value in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}',
+                      f'{name} {_format_value(value)}']
+        return '\n'.join(lines) + '\n'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram_lines(name, histogram, **labels):
+    lines = [f'{name}_bucket{_labels(**labels, le=bound)} {count}' for bound, count in histogram.buckets()]
+    lines.append(f'{name}_sum{_labels(**labels)} {_format_value(histogram.total)}')
+    lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+    return lines
+
+
+def _add_phase(environ, name, elapsed):
+    phases = environ.get(_PHASES_KEY)
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + elapsed
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Attribute the time spent in the ``with`` block to phase ``name``"""
+    if not has_request_context() or _PHASES_KEY not in request.environ:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_phase(request.environ, name, time.perf_counter() - start)
+
+
+class TimedSessionInterface:
+    """Session interface wrapper timing session load and save"""
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def open_session(self, app, request):
+        start = time.perf_counter()
+        try:
+            return self.wrapped.open_session(app, request)
+        finally:
+            _add_phase(request.environ, 'session_load', time.perf_counter() - start)
+
+    def save_session(self, app, session, response):
+        start = time.perf_counter()
+        try:
+            return self.wrapped.save_session(app, session, response)
+        finally:
+            if has_request_context():
+                _add_phase(request.environ, 'session_save', time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+class InstrumentationMiddleware:
+    """WSGI middleware timing (and optionally profiling) every request"""
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        config = self.app.config
+        if not config.get('INSTRUMENTATION'):
+            return self.wsgi_app(environ, start_response)
+
+        environ[_PHASES_KEY] = {}
+        status_holder = []
+        extra_headers = []
+
+        def capture(status, headers, exc_info=None):
+            status_holder.append(status.split(' ', 1)[0])
+            return start_response(status, headers + extra_headers, exc_info)
+
+        profiler = None
+        if self._should_profile(environ):
+            dump_path = self._dump_path(environ)
+            extra_headers.append(('X-Profile-Dump', os.path.basename(dump_path)))
+            profiler = cProfile.Profile()
+
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = self.wsgi_app(environ, capture)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+                profiler.dump_stats(dump_path)
+            elapsed = time.perf_counter() - start
+            self.app.extensions['instrumentation'].record(
+                environ.get(_ENDPOINT_KEY) or 'unmatched', environ.get('REQUEST_METHOD', 'GET'),
+                status_holder[0] if status_holder else '500', elapsed, environ[_PHASES_KEY])
+        return result
+
+    def _should_profile(self, environ):
+        config = self.app.config
+        header, token = environ.get('HTTP_X_PROFILE'), config.get('METRICS_TOKEN')
+        if header and token and hmac.compare_digest(header.encode(), token.encode()):
+            return True  # On demand only for holders of the token; anyone else is just sampled
+        rate = config.get('PROFILE_SAMPLE_RATE', 0.0)
+        return rate > 0 and random.random() < rate
+
+    def _dump_path(self, environ):
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '/')).strip('_') or 'root'
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{slug[:40]}-{random.randrange(16 ** 6):06x}.prof'
+        return os.path.join(self.app.config['PROFILE_DIR'], name)
+
+
+def _template_started(sender, template, context, **extra):
+    if has_request_context() and _PHASES_KEY in request.environ:
+        request.environ.setdefault(_TEMPLATE_STACK_KEY, []).append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    if has_request_context() and request.environ.get(_TEMPLATE_STACK_KEY):
+        stack = request.environ[_TEMPLATE_STACK_KEY]
+        start = stack.pop()
+        if not stack:
+            # Only the outermost render counts; nested renders are part of it
+            _add_phase(request.environ, 'template', time.perf_counter() - start)
+
+
+def _gauges(app):
+    """Fragment cache and enquiry queue gauges"""
+    gauges = []
+    fragment_cache = app.extensions.get('fragment_cache')
+    if fragment_cache is not None:
+        stats = fragment_cache.stats()
+        gauges += [
+            ('ikw_fragment_cache_hits_total', 'counter', 'Fragment cache hits', stats['hits']),
+            ('ikw_fragment_cache_misses_total', 'counter', 'Fragment cache misses', stats['misses']),
+            ('ikw_fragment_cache_evictions_total', 'counter', 'Fragment cache evictions', stats['evictions']),
+            ('ikw_fragment_cache_bytes', 'gauge', 'Fragment cache size in bytes', stats['bytes']),
+        ]
+    enquiries = app.extensions.get('enquiries')
+    if enquiries is not None:
+        stats = enquiries.metrics()
+        gauges += [
+            ('ikw_enquiry_queue_depth', 'gauge', 'Enquiries waiting for delivery', stats['depth']),
+            ('ikw_enquiry_dead_letters', 'gauge', 'Dead-lettered enquiries', stats['dead']),
+            ('ikw_enquiry_oldest_pending_seconds', 'gauge', 'Age of the oldest undelivered enquiry',
+             stats['oldest_pending_seconds']),
+            ('ikw_enquiry_delivery_latency_p95_seconds', 'gauge', 'p95 enqueue-to-delivery latency',
+             stats['latency_p95_seconds']),
+        ]
+    return gauges
+
+
+def metrics_view():
+    """Prometheus scrape endpoint"""
+    app = current_app
+    if not app.config.get('INSTRUMENTATION'):
+        abort(404)
+    token = app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        abort(401)
+    body = app.extensions['instrumentation'].exposition(_gauges(app))
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8',
+                    headers={'Cache-Control': 'no-store'})
+
+
+def init_instrumentation(app):
+    """Install the (disabled unless INSTRUMENTATION is set) instrumentation hooks"""
+    app.config.setdefault('INSTRUMENTATION', os.environ.get('INSTRUMENTATION', '') not in ('', '0'))
+    app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.environ.get('PROFILE_SAMPLE_RATE', 0)))
+    app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    app.extensions['instrumentation'] = Metrics()
+    app.session_interface = TimedSessionInterface(app.session_interface)
+    app.wsgi_app = InstrumentationMiddleware(app, app.wsgi_app)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    @app.after_request
+    def record_endpoint(response):
+        if app.config['INSTRUMENTATION']:
+            request.environ[_ENDPOINT_KEY] = request.endpoint
+        return response
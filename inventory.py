@@ -0,0 +1,374 @@
+"""
+Stock levels and cart reservations for IKW Store.
+
+Adding a product to the cart reserves it: the reservation holds stock for
+``INVENTORY_RESERVATION_TTL`` seconds (refreshed whenever the line changes)
+and checkout commits every line at once - all lines are sold, or none are
+and the visitor is told which products ran out. An expired reservation is
+simply re-checked against the remaining stock at checkout.
+
+Only products with a stock level are tracked; all others are unlimited, so
+a catalog without stock data behaves as before. Stock is seeded from the
+optional ``stock`` column of the catalog file (``CATALOG_SOURCE``): products
+the store does not track yet get that many units, so catalog reloads never
+undo sales.
+
+``MemoryInventory`` keeps stock per process behind striped per-product
+locks, so checkouts of different products do not wait for each other; it
+only suits a single process, and a restart seeds it afresh from the
+catalog. ``SQLiteInventory`` keeps stock across restarts and shares it between
+workers (``INVENTORY_STORE=sqlite:///path/to/inventory.db``, the default of
+``python -m app serve`` with more than one worker); each reservation or
+checkout is one short write transaction, and the CLI changes it in place:
+
+    flask --app app inventory set 3 25
+    flask --app app inventory show
+"""
+
+import contextlib
+import heapq
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from sqlite_store import SQLiteDatabase, sqlite_path
+
+DEFAULT_RESERVATION_TTL = 15 * 60
+
+
+class _StockLevel:
+    """Stock of one product: units on hand, units held and the holds themselves"""
+
+    __slots__ = ('on_hand', 'reserved', 'holds', 'expiries')
+
+    def __init__(self, on_hand):
+        self.on_hand = on_hand
+        self.reserved = 0
+        self.holds = {}  # holder -> [quantity, expires_at]
+        self.expiries = []  # heap of (expires_at, holder); stale entries are skipped
+
+    def expire(self, now):
+        """Drop holds whose time is up"""
+        expiries = self.expiries
+        while expiries and expiries[0][0] <= now:
+            expires_at, holder = heapq.heappop(expiries)
+            hold = self.holds.get(holder)
+            if hold is not None and hold[1] == expires_at:  # Not refreshed since
+                self.reserved -= hold[0]
+                del self.holds[holder]
+
+    def held_by(self, holder):
+        hold = self.holds.get(holder)
+        return hold[0] if hold else 0
+
+    def hold(self, holder, quantity, expires_at):
+        """Set ``holder``'s hold to ``quantity`` (0 releases it)"""
+        self.reserved += quantity - self.held_by(holder)
+        if quantity:
+            self.holds[holder] = [quantity, expires_at]
+            heapq.heappush(self.expiries, (expires_at, holder))
+        else:
+            self.holds.pop(holder, None)
+
+
+class MemoryInventory:
+    """Per-process stock with striped per-product locks"""
+
+    def __init__(self, ttl=DEFAULT_RESERVATION_TTL, stripes=64):
+        self.ttl = ttl
+        self._levels = {}  # product_id -> _StockLevel
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def _lock(self, product_id):
+        return self._locks[product_id % len(self._locks)]
+
+    @contextlib.contextmanager
+    def _locked(self, product_ids=None):
+        """Hold the stripe locks of ``product_ids`` (every stripe if None)"""
+        stripes = self._locks if product_ids is None else map(self._lock, product_ids)
+        # Always taken in the same order, so callers holding several cannot deadlock
+        locks = sorted({id(lock): lock for lock in stripes}.items())
+        for _, lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for _, lock in reversed(locks):
+                lock.release()
+
+    @staticmethod
+    def _snapshot(level, now):
+        level.expire(now)
+        return {'on_hand': level.on_hand, 'reserved': level.reserved, 'available': level.on_hand - level.reserved}
+
+    def set_stock(self, product_id, on_hand):
+        """Set the units on hand of a product (reservations are kept)"""
+        with self._lock(product_id):
+            level = self._levels.get(product_id)
+            if level is None:
+                self._levels[product_id] = _StockLevel(on_hand)
+            else:
+                level.on_hand = on_hand
+
+    def seed_stock(self, levels):
+        """Start tracking the products of {product_id: on_hand} not tracked yet; returns how many"""
+        seeded = 0
+        for product_id, on_hand in levels.items():
+            with self._lock(product_id):
+                if product_id not in self._levels:
+                    self._levels[product_id] = _StockLevel(on_hand)
+                    seeded += 1
+        return seeded
+
+    def stock(self, product_id):
+        """{'on_hand', 'reserved', 'available'} for a product, or None if untracked"""
+        with self._lock(product_id):
+            level = self._levels.get(product_id)
+            return self._snapshot(level, time.monotonic()) if level is not None else None
+
+    def levels(self):
+        """{product_id: stock()} for every tracked product, as one consistent snapshot"""
+        now = time.monotonic()
+        with self._locked():
+            return {product_id: self._snapshot(self._levels[product_id], now) for product_id in sorted(self._levels)}
+
+    def reserve(self, holder, product_id, quantity):
+        """Hold ``quantity`` units for ``holder`` (replacing its hold); False if not enough stock"""
+        now = time.monotonic()
+        with self._lock(product_id):
+            level = self._levels.get(product_id)
+            if level is None:
+                return True
+            level.expire(now)
+            if quantity - level.held_by(holder) > level.on_hand - level.reserved:
+                return False
+            level.hold(holder, quantity, now + self.ttl)
+            return True
+
+    def commit(self, holder, lines):
+        """
+        Sell {product_id: quantity} to ``holder``, consuming its holds.
+
+        All or nothing: returns the ids of products without enough stock
+        (nothing is sold then), or an empty list on success.
+        """
+        now = time.monotonic()
+        product_ids = sorted(lines)
+        with self._locked(product_ids):
+            short = []
+            for product_id in product_ids:
+                level = self._levels.get(product_id)
+                if level is not None:
+                    level.expire(now)
+                    if lines[product_id] - level.held_by(holder) > level.on_hand - level.reserved:
+                        short.append(product_id)
+            if short:
+                return short
+            for product_id in product_ids:
+                level = self._levels.get(product_id)
+                if level is not None:
+                    level.hold(holder, 0, None)
+                    level.on_hand -= lines[product_id]
+            return []
+
+    def reset(self):
+        with self._locked():
+            self._levels.clear()
+
+
+class SQLiteInventory:
+    """Stock and reservations shared by every worker through a SQLite database"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS stock (
+            product_id INTEGER PRIMARY KEY,
+            on_hand INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reservations (
+            holder TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (product_id, holder)
+        );
+        CREATE INDEX IF NOT EXISTS reservations_expires ON reservations (expires_at);
+    """
+
+    def __init__(self, path, ttl=DEFAULT_RESERVATION_TTL, purge_interval=60.0):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._db = SQLiteDatabase(path, self.SCHEMA)
+        self._purged_at = time.monotonic()
+
+    @staticmethod
+    def _available(conn, holder, product_id, now):
+        """Units ``holder`` may take (its own hold included), or None if untracked"""
+        row = conn.execute('SELECT on_hand FROM stock WHERE product_id = ?', (product_id,)).fetchone()
+        if row is None:
+            return None
+        held = conn.execute(
+            'SELECT COALESCE(SUM(quantity), 0) FROM reservations '
+            'WHERE product_id = ? AND holder != ? AND expires_at > ?', (product_id, holder, now)).fetchone()[0]
+        return row[0] - held
+
+    def set_stock(self, product_id, on_hand):
+        """Set the units on hand of a product (reservations are kept)"""
+        self._db.connect().execute(
+            'INSERT INTO stock (product_id, on_hand) VALUES (?, ?) '
+            'ON CONFLICT (product_id) DO UPDATE SET on_hand = excluded.on_hand', (product_id, on_hand))
+
+    def seed_stock(self, levels):
+        """Start tracking the products of {product_id: on_hand} not tracked yet; returns how many"""
+        conn = self._db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            seeded = conn.executemany(
+                'INSERT INTO stock (product_id, on_hand) VALUES (?, ?) ON CONFLICT (product_id) DO NOTHING',
+                list(levels.items())).rowcount
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return seeded
+
+    def stock(self, product_id):
+        """{'on_hand', 'reserved', 'available'} for a product, or None if untracked"""
+        conn = self._db.connect()
+        row = conn.execute('SELECT on_hand FROM stock WHERE product_id = ?', (product_id,)).fetchone()
+        if row is None:
+            return None
+        reserved = conn.execute(
+            'SELECT COALESCE(SUM(quantity), 0) FROM reservations WHERE product_id = ? AND expires_at > ?',
+            (product_id, time.time())).fetchone()[0]
+        return {'on_hand': row[0], 'reserved': reserved, 'available': row[0] - reserved}
+
+    def levels(self):
+        """{product_id: stock()} for every tracked product"""
+        ids = [row[0] for row in self._db.connect().execute('SELECT product_id FROM stock ORDER BY product_id')]
+        return {product_id: self.stock(product_id) for product_id in ids}
+
+    def reserve(self, holder, product_id, quantity):
+        """Hold ``quantity`` units for ``holder`` (replacing its hold); False if not enough stock"""
+        now = time.time()  # Wall clock: shared between processes
+        conn = self._db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            available = self._available(conn, holder, product_id, now)
+            if available is not None and quantity > available:
+                conn.execute('ROLLBACK')
+                return False
+            if available is not None:
+                if quantity:
+                    conn.execute(
+                        'INSERT INTO reservations (holder, product_id, quantity, expires_at) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (product_id, holder) DO UPDATE SET quantity = excluded.quantity, '
+                        'expires_at = excluded.expires_at', (holder, product_id, quantity, now + self.ttl))
+                else:
+                    conn.execute('DELETE FROM reservations WHERE product_id = ? AND holder = ?',
+                                 (product_id, holder))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._maybe_purge()
+        return True
+
+    def commit(self, holder, lines):
+        """
+        Sell {product_id: quantity} to ``holder``, consuming its holds.
+
+        All or nothing: returns the ids of products without enough stock
+        (nothing is sold then), or an empty list on success.
+        """
+        now = time.time()
+        conn = self._db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            short, tracked = [], []
+            for product_id in sorted(lines):
+                available = self._available(conn, holder, product_id, now)
+                if available is None:
+                    continue
+                if lines[product_id] > available:
+                    short.append(product_id)
+                tracked.append(product_id)
+            if short:
+                conn.execute('ROLLBACK')
+                return short
+            conn.executemany('UPDATE stock SET on_hand = on_hand - ? WHERE product_id = ?',
+                             [(lines[product_id], product_id) for product_id in tracked])
+            conn.executemany('DELETE FROM reservations WHERE product_id = ? AND holder = ?',
+                             [(product_id, holder) for product_id in tracked])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return []
+
+    def _maybe_purge(self):
+        # Expired holds no longer count; deleting them just keeps the table small
+        if time.monotonic() - self._purged_at >= self.purge_interval:
+            self._purged_at = time.monotonic()
+            self._db.connect().execute('DELETE FROM reservations WHERE expires_at <= ?', (time.time(),))
+
+    def reset(self):
+        self._db.connect().executescript('DELETE FROM reservations; DELETE FROM stock;')
+
+
+def create_inventory(url=None, ttl=DEFAULT_RESERVATION_TTL):
+    """
+    Build the inventory store for ``url``.
+
+    ``None`` keeps stock in process memory; ``'sqlite:///path/to/inventory.db'``
+    shares it between workers.
+    """
+    if not url:
+        return MemoryInventory(ttl)
+    return SQLiteInventory(sqlite_path(url, 'inventory store'), ttl)
+
+
+def get_inventory():
+    """Inventory store of the current app"""
+    return current_app.extensions['inventory']
+
+
+def init_inventory(app, url=None):
+    """Create the inventory store (``url`` as for ``create_inventory``) and its CLI"""
+    app.config.setdefault('INVENTORY_RESERVATION_TTL', DEFAULT_RESERVATION_TTL)
+    app.extensions['inventory'] = create_inventory(url, app.config['INVENTORY_RESERVATION_TTL'])
+    app.cli.add_command(inventory_cli)
+
+
+@click.group('inventory')
+def inventory_cli():
+    """Stock levels"""
+
+
+@inventory_cli.command('show')
+@with_appcontext
+def show_command():
+    """List stock levels of tracked products"""
+    levels = get_inventory().levels()
+    if not levels:
+        click.echo('No products are stock-tracked')
+    for product_id, level in levels.items():
+        click.echo(f'{product_id}: {level["on_hand"]} on hand, {level["reserved"]} reserved, '
+                   f'{level["available"]} available')
+
+
+@inventory_cli.command('set')
+@click.argument('product_id', type=int)
+@click.argument('on_hand', type=click.IntRange(min=0))
+@with_appcontext
+def set_command(product_id, on_hand):
+    """Set the units on hand of a product"""
+    inventory = get_inventory()
+    if isinstance(inventory, MemoryInventory):
+        raise click.ClickException('Stock is kept in server memory (no INVENTORY_STORE), which this command '
+                                   'cannot reach: use the catalog\'s stock column or a SQLite store')
+    inventory.set_stock(product_id, on_hand)
+    click.echo(f'Product {product_id}: {on_hand} on hand')
@@ -0,0 +1,123 @@
+"""
+Paginated, sorted product listings for IKW Store.
+
+Pages are addressed by an opaque keyset cursor: the sort key of the last
+product on the previous page. The next page starts right after that key,
+found by binary search in a presorted index, so a page costs the same at
+any depth and does not shift when products before it are re-rated.
+
+- catalog order (or search relevance) is the default
+- ``price`` / ``price_desc`` / ``name`` indexes are built once per catalog
+  snapshot (``Catalog.sorted_index``)
+- the ``rating`` index (best smoothed score first, then most votes, unrated
+  last; see ``analytics``) is rebuilt at most once per rating version
+- search results are ranked by relevance, or sorted by the chosen key
+"""
+
+import base64
+from bisect import bisect_right
+import json
+
+from analytics import rating_scores
+
+SORT_ORDERS = {
+    'price': 'Price: low to high',
+    'price_desc': 'Price: high to low',
+    'rating': 'Top rated',
+    'name': 'Name: A to Z',
+}
+
+STATIC_SORT_KEYS = {
+    'price': lambda product: (product.price, product.id),
+    'price_desc': lambda product: (-product.price, product.id),
+    'name': lambda product: (product.name.casefold(), product.id),
+}
+
+
+class Page:
+    """One page of a product listing"""
+
+    __slots__ = ('products', 'total', 'sort', 'cursor', 'next_cursor')
+
+    def __init__(self, products, total, sort, cursor, next_cursor):
+        self.products = products
+        self.total = total
+        self.sort = sort
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(sort, key):
+    """Opaque URL-safe cursor for the position after ``key`` in ``sort`` order"""
+    raw = json.dumps([sort or '', key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """Sort key stored in ``cursor``; raises ValueError if invalid or for another order"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor') from None
+    if cursor_sort != (sort or ''):
+        raise ValueError('cursor belongs to a different sort order')
+    return tuple(key) if isinstance(key, list) else key
+
+
+def rating_sort_key(scores):
+    """Sort key for best smoothed score first, then most votes, unrated products last"""
+    def key(product):
+        score = scores.get(product.id)
+        if score is None or not score[1]:
+            return (1, 0.0, 0, product.id)
+        return (0, -score[0], -score[1], product.id)
+    return key
+
+
+def ordered_products(catalog, ratings, sort):
+    """(products, ascending sort keys) of the whole catalog in ``sort`` order"""
+    if sort == 'rating':
+        version = ratings.version  # Read before the snapshot, so a newer vote forces a rebuild
+        return catalog.sorted_index('rating', rating_sort_key(rating_scores(ratings)), version=version)
+    if sort in STATIC_SORT_KEYS:
+        return catalog.sorted_index(sort, STATIC_SORT_KEYS[sort])
+    return catalog.products, range(len(catalog))
+
+
+def _ordered_matches(catalog, ratings, query, sort):
+    """(search matches, ascending sort keys) in relevance or ``sort`` order"""
+    matches, _ = catalog.search(query)
+    if sort == 'rating':
+        key = rating_sort_key(rating_scores(ratings))
+    elif sort in STATIC_SORT_KEYS:
+        key = STATIC_SORT_KEYS[sort]
+    else:
+        return matches, range(len(matches))
+    keyed = sorted((key(product), product) for product in matches)
+    return [product for _, product in keyed], [sort_key for sort_key, _ in keyed]
+
+
+def paginate(catalog, ratings, query='', sort=None, cursor=None, per_page=24):
+    """
+    One page of the catalog (or of the matches for ``query``) in ``sort`` order.
+
+    Unknown sort orders fall back to the default; an invalid cursor raises
+    ValueError.
+    """
+    if sort not in SORT_ORDERS:
+        sort = None
+    if query:
+        products, keys = _ordered_matches(catalog, ratings, query, sort)
+    else:
+        products, keys = ordered_products(catalog, ratings, sort)
+    start = 0
+    if cursor:
+        try:
+            start = bisect_right(keys, decode_cursor(cursor, sort))
+        except TypeError:  # Well-formed cursor holding a key of the wrong shape
+            raise ValueError('invalid cursor') from None
+    end = start + per_page
+    page = list(products[start:end])
+    next_cursor = encode_cursor(sort, keys[end - 1]) if end < len(products) else None
+    return Page(page, len(products), sort, cursor, next_cursor)
@@ -0,0 +1,259 @@
+"""
+Order log for IKW Store.
+
+Every completed checkout is appended to an append-only JSON-lines file
+(``ORDER_LOG``, ``instance/orders.jsonl`` by default): one compact line per
+order with its lines, subtotals, total and timestamp. The order id is one
+more than the line's byte offset, so an order is found with a single seek.
+A small sidecar index (``orders.jsonl.idx``) records the offset of the
+first order of each day, so a date range is a byte range of the log.
+
+Exports stream that byte range in fixed-size chunks - CSV (one row per
+order line) or the raw JSON lines - so memory use does not grow with the
+number of orders:
+
+    flask --app app orders export --format csv --since 2024-01-01 -o orders.csv
+    curl -H "Authorization: Bearer $ORDERS_TOKEN" \\
+        "http://localhost:5001/admin/orders/export?format=jsonl&since=2024-01-01"
+
+The export endpoint is disabled (404) unless ``ORDERS_TOKEN`` is set.
+Workers appending to the same log are serialized with an exclusive file
+lock (``fcntl``, where available).
+"""
+
+from bisect import bisect_left, bisect_right
+import csv
+from datetime import date, datetime
+import hmac
+import io
+import json
+import os
+import threading
+
+import click
+from flask import abort, current_app, request
+from flask.cli import with_appcontext
+
+try:
+    import fcntl
+except ImportError:  # Optional: without it, only threads of one process are serialized
+    fcntl = None
+
+CHUNK_BYTES = 64 * 1024
+CSV_HEADER = ('order_id', 'timestamp', 'product_id', 'name', 'price', 'quantity', 'subtotal', 'order_total')
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def _flock(file, exclusive):
+    """Exclusive (writer) or shared (reader) lock on ``file``, released when it is closed"""
+    if fcntl is not None:
+        fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+class OrderLog:
+    """Append-only JSON-lines order log with a per-day offset index"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._lock = threading.Lock()
+
+    def append(self, lines, total):
+        """Record an order of ``lines`` (dicts) totalling ``total``; returns the order"""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'ab') as log:
+                _flock(log, exclusive=True)
+                offset = log.seek(0, os.SEEK_END)
+                # Timestamped under the lock, so the log is in time order
+                timestamp = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+                order = {'id': offset + 1, 'timestamp': timestamp, 'lines': lines, 'total': total}
+                day = timestamp[:10]
+                if self._last_indexed_day() != day:
+                    # Indexed before the order is written: the offset is a valid start even if that write fails
+                    with open(self.index_path, 'a') as index:
+                        index.write(f'{day} {offset}\n')
+                log.write(json.dumps(order, separators=(',', ':')).encode() + b'\n')
+        return order
+
+    def _last_indexed_day(self):
+        try:
+            with open(self.index_path, 'rb') as index:
+                index.seek(max(0, index.seek(0, os.SEEK_END) - 64))
+                tail = index.read().splitlines()
+        except FileNotFoundError:
+            return None
+        return tail[-1].split()[0].decode() if tail else None
+
+    def day_offsets(self):
+        """([day, ...], [offset of its first order, ...]), oldest first"""
+        days, offsets = [], []
+        try:
+            with open(self.index_path) as index:
+                for line in index:
+                    day, offset = line.split()
+                    days.append(day)
+                    offsets.append(int(offset))
+        except FileNotFoundError:
+            pass
+        return days, offsets
+
+    def _size(self):
+        """Log size at an order boundary (no append is half-written)"""
+        try:
+            with open(self.path, 'rb') as log:
+                _flock(log, exclusive=False)
+                return log.seek(0, os.SEEK_END)
+        except FileNotFoundError:
+            return 0
+
+    def span(self, since=None, until=None):
+        """(start, end) byte range of the orders placed from ``since`` to ``until`` (ISO dates, inclusive)"""
+        end = self._size()
+        days, offsets = self.day_offsets()
+        start = 0
+        if since:
+            position = bisect_left(days, since)
+            start = offsets[position] if position < len(days) else end
+        if until:
+            position = bisect_right(days, until)
+            if position < len(days):
+                end = offsets[position]
+        return start, max(start, end)
+
+    def iter_raw(self, since=None, until=None):
+        """Yield the raw JSON line of each order in the date range, oldest first"""
+        start, end = self.span(since, until)
+        if start == end:
+            return
+        with open(self.path, 'rb') as log:
+            log.seek(start)
+            position = start
+            for line in log:
+                position += len(line)
+                if position > end:
+                    break
+                yield line
+
+    def iter_orders(self, since=None, until=None):
+        """Yield each order (dict) in the date range, oldest first"""
+        for line in self.iter_raw(since, until):
+            yield json.loads(line)
+
+    def get(self, order_id):
+        """Order with ``order_id``, or None"""
+        if not isinstance(order_id, int) or order_id < 1:
+            return None
+        try:
+            with open(self.path, 'rb') as log:
+                log.seek(order_id - 1)
+                line = log.readline()
+            order = json.loads(line)
+        except (FileNotFoundError, ValueError):
+            return None
+        return order if order.get('id') == order_id else None
+
+
+def export_jsonl(log, since=None, until=None):
+    """Yield the orders in the date range as JSON lines, in chunks of about CHUNK_BYTES"""
+    start, end = log.span(since, until)
+    if start == end:
+        return
+    with open(log.path, 'rb') as source:
+        source.seek(start)
+        remaining = end - start
+        while remaining:
+            chunk = source.read(min(CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def export_csv(log, since=None, until=None):
+    """Yield the orders in the date range as CSV (one row per line), in chunks of about CHUNK_BYTES"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for order in log.iter_orders(since, until):
+        for line in order['lines']:
+            writer.writerow((order['id'], order['timestamp'], line['product_id'], line['name'],
+                             line['price'], line['quantity'], line['subtotal'], order['total']))
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+EXPORTERS = {'csv': export_csv, 'jsonl': export_jsonl}
+
+
+def parse_day(value):
+    """Normalize an ISO date argument; raises ValueError if it is not one"""
+    return date.fromisoformat(value).isoformat() if value else None
+
+
+def get_order_log():
+    """Order log of the current app"""
+    return current_app.extensions['orders']
+
+
+def record_order(summary):
+    """Append the priced cart ``summary`` (a shopping_cart.Cart) to the order log; returns the order"""
+    lines = [{'product_id': line.product.id, 'name': line.product.name, 'price': line.product.price,
+              'quantity': line.quantity, 'subtotal': line.subtotal} for line in summary]
+    return get_order_log().append(lines, summary.total)
+
+
+def export_view():
+    """Stream the order log as CSV or JSON lines (?format=csv|jsonl&since=YYYY-MM-DD&until=YYYY-MM-DD)"""
+    token = current_app.config.get('ORDERS_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        abort(401)
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORTERS:
+        abort(400)
+    try:
+        since, until = parse_day(request.args.get('since')), parse_day(request.args.get('until'))
+    except ValueError:
+        abort(400)
+    chunks = EXPORTERS[export_format](get_order_log(), since, until)
+    return current_app.response_class(chunks, mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename=orders.{export_format}',
+        'Cache-Control': 'no-store',
+    })
+
+
+@click.group('orders')
+def orders_cli():
+    """Order log"""
+
+
+@orders_cli.command('export')
+@click.option('--format', 'export_format', type=click.Choice(sorted(EXPORTERS)), default='csv')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), help='First day (inclusive)')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), help='Last day (inclusive)')
+@click.option('-o', '--output', type=click.File('wb'), default='-', help='Output file (default: stdout)')
+@with_appcontext
+def export_command(export_format, since, until, output):
+    """Export orders as CSV or JSON lines"""
+    since = since.date().isoformat() if since else None
+    until = until.date().isoformat() if until else None
+    for chunk in EXPORTERS[export_format](get_order_log(), since, until):
+        output.write(chunk)
+
+
+def init_order_log(app):
+    """Create the order log, its export endpoint and CLI"""
+    app.config.setdefault('ORDER_LOG', os.environ.get('ORDER_LOG')
+                          or os.path.join(app.instance_path, 'orders.jsonl'))
+    app.config.setdefault('ORDERS_TOKEN', os.environ.get('ORDERS_TOKEN'))
+    app.extensions['orders'] = OrderLog(app.config['ORDER_LOG'])
+    app.add_url_rule('/admin/orders/export', 'export_orders', export_view)
+    app.cli.add_command(orders_cli)
@@ -0,0 +1,182 @@
+"""
+Rate limiting for IKW Store's write endpoints.
+
+Rating and enquiry POSTs (form and JSON API) draw from a token bucket per
+client and endpoint: ``RATE_LIMITS`` maps an endpoint to ``(requests,
+seconds)``, i.e. a burst of ``requests`` refilled evenly over ``seconds``.
+The check runs in ``before_request`` - before the form is parsed or
+validated - and a rejected request gets a small 429 with ``Retry-After``,
+so a flood costs little more than routing.
+
+Clients are keyed by IP address (``RATELIMIT_KEY='ip'``), or by the
+server-side session id once the client sends it back (``'session'``, falling
+back to the IP, so dropping the cookie does not get a fresh bucket). Behind
+a reverse proxy, set ``PROXY_FIX_HOPS`` (see ``config.py``) so the IP is the
+client's. Buckets live in process memory by default; with
+``RATELIMIT_STORE=sqlite:///path/to/ratelimit.db`` they are shared by all
+workers through SQLite. Enabled in the production profile
+(``RATELIMIT_ENABLED``).
+"""
+
+from collections import OrderedDict
+import math
+import threading
+import time
+
+from flask import current_app, request, session
+
+from sqlite_store import SQLiteDatabase, sqlite_path
+
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+CHECKED_KEY = 'ikw.rate_limited'  # Set once a request has been checked (ASGI handlers defer to WSGI)
+
+DEFAULT_RATE_LIMITS = {
+    'rate_product': (10, 60.0),
+    'api.rate': (10, 60.0),
+    'enquiry': (5, 300.0),
+    'api.submit_enquiry': (5, 300.0),
+}
+
+
+def refill(tokens, updated, now, capacity, period):
+    """Token count after refilling at ``capacity / period`` per second since ``updated``"""
+    return min(capacity, tokens + (now - updated) * capacity / period)
+
+
+class TokenBucketLimiter:
+    """Per-process token buckets, least recently used evicted beyond ``max_keys``"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+
+    def acquire(self, key, capacity, period):
+        """Take a token for ``key``; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(capacity), now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = refill(bucket[0], bucket[1], now, capacity, period)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) * period / capacity
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteTokenBucketLimiter:
+    """Token buckets shared by every worker through a SQLite database"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL,
+            full_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at);
+    """
+
+    def __init__(self, path, purge_interval=60.0):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._db = SQLiteDatabase(path, self.SCHEMA)
+        self._purged_at = time.monotonic()
+
+    def acquire(self, key, capacity, period):
+        """Take a token for ``key``; returns 0 if allowed, else seconds until one is available"""
+        now = time.time()  # Wall clock: shared between processes
+        conn = self._db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = float(capacity) if row is None else refill(row[0], row[1], now, capacity, period)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                'INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, '
+                'full_at = excluded.full_at',
+                (key, tokens, now, now + (capacity - tokens) * period / capacity))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._maybe_purge()
+        return 0.0 if allowed else (1 - tokens) * period / capacity
+
+    def _maybe_purge(self):
+        # Buckets that have refilled completely hold no state worth keeping
+        if time.monotonic() - self._purged_at >= self.purge_interval:
+            self._purged_at = time.monotonic()
+            self._db.connect().execute('DELETE FROM buckets WHERE full_at <= ?', (time.time(),))
+
+    def reset(self):
+        self._db.connect().execute('DELETE FROM buckets')
+
+
+def create_rate_limiter(url=None):
+    """
+    Build the bucket store for ``url``.
+
+    ``None`` keeps buckets in process memory; ``'sqlite:///path/to/ratelimit.db'``
+    shares them between workers.
+    """
+    if not url:
+        return TokenBucketLimiter()
+    return SQLiteTokenBucketLimiter(sqlite_path(url, 'rate limit store'))
+
+
+def client_key(req, current_session):
+    """Identify the client: returning server-side session id in 'session' mode, IP address otherwise"""
+    if current_app.config['RATELIMIT_KEY'] == 'session':
+        sid = getattr(current_session, 'sid', None)
+        if sid and not getattr(current_session, 'new', True):  # A new session is minted per cookieless request
+            return f'session:{sid}'
+    return f'ip:{req.remote_addr}'
+
+
+def check_rate_limit(endpoint, req, current_session):
+    """Return a 429 response if ``req`` to ``endpoint`` is over its limit, else None"""
+    config = current_app.config
+    if not config['RATELIMIT_ENABLED'] or req.method in SAFE_METHODS or req.environ.get(CHECKED_KEY):
+        return None
+    limit = config['RATE_LIMITS'].get(endpoint)
+    if limit is None:
+        return None
+    req.environ[CHECKED_KEY] = True
+    capacity, period = limit
+    retry_after = current_app.extensions['ratelimit'].acquire(
+        f'{endpoint}|{client_key(req, current_session)}', capacity, period)
+    if not retry_after:
+        return None
+    seconds = max(1, math.ceil(retry_after))
+    if endpoint.startswith('api.'):
+        body, mimetype = f'{{"error": "Too many requests, retry in {seconds} s"}}', 'application/json'
+    else:
+        body, mimetype = f'Too many requests - please try again in {seconds} seconds.', 'text/plain'
+    return current_app.response_class(body, status=429, mimetype=mimetype,
+                                      headers={'Retry-After': str(seconds)})
+
+
+def init_rate_limiter(app, url=None):
+    """Install the rate limit check and bucket store (``url`` as for ``create_rate_limiter``)"""
+    app.config.setdefault('RATELIMIT_ENABLED', False)
+    app.config.setdefault('RATELIMIT_KEY', 'ip')
+    app.config.setdefault('RATE_LIMITS', dict(DEFAULT_RATE_LIMITS))
+    app.extensions['ratelimit'] = create_rate_limiter(url)
+
+    @app.before_request
+    def enforce_rate_limit():
+        return check_rate_limit(request.endpoint, request, session)
@@ -0,0 +1,402 @@
+"""
+Product rating aggregates for IKW Store.
+
+Instead of keeping every vote, each product holds a running count, sum and a
+5-bucket histogram (a compact unsigned-int array). Recording a vote and
+reading the average, count or distribution are all O(1). Individual votes
+are only kept, with their timestamps, by the optional ``events`` log that
+``analytics`` attaches for trend reports.
+
+``RatingStore`` keeps the aggregates in process memory. ``SQLiteRatingStore``
+shares them between worker processes through a SQLite database in WAL mode:
+votes are applied to the local cache immediately and written behind in
+batches by a background thread, and the cache is reloaded when another
+process bumps the shared version counter.
+"""
+
+from array import array
+from collections import Counter
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, session
+
+from sqlite_store import SQLiteDatabase, sqlite_path
+
+MIN_RATING = 1
+MAX_RATING = 5
+
+
+class RatingAggregate:
+    """Running rating statistics for one product"""
+
+    __slots__ = ('count', 'total', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.histogram = array('I', [0] * MAX_RATING)
+
+    def add(self, score, times=1):
+        """Record ``times`` votes of ``score``"""
+        self.count += times
+        self.total += score * times
+        self.histogram[score - MIN_RATING] += times
+
+    @property
+    def average(self):
+        """Average rating rounded to one decimal place, or None if unrated"""
+        if not self.count:
+            return None
+        return round(self.total / self.count, 1)
+
+    def distribution(self):
+        """Return {score: number of votes} for scores 1-5"""
+        return {score: self.histogram[score - MIN_RATING]
+                for score in range(MIN_RATING, MAX_RATING + 1)}
+
+
+class RatingStore:
+    """Per-product rating aggregates with a global change counter"""
+
+    def __init__(self):
+        self._aggregates = {}  # {product_id: RatingAggregate}
+        self._lock = threading.Lock()
+        self._version = 0  # Bumped on every change, for cache invalidation
+        self.events = None  # Optional analytics.RatingEvents log fed every vote
+
+    def add(self, product_id, score):
+        """Record a single 1-5 vote for a product"""
+        score = int(score)
+        if not MIN_RATING <= score <= MAX_RATING:
+            raise ValueError(f'Rating must be between {MIN_RATING} and {MAX_RATING}')
+        with self._lock:
+            aggregate = self._aggregates.get(product_id)
+            if aggregate is None:
+                aggregate = self._aggregates[product_id] = RatingAggregate()
+            aggregate.add(score)
+            self._version += 1
+        if self.events is not None:
+            self.events.append(product_id, score)
+
+    @property
+    def version(self):
+        """Counter that changes whenever any aggregate changes"""
+        return self._version
+
+    def get(self, product_id):
+        """Return the aggregate for a product, or None if it has no votes"""
+        return self._aggregates.get(product_id)
+
+    def rated(self):
+        """Snapshot of {product_id: aggregate} for every product with votes"""
+        return dict(self._aggregates)
+
+    def average(self, product_id):
+        """Average rating for a product, or None if unrated"""
+        aggregate = self._aggregates.get(product_id)
+        return aggregate.average if aggregate else None
+
+    def count(self, product_id):
+        """Number of votes recorded for a product"""
+        aggregate = self._aggregates.get(product_id)
+        return aggregate.count if aggregate else 0
+
+    def distribution(self, product_id):
+        """Return {score: number of votes} for a product"""
+        aggregate = self._aggregates.get(product_id) or RatingAggregate()
+        return aggregate.distribution()
+
+    def reset(self, product_id=None):
+        """Forget the votes for one product, or for all products"""
+        with self._lock:
+            if product_id is None:
+                self._aggregates.clear()
+            else:
+                self._aggregates.pop(product_id, None)
+            self._version += 1
+
+    def load_lists(self, ratings_by_product):
+        """
+        One-time migration from the legacy {product_id: [ratings]} format.
+
+        Votes are folded into the aggregates; values outside 1-5 are skipped,
+        matching what the rating route would have accepted.
+        """
+        with self._lock:
+            for product_id, ratings in ratings_by_product.items():
+                aggregate = self._aggregates.get(int(product_id))
+                if aggregate is None:
+                    aggregate = self._aggregates[int(product_id)] = RatingAggregate()
+                for score, times in Counter(int(r) for r in ratings).items():
+                    if MIN_RATING <= score <= MAX_RATING:
+                        aggregate.add(score, times)
+            self._version += 1
+
+    @classmethod
+    def from_lists(cls, ratings_by_product):
+        """Build a store from the legacy {product_id: [ratings]} format"""
+        store = cls()
+        store.load_lists(ratings_by_product)
+        return store
+
+    def __contains__(self, product_id):
+        return product_id in self._aggregates
+
+    def __len__(self):
+        return len(self._aggregates)
+
+
+class SQLiteRatingStore(RatingStore):
+    """Rating store shared across processes through SQLite (WAL mode)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rating_aggregates (
+            product_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            h1 INTEGER NOT NULL, h2 INTEGER NOT NULL, h3 INTEGER NOT NULL,
+            h4 INTEGER NOT NULL, h5 INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rating_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO rating_meta (id, version) VALUES (0, 0);
+    """
+
+    def __init__(self, path, flush_interval=0.5, batch_size=500, refresh_interval=1.0):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.refresh_interval = refresh_interval
+
+        self._pending = []  # (product_id, score) votes not yet handed to the flusher
+        self._inflight = []  # votes being written by the current flush
+        self._flush_lock = threading.Lock()  # Always taken before self._lock
+        self._wakeup = threading.Event()
+        self._db = SQLiteDatabase(path, self.SCHEMA)
+        self._flusher = None
+        self._flusher_pid = None
+        self._closed = False
+        self._db_version = None  # Shared version the cache reflects
+        self._checked_at = 0.0
+
+        self._reload()
+        atexit.register(self.close)
+
+    def _ensure_flusher(self):
+        # Threads do not survive fork(), so each worker process starts its own
+        if self._flusher_pid != os.getpid():
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(target=self._run_flusher,
+                                             name='rating-flusher', daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # Votes stay queued and are retried on the next tick
+                pass
+
+    def add(self, product_id, score):
+        """Record a vote locally and queue it for the background flusher"""
+        score = int(score)
+        if not MIN_RATING <= score <= MAX_RATING:
+            raise ValueError(f'Rating must be between {MIN_RATING} and {MAX_RATING}')
+        with self._lock:
+            aggregate = self._aggregates.get(product_id)
+            if aggregate is None:
+                aggregate = self._aggregates[product_id] = RatingAggregate()
+            aggregate.add(score)
+            self._pending.append((product_id, score))
+            self._version += 1
+            backlog = len(self._pending)
+        if self.events is not None:
+            self.events.append(product_id, score)
+        self._ensure_flusher()
+        if backlog >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write all queued votes to the database in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._inflight, self._pending = self._pending, []
+
+            batch = {}
+            for product_id, score in self._inflight:
+                row = batch.setdefault(product_id, [0, 0, 0, 0, 0, 0, 0])
+                row[0] += 1
+                row[1] += score
+                row[1 + score] += 1
+
+            conn = self._db.connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany("""
+                    INSERT INTO rating_aggregates (product_id, count, total, h1, h2, h3, h4, h5)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (product_id) DO UPDATE SET
+                        count = count + excluded.count, total = total + excluded.total,
+                        h1 = h1 + excluded.h1, h2 = h2 + excluded.h2, h3 = h3 + excluded.h3,
+                        h4 = h4 + excluded.h4, h5 = h5 + excluded.h5
+                """, [(pid, *row) for pid, row in batch.items()])
+                conn.execute('UPDATE rating_meta SET version = version + 1 WHERE id = 0')
+                version = conn.execute('SELECT version FROM rating_meta WHERE id = 0').fetchone()[0]
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                with self._lock:
+                    self._pending[:0] = self._inflight
+                    self._inflight = []
+                raise
+
+            with self._lock:
+                self._inflight = []
+                # If nobody else wrote in between, the cache is still current
+                if version == self._db_version + 1:
+                    self._db_version = version
+
+    def _reload(self):
+        """Rebuild the cache from the database plus locally queued votes"""
+        with self._flush_lock:
+            conn = self._db.connect()
+            conn.execute('BEGIN')
+            try:
+                version = conn.execute('SELECT version FROM rating_meta WHERE id = 0').fetchone()[0]
+                rows = conn.execute('SELECT * FROM rating_aggregates').fetchall()
+            finally:
+                conn.execute('COMMIT')
+
+            aggregates = {}
+            for product_id, count, total, *histogram in rows:
+                aggregate = aggregates[product_id] = RatingAggregate()
+                aggregate.count = count
+                aggregate.total = total
+                aggregate.histogram = array('I', histogram)
+            with self._lock:
+                for product_id, score in self._pending:
+                    aggregates.setdefault(product_id, RatingAggregate()).add(score)
+                self._aggregates = aggregates
+                self._db_version = version
+                self._version += 1
+
+    def _refresh(self):
+        """Reload the cache if another process changed the shared version"""
+        now = time.monotonic()
+        if now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        version = self._db.connect().execute(
+            'SELECT version FROM rating_meta WHERE id = 0').fetchone()[0]
+        if version != self._db_version:
+            self._reload()
+
+    @property
+    def version(self):
+        self._refresh()
+        return self._version
+
+    def get(self, product_id):
+        self._refresh()
+        return super().get(product_id)
+
+    def rated(self):
+        self._refresh()
+        return super().rated()
+
+    def average(self, product_id):
+        self._refresh()
+        return super().average(product_id)
+
+    def count(self, product_id):
+        self._refresh()
+        return super().count(product_id)
+
+    def distribution(self, product_id):
+        self._refresh()
+        return super().distribution(product_id)
+
+    def reset(self, product_id=None):
+        """Forget votes for one or all products, locally and in the database"""
+        with self._flush_lock:
+            with self._lock:
+                if product_id is None:
+                    self._pending = []
+                else:
+                    self._pending = [vote for vote in self._pending if vote[0] != product_id]
+            conn = self._db.connect()
+            conn.execute('BEGIN IMMEDIATE')
+            if product_id is None:
+                conn.execute('DELETE FROM rating_aggregates')
+            else:
+                conn.execute('DELETE FROM rating_aggregates WHERE product_id = ?', (product_id,))
+            conn.execute('UPDATE rating_meta SET version = version + 1 WHERE id = 0')
+            conn.execute('COMMIT')
+        self._reload()
+
+    def load_lists(self, ratings_by_product):
+        """Migrate legacy rating lists straight into the database"""
+        for product_id, ratings in ratings_by_product.items():
+            with self._lock:
+                self._pending.extend((int(product_id), int(r)) for r in ratings
+                                     if MIN_RATING <= int(r) <= MAX_RATING)
+        self.flush()
+        self._reload()
+
+    def close(self):
+        """Stop the flusher and write out any queued votes"""
+        self._closed = True
+        self._wakeup.set()
+        if self._flusher is not None and self._flusher_pid == os.getpid():
+            self._flusher.join(timeout=5)
+        try:
+            self.flush()
+        except sqlite3.Error:
+            pass
+
+
+def create_rating_store(url=None):
+    """
+    Create a rating store from a URL.
+
+    ``None`` or ``'memory'`` gives a per-process ``RatingStore``;
+    ``'sqlite:///path/to/ratings.db'`` gives a shared ``SQLiteRatingStore``.
+    """
+    if not url or url == 'memory':
+        return RatingStore()
+    return SQLiteRatingStore(sqlite_path(url, 'rating store'))
+
+
+def install_rating_store(app, store):
+    """Make ``store`` the rating store used by ``app``"""
+    app.extensions['ratings'] = store
+
+
+def get_rating_store():
+    """Return the rating store installed on the current app"""
+    return current_app.extensions['ratings']
+
+
+def submit_rating(product_id, score, current_session=None):
+    """Record a visitor's vote in the shared store and their own rating in the session"""
+    current_session = session if current_session is None else current_session
+    get_rating_store().add(product_id, score)
+    user_ratings = current_session.get('ratings', {})
+    recommender = current_app.extensions.get('recommendations')
+    if recommender is not None:
+        recommender.record_rating(product_id, score, user_ratings)
+    user_ratings[str(product_id)] = int(score)
+    current_session['ratings'] = user_ratings
@@ -0,0 +1,209 @@
+"""
+"Customers also bought" recommendations for IKW Store.
+
+Products are related by how often they are seen together:
+
+- the products of each completed order (all pairs)
+- a product a visitor rates 4 or 5 stars and the other products that same
+  visitor already rated 4 or 5 (half weight)
+
+Co-occurrence weights are kept in a sparse map (only pairs actually seen)
+and turned into cosine similarities, ``pair / sqrt(weight(a) * weight(b))``,
+so best-sellers do not crowd out everything else. Each product's ``k`` most
+similar products are precomputed into a top-k table: recommending for a
+product is one dict lookup and a slice, O(k), and a cart merges the lists
+of its products, O(lines * k).
+
+Requests only queue events. A background thread in each worker (every
+``RECOMMENDATIONS_INTERVAL`` seconds) folds them into the counts and
+recomputes the top-k rows they affect: the rows of the products involved,
+and the rows of their neighbours where the changed similarity can enter or
+leave the top k (for a product whose weight grew by ``WEIGHT_DRIFT`` since
+its neighbours last saw it, so a best-seller's sale does not re-rank most
+of the catalog). On start-up the thread first learns from the order log.
+"""
+
+from collections import deque
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 8
+MAX_BASKET = 50  # Products of one event considered (pairs grow quadratically)
+LIKED_RATING = 4
+MAX_LIKED = 20  # Most recent liked products paired with a new rating
+RATING_WEIGHT = 0.5
+WEIGHT_DRIFT = 0.1  # Growth of a product's weight before its neighbours' rows are re-ranked
+
+
+class Recommender:
+    """Item-to-item co-occurrence model with a precomputed top-k table"""
+
+    def __init__(self, k=DEFAULT_TOP_K, interval=5.0, history=None, drift=WEIGHT_DRIFT):
+        self.k = k
+        self.interval = interval
+        self.drift = drift
+        self.history = history  # Callable yielding past product id groups (learned on start-up)
+        self._pending = deque()  # (product ids, weight, star) events waiting to be applied
+        self._pairs = {}  # product_id -> {other_id: co-occurrence weight}
+        self._weights = {}  # product_id -> weight of the events it appeared in
+        self._top = {}  # product_id -> tuple of up to k product ids (replaced whole, read without locks)
+        self._floor = {}  # product_id -> ranking key of the k-th product in its row (None while fewer)
+        self._propagated = {}  # product_id -> its weight when neighbours' rows last saw it
+        self._lock = threading.Lock()  # Serializes updates
+        self._pid = None
+        self.version = 0  # Bumped whenever the top-k table changes
+
+    def record(self, product_ids, weight=1.0):
+        """Queue a group of products seen together, e.g. the lines of an order"""
+        self._queue(list(dict.fromkeys(product_ids))[:MAX_BASKET], weight, False)
+
+    def record_rating(self, product_id, score, user_ratings):
+        """Queue a visitor's vote, paired with the other products they liked (``user_ratings``: {id: score})"""
+        if int(score) < LIKED_RATING or user_ratings.get(str(product_id), 0) >= LIKED_RATING:
+            return  # Not liked, or already counted
+        liked = [int(other) for other, other_score in user_ratings.items()
+                 if other_score >= LIKED_RATING and int(other) != product_id]
+        self._queue([product_id] + liked[-MAX_LIKED:], RATING_WEIGHT, True)
+
+    def _queue(self, ids, weight, star):
+        if len(ids) > 1:
+            self._pending.append((ids, weight, star))
+            if not self.interval:
+                self.update()
+
+    def recommend(self, product_id, limit=None):
+        """Ids of the products most often seen with ``product_id``, best first - O(k)"""
+        return self._top.get(product_id, ())[:limit]
+
+    def for_basket(self, product_ids, limit=4):
+        """Ids of products to suggest for a cart of ``product_ids``, best first - O(lines * k)"""
+        basket = set(product_ids)
+        scores = {}
+        for product_id in basket:
+            for rank, other in enumerate(self._top.get(product_id, ())):
+                if other not in basket:
+                    scores[other] = scores.get(other, 0) + self.k - rank
+        return heapq.nsmallest(limit, scores, key=lambda other: (-scores[other], other))
+
+    def _key(self, row, other):
+        # Cosine similarity without the row's own constant 1 / sqrt(weight); ties go to the lower id
+        return row[other] / math.sqrt(self._weights[other]), -other
+
+    def _rank(self, product_id, candidates):
+        """Make the ``k`` best of ``candidates`` the top-k row of ``product_id``"""
+        row = self._pairs[product_id]
+        best = heapq.nlargest(self.k, ((self._key(row, other), other) for other in candidates))
+        self._top[product_id] = tuple(other for _, other in best)
+        self._floor[product_id] = best[-1][0] if len(best) == self.k else None
+
+    def _count(self, events, moved=None):
+        """Add ``events`` to the pair and product weights, noting in ``moved`` whose score changed in each row"""
+        pairs, weights = self._pairs, self._weights
+        for ids, weight, star in events:
+            for product_id in ids:
+                weights[product_id] = weights.get(product_id, 0) + weight
+                row = pairs.setdefault(product_id, {})
+                others = [other for other in (ids if not star or product_id == ids[0] else ids[:1])
+                          if other != product_id]
+                for other in others:
+                    row[other] = row.get(other, 0) + weight
+                if moved is not None:
+                    moved.setdefault(product_id, set()).update(others)
+
+    def update(self):
+        """Apply queued events and refresh the affected top-k rows; returns the number of rows refreshed"""
+        with self._lock:
+            events = []
+            while self._pending:
+                events.append(self._pending.popleft())
+            if not events:
+                return 0
+            # In each row, only the scores of products involved in these events move
+            # (their pair or their weight grew), so rows are re-ranked from their current
+            # top k plus those products - unless one of the top k fell below the k-th
+            # place, when a product outside it may now belong and the row is recomputed.
+            moved = {}  # product_id -> products whose score in its row changed
+            self._count(events, moved)
+            pairs, weights = self._pairs, self._weights
+            for product_id in list(moved):
+                # A weight change moves the product in every neighbour's row; a best-seller
+                # is in most rows, so that waits until its weight has grown by ``drift``
+                if weights[product_id] < self._propagated.get(product_id, 0) * (1 + self.drift):
+                    continue
+                self._propagated[product_id] = weights[product_id]
+                for neighbour in pairs[product_id]:
+                    moved.setdefault(neighbour, set()).add(product_id)
+            for product_id, row_moved in moved.items():
+                row, top, floor = pairs[product_id], self._top.get(product_id, ()), self._floor.get(product_id)
+                if floor is not None and any(self._key(row, other) < floor for other in row_moved.intersection(top)):
+                    self._rank(product_id, row)
+                else:
+                    self._rank(product_id, row_moved.union(top))
+            self.version += 1
+            return len(moved)
+
+    def rebuild(self, groups):
+        """Recompute the model from scratch from an iterable of product id groups; returns the number of rows"""
+        events = [(ids, 1.0, False) for ids in (list(dict.fromkeys(group))[:MAX_BASKET] for group in groups)
+                  if len(ids) > 1]
+        with self._lock:
+            self._pending.clear()
+            self._pairs, self._weights, self._top, self._floor = {}, {}, {}, {}
+            self._count(events)
+            self._propagated = dict(self._weights)
+            for product_id, row in self._pairs.items():
+                self._rank(product_id, row)
+            self.version += 1
+            return len(self._pairs)
+
+    def start(self):
+        """Start the background updater (once per process; threads do not survive fork)"""
+        if self._pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='recommendations', daemon=True).start()
+
+    def _run(self):
+        if self.history is not None:
+            try:
+                for product_ids in self.history():
+                    self.record(product_ids)
+            except (OSError, ValueError, KeyError):
+                logger.exception('Could not learn recommendations from the order history')
+        while True:
+            self.update()
+            time.sleep(self.interval)
+
+    def __len__(self):
+        return len(self._top)
+
+
+def get_recommender():
+    """Recommender of the current app"""
+    return current_app.extensions['recommendations']
+
+
+def init_recommendations(app):
+    """Create the recommender, learning from the app's order log on start-up"""
+    app.config.setdefault('RECOMMENDATIONS_TOP_K', DEFAULT_TOP_K)
+    app.config.setdefault('RECOMMENDATIONS_INTERVAL', float(os.environ.get('RECOMMENDATIONS_INTERVAL', 5.0)))
+
+    def history():
+        for order in app.extensions['orders'].iter_orders():
+            yield [line['product_id'] for line in order['lines']]
+
+    recommender = app.extensions['recommendations'] = Recommender(
+        app.config['RECOMMENDATIONS_TOP_K'], app.config['RECOMMENDATIONS_INTERVAL'], history)
+    app.before_request(recommender.start)
+    return recommender
@@ -0,0 +1,112 @@
+"""
+Full-text product search for IKW Store.
+
+An inverted index over product names and descriptions is built once when a
+catalog loads. Partial words are resolved against the token vocabulary
+(short prefixes and trigrams), never against the products themselves, so
+the cost of a query grows with the number of matches rather than with the
+size of the catalog.
+"""
+
+import heapq
+import re
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Field weights: a hit in the product name outranks one in the description
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+# Match-kind weights: whole word > start of word > inside a word
+EXACT_MATCH = 3
+PREFIX_MATCH = 2
+INFIX_MATCH = 1
+
+GRAM_SIZE = 3
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric tokens"""
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _grams(token):
+    """Return the set of trigrams of a token"""
+    return {token[i:i + GRAM_SIZE] for i in range(len(token) - GRAM_SIZE + 1)}
+
+
+class SearchIndex:
+    """Inverted index with prefix and trigram lookup over the vocabulary"""
+
+    def __init__(self, products):
+        self._postings = {}  # token -> {product_id: field weight}
+        self._prefixes = {}  # 1-2 character prefix -> set of tokens
+        self._grams = {}  # trigram -> set of tokens
+        self._position = {}  # product_id -> catalog position (tie-breaker)
+
+        for position, product in enumerate(products):
+            self._position[product.id] = position
+            self._add_field(product.id, product.name, NAME_WEIGHT)
+            self._add_field(product.id, product.description, DESCRIPTION_WEIGHT)
+
+        for token in self._postings:
+            for size in range(1, min(len(token), GRAM_SIZE - 1) + 1):
+                self._prefixes.setdefault(token[:size], set()).add(token)
+            for gram in _grams(token):
+                self._grams.setdefault(gram, set()).add(token)
+
+    def _add_field(self, product_id, text, weight):
+        for token in set(tokenize(text)):
+            posting = self._postings.setdefault(token, {})
+            posting[product_id] = posting.get(product_id, 0) + weight
+
+    def _matching_tokens(self, term):
+        """Return the vocabulary tokens that contain ``term``"""
+        if len(term) < GRAM_SIZE:
+            # Very short terms are too unselective inside words - match word starts only
+            return self._prefixes.get(term, ())
+        gram_sets = sorted((self._grams.get(g, set()) for g in _grams(term)), key=len)
+        candidates = set.intersection(*gram_sets) if gram_sets[0] else set()
+        return [token for token in candidates if term in token]
+
+    def _score_term(self, term):
+        """Return {product_id: score} for a single query term"""
+        scores = {}
+        for token in self._matching_tokens(term):
+            if token == term:
+                kind = EXACT_MATCH
+            elif token.startswith(term):
+                kind = PREFIX_MATCH
+            else:
+                kind = INFIX_MATCH
+            for product_id, weight in self._postings[token].items():
+                score = weight * kind
+                if score > scores.get(product_id, 0):
+                    scores[product_id] = score
+        return scores
+
+    def search(self, query, offset=0, limit=None):
+        """
+        Return (ranked product ids, total matches) for ``query``.
+
+        Every query term must match (AND semantics); results are ordered by
+        descending score, then by catalog position.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], 0
+
+        per_term = sorted((self._score_term(term) for term in terms), key=len)
+        scores = per_term[0]
+        for other in per_term[1:]:
+            scores = {pid: score + other[pid] for pid, score in scores.items() if pid in other}
+            if not scores:
+                return [], 0
+
+        position = self._position
+        rank = lambda pid: (-scores[pid], position[pid])
+        if limit is None:
+            ranked = sorted(scores, key=rank)[offset:]
+        else:
+            ranked = heapq.nsmallest(offset + limit, scores, key=rank)[offset:]
+        return ranked, len(scores)
@@ -0,0 +1,152 @@
+"""
+Production server for IKW Store.
+
+``python -m app serve`` runs the app under gunicorn's pre-fork server with
+the ``production`` configuration profile:
+
+- ``--workers`` processes, each with ``--threads`` threads (gthread worker)
+- ``--keepalive`` seconds for idle keep-alive connections and a listen
+  ``--backlog`` for connection bursts
+- the app, catalog and search index are loaded once in the master before
+  forking (``--preload``, on by default), then frozen out of the garbage
+  collector so workers share those memory pages copy-on-write
+- graceful reload: ``kill -HUP <master pid>`` starts fresh workers and lets
+  the old ones finish their in-flight requests (``--graceful-timeout``).
+  With ``--no-preload`` the master never imports the application, so each
+  new worker imports its current code (this launcher module excepted).
+- with more than one worker, stock is kept in ``instance/inventory.db``
+  unless ``INVENTORY_STORE`` says otherwise: per-process counts would let
+  each worker sell the same units
+"""
+
+import argparse
+import gc
+import importlib
+import multiprocessing
+import os
+
+# Application modules (config, inventory, templating, app) are imported by the
+# functions that use them: with --no-preload that happens only in the workers
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # Optional: only needed for `python -m app serve`
+    BaseApplication = None
+
+APP_MODULE = 'app'
+INSTANCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+
+def default_workers():
+    """2 x CPUs + 1, the usual starting point for sync/threaded workers"""
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app serve',
+                                     description='Run IKW Store under a pre-fork multi-worker server')
+    parser.add_argument('--bind', default=os.environ.get('BIND', '0.0.0.0:5001'),
+                        help='address to listen on (default: 0.0.0.0:5001)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', 0)) or None,
+                        help='worker processes (default: 2 x CPUs + 1)')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker (default: 4)')
+    parser.add_argument('--keepalive', type=int, default=5, help='keep-alive timeout in seconds (default: 5)')
+    parser.add_argument('--backlog', type=int, default=2048, help='listen backlog (default: 2048)')
+    parser.add_argument('--timeout', type=int, default=30, help='worker timeout in seconds (default: 30)')
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='seconds old workers get to finish on reload/shutdown (default: 30)')
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help='recycle a worker after this many requests (default: never)')
+    parser.add_argument('--preload', action=argparse.BooleanOptionalAction, default=True,
+                        help='load the app before forking workers (default: on)')
+    parser.add_argument('--pid', help='write the master pid to this file')
+    parser.add_argument('--config', default=os.environ.get('APP_CONFIG', 'production'),
+                        help='configuration profile (default: production)')
+    return parser.parse_args(argv)
+
+
+def gunicorn_options(args):
+    """Translate command-line arguments into gunicorn settings"""
+    options = {
+        'bind': args.bind,
+        'workers': args.workers or default_workers(),
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'keepalive': args.keepalive,
+        'backlog': args.backlog,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'preload_app': args.preload,
+        'accesslog': '-',
+    }
+    if args.max_requests:
+        options['max_requests'] = args.max_requests
+        options['max_requests_jitter'] = max(1, args.max_requests // 10)
+    if args.pid:
+        options['pidfile'] = args.pid
+    return options
+
+
+def shared_inventory_url(workers):
+    """Default ``INVENTORY_STORE`` to SQLite when several worker processes must share stock"""
+    if workers > 1 and not os.environ.get('INVENTORY_STORE'):
+        os.environ['INVENTORY_STORE'] = 'sqlite:///' + os.path.join(INSTANCE_DIR, 'inventory.db')
+    return os.environ.get('INVENTORY_STORE')
+
+
+def share_inventory(application, workers):
+    """Move an app's in-memory stock to the shared store when serving with several workers"""
+    from inventory import MemoryInventory, create_inventory
+
+    url = shared_inventory_url(workers)
+    memory = application.extensions['inventory']
+    if url and isinstance(memory, MemoryInventory):
+        # Imported before INVENTORY_STORE was set (`python -m app serve`): seeded stock moves over
+        shared = application.extensions['inventory'] = create_inventory(url, memory.ttl)
+        shared.seed_stock({product_id: level['on_hand'] for product_id, level in memory.levels().items()})
+    return application.extensions['inventory']
+
+
+def load_app(config_name, workers=1):
+    """Import the Flask app, apply the config profile and move it all out of GC tracking"""
+    from config import load_config
+    from templating import precompile_templates
+
+    application = importlib.import_module(APP_MODULE).app
+    load_config(application, config_name)
+    share_inventory(application, workers)
+    precompile_templates(application)  # Compiled once here, inherited by every worker
+    gc.collect()
+    gc.freeze()  # Keeps the collector from touching (and so copying) shared pages after fork
+    return application
+
+
+if BaseApplication is not None:
+    class StoreServer(BaseApplication):
+        """gunicorn application configured from a dict of settings"""
+
+        def __init__(self, options, config_name):
+            self.options = options
+            self.config_name = config_name
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app(self.config_name, self.options['workers'])
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if BaseApplication is None:
+        raise SystemExit('gunicorn is not installed: pip install gunicorn')
+    os.environ['APP_CONFIG'] = args.config
+    options = gunicorn_options(args)
+    shared_inventory_url(options['workers'])  # Before workers that import the app themselves (--no-preload)
+    StoreServer(options, args.config).run()
+
+
+if __name__ == '__main__':
+    main()
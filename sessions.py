@@ -0,0 +1,156 @@
+"""
+Server-side session storage for IKW Store.
+
+Flask's default session puts the whole cart, the user's ratings and any
+pending enquiry in a signed cookie that is uploaded, verified and decoded on
+every request. ``ServerSideSessionInterface`` keeps only an opaque random id
+in the cookie and stores the session data in a local SQLite database, with
+expired sessions evicted in the background of normal writes.
+"""
+
+import secrets
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from sqlite_store import SQLiteDatabase, sqlite_path
+
+SESSION_ID_BYTES = 32
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict whose data lives on the server under ``sid``"""
+
+    def __init__(self, initial=None, sid=None, new=False, expires=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+        self.modified = False
+
+
+class SQLiteSessionStore:
+    """Session records keyed by id, with an expiry timestamp per record"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+    """
+
+    def __init__(self, path, purge_interval=60.0):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._db = SQLiteDatabase(path, self.SCHEMA)
+        self._purged_at = time.monotonic()
+
+    def load(self, sid):
+        """Return (data, expires) for a live session, or None"""
+        return self._db.connect().execute(
+            'SELECT data, expires FROM sessions WHERE sid = ? AND expires > ?',
+            (sid, time.time())).fetchone()
+
+    def save(self, sid, data, expires):
+        """Insert or replace a session record"""
+        self._db.connect().execute(
+            'INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+            (sid, data, expires))
+        self._maybe_purge()
+
+    def touch(self, sid, expires):
+        """Extend the lifetime of a session without rewriting its data"""
+        self._db.connect().execute('UPDATE sessions SET expires = ? WHERE sid = ?', (expires, sid))
+
+    def delete(self, sid):
+        """Remove a session record"""
+        self._db.connect().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def purge_expired(self):
+        """Evict every expired session; returns the number removed"""
+        self._purged_at = time.monotonic()
+        return self._db.connect().execute(
+            'DELETE FROM sessions WHERE expires <= ?', (time.time(),)).rowcount
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._purged_at >= self.purge_interval:
+            self.purge_expired()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface keeping only an opaque session id in the cookie"""
+
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+
+    def __init__(self, store):
+        self.store = store
+
+    def _new_session(self):
+        return self.session_class(sid=secrets.token_urlsafe(SESSION_ID_BYTES), new=True)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self._new_session()
+        record = self.store.load(sid)
+        if record is None:
+            return self._new_session()
+        data, expires = record
+        return self.session_class(self.serializer.loads(data), sid=sid, expires=expires)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            # Emptied session: drop the record and the cookie
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        expires = time.time() + lifetime
+        if session.modified or session.new:
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), expires)
+        elif session.expires is not None and session.expires - time.time() < lifetime / 2:
+            # Sliding expiry, but only rewrite once half the lifetime has passed
+            self.store.touch(session.sid, expires)
+        else:
+            return
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def init_session_store(app, url=None):
+    """
+    Switch ``app`` to server-side sessions when ``url`` is set.
+
+    ``'sqlite:///path/to/sessions.db'`` stores sessions in SQLite; ``None``
+    keeps Flask's signed-cookie sessions.
+    """
+    if not url:
+        return
+    app.session_interface = ServerSideSessionInterface(SQLiteSessionStore(sqlite_path(url, 'session store')))
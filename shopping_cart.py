@@ -0,0 +1,124 @@
+"""
+Session shopping cart for IKW Store.
+
+The cart is stored in the session as {product_id (str): quantity}. These
+helpers are shared by the HTML routes and the JSON API so that both mutate
+and price the cart in the same way.
+
+Pricing goes through ``Cart``, which resolves every line against the
+catalog's id index and computes subtotals, the item count and the total in
+a single pass (prices are integer minor units throughout). The session
+cart's ``Cart`` is computed once per request and shared by the page, the
+API and anything else that asks for it until the cart is saved again.
+
+Each cart has a random ``cart_id`` in the session; stock reservations
+(see ``inventory``) are held in its name, so they follow the cart rather
+than the connection or worker.
+"""
+
+import secrets
+
+from flask import g, session
+
+from catalog import get_catalog
+
+MAX_QUANTITY = 99  # Largest quantity accepted per line (matches the cart page input)
+
+
+def get_cart():
+    """Get current cart from session"""
+    return session.get('cart', {})
+
+
+def save_cart(cart):
+    """Store the cart back in the session"""
+    session['cart'] = cart
+    g.pop('_cart_summary', None)  # Re-priced on next use
+
+
+def cart_holder(current_session=None):
+    """Id under which the cart's stock reservations are held (created on first use)"""
+    current_session = session if current_session is None else current_session
+    holder = current_session.get('cart_id')
+    if holder is None:
+        holder = current_session['cart_id'] = secrets.token_urlsafe(12)
+    return holder
+
+
+def add_item(cart, product_id, quantity=1):
+    """Increase the quantity of a product in ``cart``"""
+    key = str(product_id)
+    cart[key] = cart.get(key, 0) + quantity
+
+
+def set_quantity(cart, product_id, quantity):
+    """Set the quantity of a product in ``cart``; zero or less removes it"""
+    if quantity <= 0:
+        cart.pop(str(product_id), None)
+    else:
+        cart[str(product_id)] = quantity
+
+
+def remove_item(cart, product_id):
+    """Remove a product from ``cart``"""
+    cart.pop(str(product_id), None)
+
+
+class CartLine:
+    """One priced cart line"""
+
+    __slots__ = ('product', 'quantity', 'subtotal')
+
+    def __init__(self, product, quantity, subtotal):
+        self.product = product
+        self.quantity = quantity
+        self.subtotal = subtotal
+
+    def __getitem__(self, key):
+        # Allow dict-style access (item['subtotal']) used by older call sites
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+
+class Cart:
+    """Priced snapshot of a cart: lines, item count and total computed in one pass"""
+
+    __slots__ = ('lines', 'count', 'total', 'catalog_version')
+
+    def __init__(self, contents, catalog):
+        lookup = catalog.get
+        lines = []
+        count = total = 0
+        for product_id, quantity in contents.items():
+            product = lookup(product_id)
+            if product is not None:  # Products no longer in the catalog are skipped
+                subtotal = product.price * quantity
+                lines.append(CartLine(product, quantity, subtotal))
+                count += quantity
+                total += subtotal
+        self.lines = lines
+        self.count = count
+        self.total = total
+        self.catalog_version = catalog.version
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+
+def get_cart_summary(cart=None):
+    """Priced ``cart``; the session cart is priced once per request"""
+    catalog = get_catalog()
+    if cart is not None:
+        return Cart(cart, catalog)
+    summary = g.get('_cart_summary')
+    if summary is None or summary.catalog_version != catalog.version:
+        summary = g._cart_summary = Cart(get_cart(), catalog)
+    return summary
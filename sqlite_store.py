@@ -0,0 +1,67 @@
+"""
+SQLite plumbing shared by IKW Store's multi-worker stores.
+
+Ratings, server-side sessions, the enquiry queue, rate limit buckets and
+stock can each live in a SQLite file shared by every worker process.
+``SQLiteDatabase`` handles the connections for all of them the same way:
+
+- one connection per thread, reopened after a fork (a connection must not
+  cross processes), in autocommit mode - writes that must be atomic open
+  their own ``BEGIN IMMEDIATE`` transaction
+- WAL journaling, so readers never wait for the writer, and
+  ``synchronous=NORMAL``
+- the schema (and the file's directory) created on first use, so importing
+  the app never touches the disk
+
+Stores are configured with ``sqlite:///path/to/file.db`` URLs, parsed by
+``sqlite_path``.
+"""
+
+import os
+import sqlite3
+import threading
+
+SQLITE_URL_PREFIX = 'sqlite:///'
+
+
+def sqlite_path(url, kind):
+    """Database path of a ``sqlite:///path/to/file.db`` URL (``kind`` names the store in errors)"""
+    if not url.startswith(SQLITE_URL_PREFIX):
+        raise ValueError(f'Unsupported {kind} URL: {url}')
+    return url[len(SQLITE_URL_PREFIX):]
+
+
+class SQLiteDatabase:
+    """Per-thread connections to one SQLite file whose ``schema`` script runs before the first"""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._ready = False
+
+    def connect(self):
+        """Return this thread's connection (reopened after a fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            if not self._ready:
+                self._create_schema()
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self):
+        with self._schema_lock:
+            if self._ready:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.schema)
+            conn.close()
+            self._ready = True
@@ -0,0 +1,100 @@
+"""
+Template compilation and precomputed URLs for IKW Store.
+
+- Compiled templates are kept in a filesystem bytecode cache
+  (``TEMPLATE_CACHE_DIR``, ``instance/jinja_cache`` by default) shared by
+  every worker and restart, so a new worker loads bytecode instead of
+  parsing and compiling ``base.html``, ``products.html`` and the rest.
+  ``flask --app app templates compile`` fills the cache ahead of time, and
+  ``python -m app serve`` compiles every template in the master before
+  forking so workers inherit them already loaded.
+- ``product_urls(product)`` returns the product's image and rating-form
+  URLs, built with ``url_for`` once per catalog version instead of on
+  every card render.
+"""
+
+import os
+
+import click
+from flask import current_app, request, url_for
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+PLACEHOLDER_IMAGE = 'images/placeholder.jpg'
+
+
+class LazyBytecodeCache(FileSystemBytecodeCache):
+    """Filesystem bytecode cache that creates its directory on first write"""
+
+    def dump_bytecode(self, bucket):
+        # Deferred so importing the app never touches the disk
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+
+class ProductURLs:
+    """Image and rating-form URLs of one product"""
+
+    __slots__ = ('image', 'rate')
+
+    def __init__(self, image, rate):
+        self.image = image
+        self.rate = rate
+
+
+def precompile_templates(app):
+    """Compile every template into the environment (and bytecode cache); returns the count"""
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def _url_cache():
+    """Per-product URL cache of the current catalog version, static manifest and script root"""
+    app = current_app
+    key = (app.extensions['catalog'].version, id(app.extensions.get('assets')), request.script_root)
+    cached = app.extensions.get('product_urls')
+    if cached is None or cached[0] != key:
+        cached = app.extensions['product_urls'] = (key, {
+            None: url_for('static', filename=PLACEHOLDER_IMAGE),
+        })
+    return cached[1]
+
+
+def product_urls(product):
+    """Image and rating-form URLs of ``product``, built once per catalog version"""
+    urls = _url_cache()
+    entry = urls.get(product.id)
+    if entry is None:
+        entry = urls[product.id] = ProductURLs(
+            url_for('static', filename='images/' + product.image),
+            url_for('rate_product', product_id=product.id))
+    return entry
+
+
+def placeholder_image_url():
+    """Fallback product image URL"""
+    return _url_cache()[None]
+
+
+@click.group('templates')
+def templates_cli():
+    """Template compilation"""
+
+
+@templates_cli.command('compile')
+@with_appcontext
+def compile_command():
+    """Compile every template into the bytecode cache"""
+    count = precompile_templates(current_app)
+    click.echo(f'Compiled {count} templates into {current_app.config["TEMPLATE_CACHE_DIR"]}')
+
+
+def init_templating(app):
+    """Configure the Jinja environment; must run before ``app.jinja_env`` is first used"""
+    app.config.setdefault('TEMPLATE_CACHE_DIR', os.environ.get('TEMPLATE_CACHE_DIR')
+                          or os.path.join(app.instance_path, 'jinja_cache'))
+    app.jinja_options = dict(app.jinja_options,
+                             bytecode_cache=LazyBytecodeCache(app.config['TEMPLATE_CACHE_DIR']))
+    app.cli.add_command(templates_cli)
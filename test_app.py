@@ -11,9 +11,45 @@ Test Case Attributes (ISO/IEC/IEEE 29119-3:2021):
 - Expected results
 """
 
+import asyncio
+import pstats
+import time
 import pytest
-from app import app, PRODUCTS, PRODUCT_RATINGS
+from flask import Flask, request
+from app import app, PRODUCTS, PRODUCT_RATINGS, FRAGMENT_CACHE
+from asgi import application
+import analytics
+from analytics import RatingColumns, RatingEvents, rating_report, top_rated, trending, vote_trend
+from assets import build_assets, static_srcset
+from catalog import Catalog, Product, install_catalog
+from catalog_loader import CatalogWatcher, init_catalog_source, load_catalog
+from config import load_config
+from enquiries import EnquiryProcessor, SQLiteEnquiryQueue
+from fragment_cache import FragmentCache
+import http_cache
+from inventory import MemoryInventory, SQLiteInventory
+from listing import decode_cursor, paginate
+import orders
+from orders import OrderLog
+from ratelimit import SQLiteTokenBucketLimiter, TokenBucketLimiter
+from ratings import RatingStore, SQLiteRatingStore, create_rating_store
+from recommendations import Recommender
+import serve
+from serve import gunicorn_options, parse_args
+from templating import init_templating, precompile_templates, product_urls
+from shopping_cart import Cart, get_cart_summary, save_cart
+from sessions import ServerSideSessionInterface, SQLiteSessionStore, init_session_store
+from validation import validate_enquiry, validate_input_security
+import csv
+import datetime
 import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
 
 @pytest.fixture
 def client():
@@ -23,6 +59,17 @@ def client():
         with app.app_context():
             yield client
 
+@pytest.fixture(autouse=True)
+def enquiry_queue(monkeypatch, tmp_path):
+    """Temporary enquiry queue with no worker threads (tests deliver with ``run_once``)"""
+    delivered = []
+    processor = EnquiryProcessor(SQLiteEnquiryQueue(str(tmp_path / 'enquiries.db')),
+                                 handler=delivered.append, workers=0)
+    processor.delivered = delivered
+    monkeypatch.setitem(app.config, 'ENQUIRY_QUEUE', processor.queue.path)
+    monkeypatch.setitem(app.extensions, 'enquiries', processor)
+    return processor
+
 @pytest.fixture
 def session(client):
     """Create a session for testing"""
@@ -359,6 +406,51 @@ class TestEnquiryForm:
         assert response.status_code == 200
         assert b'100 characters' in response.data or b'less than' in response.data.lower()
 
+class TestInputValidator:
+    """TC-VALID: Single-Pass Input Validator Tests"""
+    
+    def test_benign_input_passes(self):
+        """TC-VALID-001: Ordinary text, including ':' '=' ';', is accepted"""
+        assert validate_input_security('Order status: shipped; a = b') == (True, None)
+    
+    def test_rule_priority_preserved(self):
+        """TC-VALID-002: Highest-priority rule is reported when several match"""
+        # HTML tag wraps a javascript: URL - the javascript rule has priority
+        is_valid, error_msg = validate_input_security('<a href="javascript:x">')
+        assert not is_valid
+        assert error_msg == 'Javascript protocol is not allowed'
+    
+    def test_sql_patterns_detected(self):
+        """TC-VALID-003: Each SQL injection pattern is detected case-insensitively"""
+        for text in ("' or 1=1", "; drop table users", "UNION SELECT *", "/* x */"):
+            assert validate_input_security(text) == (False, 'Potentially malicious SQL patterns detected')
+    
+    def test_batch_validation_messages(self):
+        """TC-VALID-004: Batch API returns every field's error in field order"""
+        values, errors = validate_enquiry({
+            'name': ' ',
+            'email': 'bad',
+            'subject': 'S' * 201,
+            'message': 'onclick=go()'
+        })
+        assert errors == [
+            'Name is required',
+            'Invalid email format',
+            'Subject must be less than 200 characters',
+            'Message: Event handlers are not allowed',
+        ]
+    
+    def test_batch_validation_strips_values(self):
+        """TC-VALID-005: Batch API returns stripped values for valid input"""
+        values, errors = validate_enquiry({
+            'name': ' Test User ',
+            'email': 'test@example.com',
+            'subject': 'Hi',
+            'message': 'Hello'
+        })
+        assert errors == []
+        assert values['name'] == 'Test User'
+
 class TestProductRating:
     """TC-RATING: Product Rating Tests"""
     
@@ -382,8 +474,7 @@ class TestProductRating:
     def test_average_rating_calculation(self, client):
         """TC-RATING-004: Average rating is calculated correctly"""
         # Clear ratings for product 1
-        if 1 in PRODUCT_RATINGS:
-            PRODUCT_RATINGS[1] = []
+        PRODUCT_RATINGS.reset(1)
         
         # Add ratings
         client.post('/rate_product/1', data={'rating': '5'})
@@ -399,6 +490,1436 @@ class TestProductRating:
         response = client.get('/products')
         assert b'rating' in response.data.lower() or b'ratings' in response.data.lower()
 
+class TestRatingAggregates:
+    """TC-RATEAGG: Incremental Rating Aggregate Tests"""
+    
+    def test_aggregate_average_and_count(self):
+        """TC-RATEAGG-001: Average and count are kept incrementally"""
+        store = RatingStore()
+        for score in (5, 4, 3):
+            store.add(7, score)
+        assert store.average(7) == 4.0
+        assert store.count(7) == 3
+    
+    def test_aggregate_distribution(self):
+        """TC-RATEAGG-002: Vote distribution is kept in a 5-bucket histogram"""
+        store = RatingStore()
+        for score in (5, 5, 1):
+            store.add(7, score)
+        assert store.distribution(7) == {1: 1, 2: 0, 3: 0, 4: 0, 5: 2}
+    
+    def test_aggregate_unrated_product(self):
+        """TC-RATEAGG-003: Unrated products have no average and zero count"""
+        store = RatingStore()
+        assert store.average(7) is None
+        assert store.count(7) == 0
+    
+    def test_aggregate_rejects_out_of_range(self):
+        """TC-RATEAGG-004: Votes outside 1-5 are rejected"""
+        store = RatingStore()
+        with pytest.raises(ValueError):
+            store.add(7, 6)
+        assert store.count(7) == 0
+    
+    def test_migration_from_lists(self):
+        """TC-RATEAGG-005: Legacy rating lists migrate into aggregates"""
+        store = RatingStore.from_lists({1: [5, 4, 3], '2': [1, 9]})
+        assert store.average(1) == 4.0
+        assert store.count(1) == 3
+        assert store.count(2) == 1
+    
+    def test_rating_route_updates_aggregate(self, client):
+        """TC-RATEAGG-006: Rating route bumps the aggregate and version"""
+        PRODUCT_RATINGS.reset(3)
+        version = PRODUCT_RATINGS.version
+        client.post('/rate_product/3', data={'rating': '2'})
+        assert PRODUCT_RATINGS.count(3) == 1
+        assert PRODUCT_RATINGS.version > version
+
+class TestSharedRatingStore:
+    """TC-RATEDB: Shared SQLite Rating Store Tests"""
+    
+    def test_votes_visible_before_flush(self, tmp_path):
+        """TC-RATEDB-001: Votes are served from the local cache before they are flushed"""
+        store = SQLiteRatingStore(str(tmp_path / 'ratings.db'), flush_interval=60)
+        store.add(1, 5)
+        store.add(1, 3)
+        assert store.average(1) == 4.0
+        assert store.count(1) == 2
+        store.close()
+    
+    def test_votes_persist_across_instances(self, tmp_path):
+        """TC-RATEDB-002: Flushed votes survive a restart"""
+        path = str(tmp_path / 'ratings.db')
+        store = SQLiteRatingStore(path, flush_interval=60)
+        store.add(1, 5)
+        store.add(2, 1)
+        store.close()
+        reopened = SQLiteRatingStore(path)
+        assert reopened.count(1) == 1
+        assert reopened.distribution(2)[1] == 1
+        reopened.close()
+    
+    def test_cache_invalidated_by_version(self, tmp_path):
+        """TC-RATEDB-003: Another process's writes are picked up via the version counter"""
+        path = str(tmp_path / 'ratings.db')
+        writer = SQLiteRatingStore(path, flush_interval=60)
+        reader = SQLiteRatingStore(path, refresh_interval=0)
+        assert reader.count(4) == 0
+        writer.add(4, 2)
+        writer.flush()
+        assert reader.count(4) == 1
+        assert reader.average(4) == 2.0
+        writer.close()
+        reader.close()
+    
+    def test_background_flush(self, tmp_path):
+        """TC-RATEDB-004: The background thread writes votes behind in batches"""
+        import time
+        path = str(tmp_path / 'ratings.db')
+        store = SQLiteRatingStore(path, flush_interval=0.01)
+        for _ in range(10):
+            store.add(6, 4)
+        reader = SQLiteRatingStore(path, refresh_interval=0)
+        deadline = time.time() + 5
+        while reader.count(6) < 10 and time.time() < deadline:
+            time.sleep(0.01)
+        assert reader.count(6) == 10
+        store.close()
+        reader.close()
+    
+    def test_store_factory(self, tmp_path):
+        """TC-RATEDB-005: Rating stores are created from a URL"""
+        assert type(create_rating_store(None)) is RatingStore
+        store = create_rating_store(f'sqlite:///{tmp_path}/ratings.db')
+        assert isinstance(store, SQLiteRatingStore)
+        store.close()
+        with pytest.raises(ValueError):
+            create_rating_store('redis://localhost')
+
+class TestServerSideSessions:
+    """TC-SESSION: Server-Side Session Store Tests"""
+    
+    @pytest.fixture
+    def server_client(self, tmp_path):
+        """Test client using SQLite-backed sessions"""
+        original = app.session_interface
+        store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+        app.session_interface = ServerSideSessionInterface(store)
+        app.config['TESTING'] = True
+        try:
+            with app.test_client() as client:
+                yield client, store
+        finally:
+            app.session_interface = original
+    
+    def test_cookie_holds_only_session_id(self, server_client):
+        """TC-SESSION-001: Cookie carries an opaque id, not the cart"""
+        client, store = server_client
+        for product_id in range(1, 21):
+            client.get(f'/add_to_cart/{product_id}')
+        cookie = client.get_cookie('session')
+        assert len(cookie.value) < 64
+        assert store.load(cookie.value) is not None
+    
+    def test_cart_persists_server_side(self, server_client):
+        """TC-SESSION-002: Cart contents persist through the server-side store"""
+        client, _ = server_client
+        client.get('/add_to_cart/1')
+        client.get('/add_to_cart/2')
+        response = client.get('/cart')
+        assert b'Wireless Mouse' in response.data
+        assert b'Mechanical Keyboard' in response.data
+    
+    def test_anonymous_request_sets_no_cookie(self, server_client):
+        """TC-SESSION-003: Requests that never touch the session store nothing"""
+        client, _ = server_client
+        client.get('/')
+        assert client.get_cookie('session') is None
+    
+    def test_expired_sessions_evicted(self, tmp_path):
+        """TC-SESSION-004: Expired sessions are not served and are purged"""
+        import time
+        store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+        store.save('old', '{}', time.time() - 1)
+        store.save('live', '{}', time.time() + 60)
+        assert store.load('old') is None
+        assert store.purge_expired() == 1
+        assert store.load('live') is not None
+    
+    def test_unsupported_store_url(self):
+        """TC-SESSION-005: Unknown session store URLs are rejected"""
+        with pytest.raises(ValueError):
+            init_session_store(app, 'memcached://localhost')
+
+class TestFragmentCache:
+    """TC-FRAGCACHE: Rendered Fragment Cache Tests"""
+    
+    def test_lru_eviction_by_entries(self):
+        """TC-FRAGCACHE-001: Least recently used entries are evicted first"""
+        cache = FragmentCache(max_entries=2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        cache.get('a')
+        cache.set('c', 'C')
+        assert cache.get('b') is None
+        assert cache.get('a') == 'A'
+        assert cache.evictions == 1
+    
+    def test_memory_cap(self):
+        """TC-FRAGCACHE-002: Cache stays within its byte budget"""
+        cache = FragmentCache(max_bytes=2000)
+        for i in range(20):
+            cache.set(i, 'x' * 500)
+        assert cache.bytes <= 2000
+        assert len(cache) < 20
+    
+    def test_hit_miss_counters(self):
+        """TC-FRAGCACHE-003: Hits and misses are counted"""
+        cache = FragmentCache()
+        renders = []
+        for _ in range(3):
+            cache.get_or_render('k', lambda: renders.append(1) or 'v')
+        assert len(renders) == 1
+        assert cache.stats()['hits'] == 2
+        assert cache.stats()['misses'] == 1
+    
+    def test_rating_invalidates_only_affected_card(self, client):
+        """TC-FRAGCACHE-004: A new rating re-renders only that product's card"""
+        client.get('/products')
+        client.get('/products')
+        before = FRAGMENT_CACHE.stats()
+        PRODUCT_RATINGS.add(2, 5)
+        response = client.get('/products')
+        after = FRAGMENT_CACHE.stats()
+        # Page, grid and the one changed card miss; every other card hits
+        assert after['misses'] - before['misses'] == 3
+        assert after['hits'] - before['hits'] == len(PRODUCTS) - 1
+        assert b'Mechanical Keyboard' in response.data
+    
+    def test_anonymous_home_page_cached(self, client):
+        """TC-FRAGCACHE-005: Anonymous home page is served from the cache"""
+        client.get('/')
+        hits = FRAGMENT_CACHE.hits
+        response = client.get('/')
+        assert FRAGMENT_CACHE.hits == hits + 1
+        assert b'IKW Store' in response.data
+    
+    def test_cart_pages_not_page_cached(self, client):
+        """TC-FRAGCACHE-006: Pages with per-visitor content render fresh"""
+        client.get('/add_to_cart/1')
+        response = client.get('/products')
+        assert b'cart-count' in response.data
+
+class TestConditionalResponses:
+    """TC-ETAG: ETag / Conditional Response Tests"""
+    
+    def test_etag_emitted(self, client):
+        """TC-ETAG-001: Catalog pages carry an ETag and Cache-Control"""
+        response = client.get('/products')
+        assert response.headers.get('ETag')
+        assert response.headers.get('Cache-Control') == 'private, no-cache'
+    
+    def test_not_modified(self, client):
+        """TC-ETAG-002: Matching If-None-Match is answered with an empty 304"""
+        etag = client.get('/products').headers['ETag']
+        response = client.get('/products', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+    
+    def test_etag_changes_with_rating(self, client):
+        """TC-ETAG-003: A new rating changes the products ETag"""
+        etag = client.get('/products').headers['ETag']
+        PRODUCT_RATINGS.add(5, 4)
+        response = client.get('/products', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    
+    def test_etag_varies_by_search_and_cart(self, client):
+        """TC-ETAG-004: Search query and cart badge are part of the ETag"""
+        plain = client.get('/products').headers['ETag']
+        searched = client.get('/products?search=mouse').headers['ETag']
+        client.get('/add_to_cart/1')
+        client.get('/products')  # Consume the flash message
+        with_cart = client.get('/products').headers['ETag']
+        assert len({plain, searched, with_cart}) == 3
+    
+    def test_flash_messages_bypass_conditional(self, client):
+        """TC-ETAG-005: Pages showing flash messages are never answered with 304"""
+        etag = client.get('/products').headers['ETag']
+        with client.session_transaction() as sess:
+            sess['_flashes'] = [('info', 'Hello')]
+        response = client.get('/products', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert b'Hello' in response.data
+        assert response.headers['Cache-Control'] == 'no-store'
+    
+    def test_cache_control_configurable(self, client):
+        """TC-ETAG-006: Cache-Control policy is configurable per route"""
+        original = dict(app.config['CACHE_CONTROL'])
+        app.config['CACHE_CONTROL']['home'] = 'public, max-age=60'
+        try:
+            response = client.get('/')
+            assert response.headers['Cache-Control'] == 'public, max-age=60'
+        finally:
+            app.config['CACHE_CONTROL'] = original
+    
+    def test_etag_names_worker(self, client, monkeypatch):
+        """TC-ETAG-007: Another worker's equal counters do not revalidate a page it did not render"""
+        products, home = client.get('/products').headers['ETag'], client.get('/').headers['ETag']
+        monkeypatch.setattr(http_cache, '_instance', (os.getpid(), 'another-worker'))
+        response = client.get('/products', headers={'If-None-Match': products})
+        assert response.status_code == 200 and response.headers['ETag'] != products
+        assert client.get('/', headers={'If-None-Match': home}).status_code == 304  # No per-process state
+
+class TestStaticAssets:
+    """TC-ASSET: Static Asset Pipeline Tests"""
+    
+    @pytest.fixture
+    def built_static(self, tmp_path):
+        """App serving a freshly built copy of style.css"""
+        import shutil
+        (tmp_path / 'css').mkdir()
+        shutil.copy(app.static_folder + '/css/style.css', tmp_path / 'css' / 'style.css')
+        manifest = build_assets(str(tmp_path))
+        original_folder, original_manifest = app.static_folder, app.extensions['assets']
+        app.static_folder, app.extensions['assets'] = str(tmp_path), manifest
+        try:
+            yield manifest
+        finally:
+            app.static_folder, app.extensions['assets'] = original_folder, original_manifest
+    
+    def test_build_writes_manifest_and_gzip(self, built_static, tmp_path):
+        """TC-ASSET-001: Build fingerprints files and writes gzip variants"""
+        entry = built_static['css/style.css']
+        assert len(entry['hash']) == 16
+        assert (tmp_path / 'build' / 'css' / 'style.css.gz').exists()
+        assert (tmp_path / 'build' / 'manifest.json').exists()
+    
+    def test_url_for_adds_fingerprint(self, built_static):
+        """TC-ASSET-002: url_for('static') emits fingerprinted URLs"""
+        from flask import url_for
+        with app.test_request_context():
+            url = url_for('static', filename='css/style.css')
+        assert url == '/static/css/style.css?v=' + built_static['css/style.css']['hash']
+    
+    def test_fingerprinted_asset_immutable_and_precompressed(self, client, built_static):
+        """TC-ASSET-003: Fingerprinted requests get immutable caching and gzip"""
+        import gzip
+        version = built_static['css/style.css']['hash']
+        response = client.get(f'/static/css/style.css?v={version}', headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.mimetype == 'text/css'
+        assert b'.logo-img' in gzip.decompress(response.data)
+    
+    def test_identity_encoding_fallback(self, client, built_static):
+        """TC-ASSET-004: Clients without gzip get the original file"""
+        version = built_static['css/style.css']['hash']
+        response = client.get(f'/static/css/style.css?v={version}', headers={'Accept-Encoding': 'identity'})
+        assert 'Content-Encoding' not in response.headers
+        assert b'.logo-img' in response.data
+    
+    def test_unbuilt_assets_served_normally(self, client):
+        """TC-ASSET-005: Without a build, static files are served as before"""
+        response = client.get('/static/css/style.css')
+        assert response.status_code == 200
+        assert 'immutable' not in response.headers.get('Cache-Control', '')
+    
+    def test_srcset_under_script_root(self, monkeypatch):
+        """TC-ASSET-006: WebP srcset URLs include the prefix the app is mounted under"""
+        entry = {'hash': 'abc123', 'webp': 'build/logo.webp', 'width': 160, 'sizes': {'80': 'build/logo-80.webp'}}
+        monkeypatch.setitem(app.extensions, 'assets', {'images/logo.png': entry})
+        with app.test_request_context('/', base_url='http://localhost/shop'):
+            assert static_srcset('images/logo.png') == ('/shop/static/build/logo-80.webp?v=abc123 80w, '
+                                                        '/shop/static/build/logo.webp?v=abc123 160w')
+
+class TestJSONAPI:
+    """TC-API: JSON API Tests"""
+    
+    def test_api_product_listing(self, client):
+        """TC-API-001: Catalog listing is paginated JSON with rating summaries"""
+        response = client.get('/api/v1/products?offset=5&limit=5')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['total'] == len(PRODUCTS)
+        assert [p['id'] for p in data['products']] == [6, 7, 8, 9, 10]
+        assert 'average' in data['products'][0]['rating']
+    
+    def test_api_search(self, client):
+        """TC-API-002: Search endpoint returns ranked matches"""
+        data = client.get('/api/v1/search?q=keyboard').get_json()
+        assert data['products'][0]['name'] == 'Mechanical Keyboard'
+    
+    def test_api_add_to_cart(self, client):
+        """TC-API-003: Adding a cart item returns the updated cart"""
+        client.post('/api/v1/cart/items', json={'product_id': 1})
+        data = client.post('/api/v1/cart/items', json={'product_id': 1, 'quantity': 2}).get_json()
+        assert data['lines'] == [{'product_id': 1, 'name': 'Wireless Mouse', 'unit_price': 2500,
+                                  'quantity': 3, 'subtotal': 7500}]
+        assert data['total'] == 7500
+    
+    def test_api_batch_cart_update(self, client):
+        """TC-API-004: Batch endpoint applies many line changes and returns totals"""
+        client.post('/api/v1/cart/items', json={'product_id': 3})
+        data = client.post('/api/v1/cart/batch', json={'lines': [
+            {'product_id': 1, 'quantity': 2},
+            {'product_id': 2, 'quantity': 1},
+            {'product_id': 3, 'quantity': 0},
+        ]}).get_json()
+        assert {line['product_id']: line['quantity'] for line in data['lines']} == {1: 2, 2: 1}
+        assert data['total'] == 2 * 2500 + 8500
+        assert data['count'] == 3
+    
+    def test_api_batch_is_all_or_nothing(self, client):
+        """TC-API-005: An invalid line rejects the whole batch"""
+        response = client.post('/api/v1/cart/batch', json={'lines': [
+            {'product_id': 1, 'quantity': 2},
+            {'product_id': 999, 'quantity': 1},
+        ]})
+        assert response.status_code == 404
+        assert 'lines[1]' in response.get_json()['error']
+        assert client.get('/api/v1/cart').get_json()['lines'] == []
+    
+    def test_api_cart_shared_with_html(self, client):
+        """TC-API-006: API cart changes show up on the HTML cart page"""
+        client.put('/api/v1/cart/items/2', json={'quantity': 4})
+        response = client.get('/cart')
+        assert b'Mechanical Keyboard' in response.data
+        assert b'\xc2\xa534000' in response.data
+    
+    def test_api_rating(self, client):
+        """TC-API-007: Rating endpoint returns the updated summary"""
+        PRODUCT_RATINGS.reset(8)
+        client.post('/api/v1/products/8/ratings', json={'rating': 5})
+        data = client.post('/api/v1/products/8/ratings', json={'rating': 3}).get_json()
+        assert data['average'] == 4.0
+        assert data['count'] == 2
+    
+    def test_api_validation_errors(self, client):
+        """TC-API-008: Invalid input is rejected with a JSON error"""
+        assert client.post('/api/v1/products/1/ratings', json={'rating': 6}).status_code == 400
+        assert client.post('/api/v1/cart/items', json={'product_id': 1, 'quantity': 'x'}).status_code == 400
+        assert client.get('/api/v1/products/999').status_code == 404
+        assert client.get('/api/v1/products?limit=0').get_json()['error']
+    
+    def test_api_enquiry(self, client):
+        """TC-API-009: Enquiry endpoint applies the form validation rules"""
+        enquiry = {'name': 'Ann', 'email': 'ann@example.com', 'subject': 'Hi', 'message': 'Hello'}
+        response = client.post('/api/v1/enquiries', json=enquiry)
+        assert response.status_code == 201
+        assert response.get_json()['enquiry']['email'] == 'ann@example.com'
+        response = client.post('/api/v1/enquiries', json=dict(enquiry, email='nope'))
+        assert response.status_code == 400
+        assert 'Invalid email format' in response.get_json()['error']
+
+
+def asgi_request(method, path, body=b'', headers=(), query=b''):
+    """Drive the ASGI application once; returns (status, headers, body)"""
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': [(k.encode(), v.encode()) for k, v in headers], 'scheme': 'http',
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 1234), 'http_version': '1.1'}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    response_headers = {}
+    for name, value in sent[0]['headers']:
+        response_headers.setdefault(name.decode(), value.decode())
+    return sent[0]['status'], response_headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+
+class TestASGI:
+    """TC-ASGI: Async Serving Mode Tests"""
+    
+    def test_asgi_catalog(self):
+        """TC-ASGI-001: Catalog endpoints are served natively with the same JSON"""
+        status, headers, body = asgi_request('GET', '/api/v1/products', query=b'limit=3')
+        assert status == 200
+        assert headers['content-type'] == 'application/json'
+        assert [p['id'] for p in json.loads(body)['products']] == [1, 2, 3]
+        status, _, body = asgi_request('GET', '/api/v1/search', query=b'q=keyboard')
+        assert json.loads(body)['products'][0]['name'] == 'Mechanical Keyboard'
+    
+    def test_asgi_cart_session(self):
+        """TC-ASGI-002: Cart changes persist across requests through the session cookie"""
+        status, headers, body = asgi_request('POST', '/api/v1/cart/items', b'{"product_id": 1, "quantity": 2}',
+                                             [('content-type', 'application/json')])
+        assert status == 200
+        cookie = headers['set-cookie'].split(';', 1)[0]
+        assert json.loads(body)['total'] == 5000
+        _, _, body = asgi_request('GET', '/api/v1/cart', headers=[('cookie', cookie)])
+        assert json.loads(body)['lines'][0]['quantity'] == 2
+        # The HTML cart page (served through the WSGI fallback) sees the same cart
+        status, _, body = asgi_request('GET', '/cart', headers=[('cookie', cookie)])
+        assert status == 200
+        assert b'Wireless Mouse' in body
+    
+    def test_asgi_rating_and_errors(self, monkeypatch):
+        """TC-ASGI-003: Ratings are recorded and invalid input gets a JSON error"""
+        PRODUCT_RATINGS.reset(9)
+        PRODUCT_RATINGS.reset(10)
+        recommender = Recommender(interval=None)
+        monkeypatch.setitem(app.extensions, 'recommendations', recommender)
+        status, headers, body = asgi_request('POST', '/api/v1/products/9/ratings', b'{"rating": 4}',
+                                             [('content-type', 'application/json')])
+        assert status == 200
+        assert json.loads(body)['count'] == 1
+        # Same rating path as the Flask view: the visitor's ratings are kept and paired
+        cookie = headers['set-cookie'].split(';', 1)[0]
+        status, _, body = asgi_request('POST', '/api/v1/products/10/ratings', b'{"rating": 5}',
+                                       [('content-type', 'application/json'), ('cookie', cookie)])
+        assert json.loads(body)['your_rating'] == 5
+        assert recommender.recommend(10) == (9,)
+        PRODUCT_RATINGS.reset(10)
+        status, _, body = asgi_request('POST', '/api/v1/products/9/ratings', b'{"rating": 9}',
+                                       [('content-type', 'application/json')])
+        assert status == 400
+        assert 'rating' in json.loads(body)['error']
+    
+    def test_asgi_enquiry_form(self):
+        """TC-ASGI-004: Valid enquiries redirect natively; invalid ones render errors via Flask"""
+        form = 'name=Ann&email=ann%40example.com&subject=Hi&message=Hello'
+        form_type = [('content-type', 'application/x-www-form-urlencoded')]
+        status, headers, _ = asgi_request('POST', '/enquiry', form.encode(), form_type)
+        assert status == 302
+        assert headers['location'].endswith('/enquiry/confirmation')
+        status, _, body = asgi_request('POST', '/enquiry', form.replace('ann%40', 'ann').encode(), form_type)
+        assert status == 200
+        assert b'Invalid email format' in body
+    
+    def test_asgi_wsgi_fallback(self):
+        """TC-ASGI-005: Other pages are served by the Flask app"""
+        status, headers, body = asgi_request('GET', '/')
+        assert status == 200
+        assert b'IKW' in body
+        assert asgi_request('GET', '/no-such-page')[0] == 404
+    
+    def test_asgi_streamed_page(self, monkeypatch):
+        """TC-ASGI-006: Streamed templates keep the request context for every chunk"""
+        monkeypatch.setitem(app.config, 'STREAM_PRODUCT_LIST', True)
+        status, headers, body = asgi_request('GET', '/products', query=b'sort=name')
+        assert status == 200 and 'content-length' not in headers
+        assert body.count(b'class="product-card"') == len(PRODUCTS)
+        assert body.rstrip().endswith(b'</html>')
+    
+    def test_asgi_disconnect_mid_body(self, enquiry_queue):
+        """TC-ASGI-007: A client that disconnects mid-body is not answered and its request not run"""
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/v1/enquiries', 'query_string': b'',
+                 'headers': [(b'content-type', b'application/json')], 'client': ('127.0.0.1', 1234)}
+        enquiry = json.dumps({'name': 'Ann', 'email': 'ann@example.com', 'subject': 'Hi', 'message': 'Hello'})
+        messages = [{'type': 'http.request', 'body': enquiry[:20].encode(), 'more_body': True},
+                    {'type': 'http.disconnect'}]
+        sent = []
+        
+        async def receive():
+            return messages.pop(0)
+        
+        async def send(message):
+            sent.append(message)
+        
+        asyncio.run(application(scope, receive, send))
+        assert sent == []
+        assert enquiry_queue.queue.counts()['pending'] == 0
+    
+    def test_asgi_background_and_metrics(self, instrumented, monkeypatch):
+        """TC-ASGI-008: Native handlers start the background threads and are counted in /metrics"""
+        recommender = Recommender(interval=60.0)
+        monkeypatch.setitem(app.extensions, 'recommendations', recommender)
+        assert asgi_request('GET', '/api/v1/products')[0] == 200
+        assert recommender._pid == os.getpid()
+        text = instrumented.get('/metrics').get_data(as_text=True)
+        assert 'endpoint="api.list_products",method="GET"' in text
+
+class TestEnquiryQueue:
+    """TC-ENQQ: Durable Enquiry Queue Tests"""
+    
+    def test_form_submission_is_queued(self, client, enquiry_queue):
+        """TC-ENQQ-001: A valid enquiry is appended to the durable queue and delivered from it"""
+        response = client.post('/enquiry', data={'name': 'Ann', 'email': 'ann@example.com',
+                                                 'subject': 'Stock', 'message': 'Is the dock in stock?'})
+        assert response.status_code == 302
+        assert enquiry_queue.queue.counts()['pending'] == 1
+        assert enquiry_queue.run_once() == 1
+        assert enquiry_queue.delivered[0]['email'] == 'ann@example.com'
+        assert enquiry_queue.metrics()['delivered_total'] == 1
+    
+    def test_batch_delivery_and_metrics(self, tmp_path):
+        """TC-ENQQ-002: Workers deliver queued enquiries in batches and report latency"""
+        delivered = []
+        processor = EnquiryProcessor(SQLiteEnquiryQueue(str(tmp_path / 'q.db')), handler=delivered.append,
+                                     batch_size=2)
+        for n in range(3):
+            processor.queue.enqueue({'n': n})
+        assert processor.metrics()['depth'] == 3
+        assert processor.run_once() == 2
+        assert processor.run_once() == 1
+        assert [record['n'] for record in delivered] == [0, 1, 2]
+        metrics = processor.metrics()
+        assert (metrics['depth'], metrics['delivered_total'], metrics['processed']) == (0, 3, 3)
+        assert metrics['latency_max_seconds'] >= metrics['latency_p50_seconds'] >= 0
+    
+    def test_background_workers(self, tmp_path):
+        """TC-ENQQ-003: Submitting starts the worker pool, which drains the queue and stops cleanly"""
+        delivered = []
+        processor = EnquiryProcessor(SQLiteEnquiryQueue(str(tmp_path / 'q.db')), handler=delivered.append,
+                                     poll_interval=0.05)
+        processor.submit({'n': 1})
+        deadline = time.time() + 5
+        while not delivered and time.time() < deadline:
+            time.sleep(0.01)
+        processor.stop()
+        assert delivered == [{'n': 1}]
+        assert not any(thread.name.startswith('enquiry-worker') for thread in threading.enumerate())
+    
+    def test_retry_then_dead_letter(self, tmp_path):
+        """TC-ENQQ-004: Failed deliveries are retried, then dead-lettered"""
+        def failing(record):
+            raise OSError('mail server down')
+        processor = EnquiryProcessor(SQLiteEnquiryQueue(str(tmp_path / 'q.db')), handler=failing,
+                                     max_attempts=2, backoff=0)
+        processor.queue.enqueue({'n': 1})
+        processor.run_once()
+        assert processor.queue.counts()['pending'] == 1
+        assert processor.retried == 1
+        processor.run_once()
+        assert processor.queue.counts()['dead'] == 1
+        assert processor.metrics()['depth'] == 0
+        assert processor.queue.requeue_dead() == 1
+        assert processor.queue.counts()['pending'] == 1
+    
+    def test_expired_lease_is_reclaimed(self, tmp_path):
+        """TC-ENQQ-005: Work claimed by a crashed worker is handed out again after its lease"""
+        queue = SQLiteEnquiryQueue(str(tmp_path / 'q.db'), lease=60)
+        queue.enqueue({'n': 1})
+        assert len(queue.claim(10, 'a')) == 1
+        assert queue.claim(10, 'b') == []
+        expired = SQLiteEnquiryQueue(str(tmp_path / 'q.db'), lease=0)
+        expired.enqueue({'n': 2})
+        assert len(expired.claim(10, 'c')) == 1
+        time.sleep(0.01)
+        assert len(expired.claim(10, 'd')) == 1
+
+
+@pytest.fixture
+def instrumented(client, monkeypatch, tmp_path):
+    """Client with instrumentation switched on and empty metrics"""
+    monkeypatch.setitem(app.config, 'INSTRUMENTATION', True)
+    monkeypatch.setitem(app.config, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    app.extensions['instrumentation'].reset()
+    return client
+
+
+class TestInstrumentation:
+    """TC-INSTR: Request Instrumentation Tests"""
+    
+    def test_metrics_disabled_by_default(self, client):
+        """TC-INSTR-001: /metrics does not exist unless instrumentation is enabled"""
+        assert client.get('/metrics').status_code == 404
+    
+    def test_route_latency_histograms(self, instrumented):
+        """TC-INSTR-002: Requests are counted in per-endpoint Prometheus histograms"""
+        instrumented.get('/products')
+        instrumented.get('/products')
+        instrumented.get('/no-such-page')
+        response = instrumented.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        text = response.get_data(as_text=True)
+        assert 'ikw_request_duration_seconds_count{endpoint="products",method="GET"} 2' in text
+        assert 'ikw_request_duration_seconds_bucket{endpoint="products",method="GET",le="+Inf"} 2' in text
+        assert 'ikw_requests_total{endpoint="unmatched",method="GET",status="404"} 1' in text
+        assert 'ikw_fragment_cache_hits_total' in text
+        assert 'ikw_enquiry_queue_depth' in text
+    
+    def test_phase_timings(self, instrumented):
+        """TC-INSTR-003: Template, session, validation and catalog time is recorded per endpoint"""
+        instrumented.get('/add_to_cart/1')
+        instrumented.get('/cart')
+        instrumented.post('/enquiry', data={'name': 'Ann', 'email': 'bad', 'subject': 'S', 'message': 'M'})
+        text = instrumented.get('/metrics').get_data(as_text=True)
+        for endpoint, phase_name in (('cart', 'template'), ('cart', 'session_load'), ('cart', 'catalog'),
+                                     ('add_to_cart', 'session_save'), ('enquiry', 'validation')):
+            assert f'ikw_phase_duration_seconds_count{{endpoint="{endpoint}",phase="{phase_name}"}} 1' in text
+    
+    def test_profile_on_header(self, instrumented, tmp_path, monkeypatch):
+        """TC-INSTR-004: X-Profile with the metrics token writes a cProfile dump named in the response"""
+        assert 'X-Profile-Dump' not in instrumented.get('/products', headers={'X-Profile': '1'}).headers
+        monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+        response = instrumented.get('/products', headers={'X-Profile': 's3cret'})
+        dump = tmp_path / 'profiles' / response.headers['X-Profile-Dump']
+        assert dump.exists()
+        assert pstats.Stats(str(dump)).total_calls > 0
+        assert 'X-Profile-Dump' not in instrumented.get('/products').headers
+    
+    def test_metrics_token(self, instrumented, monkeypatch):
+        """TC-INSTR-005: METRICS_TOKEN protects /metrics and on-demand profiling"""
+        monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+        assert instrumented.get('/metrics').status_code == 401
+        assert instrumented.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+        assert 'X-Profile-Dump' not in instrumented.get('/', headers={'X-Profile': '1'}).headers
+        assert 'X-Profile-Dump' in instrumented.get('/', headers={'X-Profile': 's3cret'}).headers
+
+
+class TestServerConfig:
+    """TC-SERVE: Production Server and Configuration Tests"""
+    
+    def test_development_profile(self, monkeypatch):
+        """TC-SERVE-001: Development profile works without any environment"""
+        monkeypatch.delenv('SECRET_KEY', raising=False)
+        target = Flask(__name__)
+        load_config(target, 'development')
+        assert target.secret_key
+        assert target.config['SESSION_COOKIE_SECURE'] is False
+    
+    def test_production_requires_secret_key(self, monkeypatch):
+        """TC-SERVE-002: Production profile takes SECRET_KEY from the environment only"""
+        monkeypatch.delenv('SECRET_KEY', raising=False)
+        with pytest.raises(RuntimeError):
+            load_config(Flask(__name__), 'production')
+        monkeypatch.setenv('SECRET_KEY', 'from-the-environment')
+        target = Flask(__name__)
+        load_config(target, 'production')
+        assert target.secret_key == 'from-the-environment'
+        assert target.config['SESSION_COOKIE_SECURE'] is True
+        with pytest.raises(ValueError):
+            load_config(Flask(__name__), 'staging')
+    
+    def test_gunicorn_options(self):
+        """TC-SERVE-003: Serve arguments map to a preloaded threaded worker setup"""
+        options = gunicorn_options(parse_args(['--workers', '3', '--threads', '8', '--backlog', '512',
+                                               '--keepalive', '10', '--max-requests', '1000']))
+        assert options['workers'] == 3
+        assert options['worker_class'] == 'gthread'
+        assert options['preload_app'] is True
+        assert (options['backlog'], options['keepalive']) == (512, 10)
+        assert options['max_requests_jitter'] == 100
+        options = gunicorn_options(parse_args(['--threads', '1', '--no-preload']))
+        assert options['worker_class'] == 'sync'
+        assert options['preload_app'] is False
+        assert options['workers'] >= 3
+    
+    def test_proxy_hops(self, monkeypatch):
+        """TC-SERVE-004: Production trusts one proxy's X-Forwarded-For for the client IP"""
+        monkeypatch.setenv('SECRET_KEY', 'from-the-environment')
+        monkeypatch.delenv('PROXY_FIX_HOPS', raising=False)
+        
+        def client_ip(profile):
+            target = Flask(__name__)
+            load_config(target, profile)
+            target.add_url_rule('/ip', 'ip', lambda: request.remote_addr)
+            headers = {'X-Forwarded-For': '203.0.113.7, 198.51.100.2'}
+            return target.test_client().get('/ip', headers=headers).get_data(as_text=True)
+        
+        assert client_ip('production') == '198.51.100.2'
+        assert client_ip('development') == '127.0.0.1'  # Forwarded headers are not trusted
+        monkeypatch.setenv('PROXY_FIX_HOPS', '2')
+        assert client_ip('production') == '203.0.113.7'
+    
+    def test_launcher_imports_no_app_code(self):
+        """TC-SERVE-005: The server launcher leaves app imports to the workers (--no-preload reloads code)"""
+        check = "import serve, sys; print(sorted({'app', 'config', 'inventory', 'templating'} & set(sys.modules)))"
+        output = subprocess.run([sys.executable, '-c', check], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        assert output.strip() == '[]'
+
+
+class TestTemplating:
+    """TC-TPL: Template Compilation and Precomputed URL Tests"""
+    
+    def test_bytecode_cache_precompile(self, tmp_path):
+        """TC-TPL-001: Templates are compiled ahead of time into the bytecode cache"""
+        target = Flask('app', root_path=app.root_path)
+        target.config['TEMPLATE_CACHE_DIR'] = str(tmp_path / 'jinja')
+        init_templating(target)
+        count = precompile_templates(target)
+        assert count >= 7
+        assert len(list((tmp_path / 'jinja').iterdir())) == count
+        # A new worker loads the bytecode instead of compiling the source
+        fresh = Flask('app', root_path=app.root_path)
+        fresh.config['TEMPLATE_CACHE_DIR'] = str(tmp_path / 'jinja')
+        init_templating(fresh)
+        assert precompile_templates(fresh) == count
+    
+    def test_product_card_urls(self, client):
+        """TC-TPL-002: Product cards use the precomputed image and rating URLs"""
+        response = client.get('/products')
+        assert response.status_code == 200
+        with app.test_request_context():
+            from flask import url_for
+            assert url_for('static', filename='images/mouse.svg').encode() in response.data
+            assert f'action="{url_for("rate_product", product_id=1)}"'.encode() in response.data
+    
+    def test_product_urls_per_catalog_version(self, client):
+        """TC-TPL-003: Product URLs are built once per catalog version"""
+        original = app.extensions['catalog']
+        with app.test_request_context():
+            product = original.get(1)
+            assert product_urls(product) is product_urls(product)
+            first = product_urls(product)
+            assert first.rate == '/rate_product/1'
+            install_catalog(app, Catalog(PRODUCTS, version=original.version + 1))
+            try:
+                assert product_urls(product) is not first
+                assert product_urls(product).image == first.image
+            finally:
+                install_catalog(app, original)
+
+
+class TestCartSummary:
+    """TC-CARTSUM: Single-Pass Cart Pricing Tests"""
+    
+    def test_single_pass_pricing(self):
+        """TC-CARTSUM-001: Lines, item count and total are priced in integer minor units"""
+        summary = Cart({'1': 2, '3': 1, '999': 4}, Catalog(PRODUCTS))
+        assert [(line.product.id, line.quantity, line.subtotal) for line in summary] == [(1, 2, 5000), (3, 1, 3200)]
+        assert summary.count == 3
+        assert summary.total == 8200
+        assert isinstance(summary.total, int)
+        assert summary.lines[0]['subtotal'] == 5000
+        assert not Cart({}, Catalog(PRODUCTS))
+    
+    def test_summary_cached_per_request(self, client):
+        """TC-CARTSUM-002: The session cart is priced once per request until it is saved"""
+        with app.test_request_context():
+            from flask import session as request_session
+            request_session['cart'] = {'1': 1}
+            summary = get_cart_summary()
+            assert get_cart_summary() is summary
+            save_cart({'1': 1, '2': 1})
+            assert get_cart_summary() is not summary
+            assert get_cart_summary().total == 2500 + 8500
+    
+    def test_large_cart(self, client, session):
+        """TC-CARTSUM-003: Carts with hundreds of lines are priced correctly"""
+        original = app.extensions['catalog']
+        products = [dict(product, id=product['id'] + 20 * n) for n in range(25) for product in PRODUCTS]
+        install_catalog(app, Catalog(products, version=original.version + 1))
+        try:
+            with client.session_transaction() as sess:
+                sess['cart'] = {str(product['id']): 2 for product in products}
+            data = client.get('/api/v1/cart').get_json()
+            assert len(data['lines']) == 500
+            assert data['count'] == 1000
+            assert data['total'] == 2 * 25 * sum(product['price'] for product in PRODUCTS)
+            assert client.get('/cart').status_code == 200
+        finally:
+            install_catalog(app, original)
+
+
+class TestPagination:
+    """TC-PAGE: Sorted, Cursor-Paginated Product Listing Tests"""
+    
+    def test_cursor_pages_cover_catalog(self, client, monkeypatch):
+        """TC-PAGE-001: Following the next-page cursors lists every product exactly once"""
+        monkeypatch.setitem(app.config, 'PRODUCTS_PER_PAGE', 8)
+        seen, url, pages = [], '/products?sort=price', 0
+        while url:
+            html = client.get(url).data.decode()
+            seen += [int(i) for i in re.findall(r'id="rating-form-(\d+)"', html)]
+            match = re.search(r'href="([^"]*cursor=[^"]*)" class="btn btn-primary">Next page', html)
+            url = match.group(1).replace('&amp;', '&') if match else None
+            pages += 1
+        assert pages == 3
+        assert sorted(seen) == list(range(1, 21))
+        assert seen == [p['id'] for p in sorted(PRODUCTS, key=lambda p: (p['price'], p['id']))]
+    
+    def test_sort_orders(self):
+        """TC-PAGE-002: Price, name and search listings come back in the requested order"""
+        catalog, ratings = Catalog(PRODUCTS), RatingStore()
+        by_price = paginate(catalog, ratings, sort='price', per_page=20).products
+        assert [p.price for p in by_price] == sorted(p['price'] for p in PRODUCTS)
+        by_price_desc = paginate(catalog, ratings, sort='price_desc', per_page=5).products
+        assert by_price_desc[0].name == 'Portable Monitor'
+        by_name = paginate(catalog, ratings, sort='name', per_page=20).products
+        assert [p.name for p in by_name] == sorted((p['name'] for p in PRODUCTS), key=str.casefold)
+        matches = paginate(catalog, ratings, 'usb', sort='price', per_page=20).products
+        assert [p.price for p in matches] == sorted(p.price for p in matches)
+        assert paginate(catalog, ratings, sort='bogus', per_page=20).products == list(catalog.products)
+    
+    def test_rating_order_and_cursor_checks(self, client):
+        """TC-PAGE-003: Rating order follows new votes; cursors are bound to their sort order"""
+        catalog, ratings = Catalog(PRODUCTS), RatingStore()
+        ratings.add(5, 4)
+        ratings.add(9, 5)
+        page = paginate(catalog, ratings, sort='rating', per_page=3)
+        assert [p.id for p in page.products] == [9, 5, 1]  # Unrated products last, in catalog order
+        ratings.add(5, 5)
+        ratings.add(5, 5)
+        assert [p.id for p in paginate(catalog, ratings, sort='rating', per_page=2).products] == [9, 5]
+        ratings.add(9, 1)
+        assert [p.id for p in paginate(catalog, ratings, sort='rating', per_page=2).products] == [5, 9]
+        with pytest.raises(ValueError):
+            decode_cursor(page.next_cursor, 'price')
+        with pytest.raises(ValueError):
+            paginate(catalog, ratings, sort='rating', cursor='not-a-cursor')
+        # A cursor from another sort order falls back to the first page
+        assert client.get(f'/products?sort=price&cursor={page.next_cursor}').status_code == 200
+    
+    def test_streamed_listing(self, client, monkeypatch):
+        """TC-PAGE-004: The optional streamed mode flushes the same product listing"""
+        monkeypatch.setitem(app.config, 'STREAM_PRODUCT_LIST', True)
+        response = client.get('/products?sort=name')
+        assert response.is_streamed
+        html = response.get_data(as_text=True)
+        assert len(re.findall(r'id="rating-form-(\d+)"', html)) == 20
+        assert html.index('Bluetooth Speaker') < html.index('Wrist Rest')
+
+
+@pytest.fixture
+def rate_limited(client, monkeypatch):
+    """Client with rate limiting on and fresh in-memory buckets"""
+    monkeypatch.setitem(app.config, 'RATELIMIT_ENABLED', True)
+    monkeypatch.setitem(app.extensions, 'ratelimit', TokenBucketLimiter())
+    return client
+
+class TestRateLimit:
+    """TC-RATELIMIT: Rate Limiting Tests"""
+    
+    def test_token_bucket(self, monkeypatch):
+        """TC-RATELIMIT-001: A bucket allows its burst, then refills at the configured rate"""
+        clock = [1000.0]
+        monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+        limiter = TokenBucketLimiter()
+        assert [limiter.acquire('a', 3, 60) for _ in range(3)] == [0, 0, 0]
+        assert limiter.acquire('a', 3, 60) == pytest.approx(20.0)
+        assert limiter.acquire('b', 3, 60) == 0  # Separate client
+        clock[0] += 20
+        assert limiter.acquire('a', 3, 60) == 0
+        assert limiter.acquire('a', 3, 60) > 0
+    
+    def test_shared_sqlite_buckets(self, tmp_path):
+        """TC-RATELIMIT-002: Workers sharing the SQLite store draw from the same bucket"""
+        path = str(tmp_path / 'ratelimit.db')
+        worker_a, worker_b = SQLiteTokenBucketLimiter(path), SQLiteTokenBucketLimiter(path)
+        assert worker_a.acquire('ip:10.0.0.1', 2, 60) == 0
+        assert worker_b.acquire('ip:10.0.0.1', 2, 60) == 0
+        assert worker_a.acquire('ip:10.0.0.1', 2, 60) > 0
+        assert worker_b.acquire('ip:10.0.0.2', 2, 60) == 0
+    
+    def test_rating_flood_rejected(self, rate_limited, monkeypatch):
+        """TC-RATELIMIT-003: Rating POSTs over the limit get a 429 and are not recorded"""
+        monkeypatch.setitem(app.config, 'RATE_LIMITS', {'rate_product': (2, 60.0)})
+        PRODUCT_RATINGS.reset(4)
+        for _ in range(2):
+            assert rate_limited.post('/rate_product/4', data={'rating': '5'}).status_code == 302
+        response = rate_limited.post('/rate_product/4', data={'rating': '1'})
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+        assert PRODUCT_RATINGS.count(4) == 2
+        # Reads are never limited, and other clients have their own bucket
+        assert rate_limited.get('/products').status_code == 200
+        response = rate_limited.post('/rate_product/4', data={'rating': '5'},
+                                     environ_base={'REMOTE_ADDR': '10.1.2.3'})
+        assert response.status_code == 302
+    
+    def test_api_and_asgi_enquiry_limits(self, rate_limited, monkeypatch):
+        """TC-RATELIMIT-004: Enquiry limits apply to the JSON API and the ASGI handlers"""
+        monkeypatch.setitem(app.config, 'RATE_LIMITS', {'api.submit_enquiry': (1, 300.0)})
+        enquiry = {'name': 'Ann', 'email': 'ann@example.com', 'subject': 'Hi', 'message': 'Hello there'}
+        assert rate_limited.post('/api/v1/enquiries', json=enquiry).status_code == 201
+        response = rate_limited.post('/api/v1/enquiries', json=enquiry)
+        assert response.status_code == 429
+        assert 'error' in response.get_json()
+        status, headers, _ = asgi_request('POST', '/api/v1/enquiries', json.dumps(enquiry).encode(),
+                                          headers=[('Content-Type', 'application/json')])
+        assert status == 429
+        assert headers['retry-after']
+    
+    def test_session_key_without_cookie(self, rate_limited, monkeypatch, tmp_path):
+        """TC-RATELIMIT-005: Clients that drop the session cookie are still limited by IP"""
+        monkeypatch.setitem(app.config, 'RATE_LIMITS', {'rate_product': (2, 60.0)})
+        monkeypatch.setitem(app.config, 'RATELIMIT_KEY', 'session')
+        monkeypatch.setattr(app, 'session_interface',
+                            ServerSideSessionInterface(SQLiteSessionStore(str(tmp_path / 'sessions.db'))))
+        with app.test_client(use_cookies=False) as cookieless:
+            codes = [cookieless.post('/rate_product/4', data={'rating': '5'}).status_code for _ in range(4)]
+        assert codes == [302, 302, 429, 429]
+        with app.test_client() as returning:  # Same IP, but its own bucket once the session cookie comes back
+            returning.get('/add_to_cart/1')
+            codes = [returning.post('/rate_product/4', data={'rating': '5'}).status_code for _ in range(3)]
+        assert codes == [302, 302, 429]
+
+
+@pytest.fixture
+def stocked(client, monkeypatch):
+    """Client with a fresh in-memory inventory (products untracked until stocked)"""
+    inventory = MemoryInventory()
+    monkeypatch.setitem(app.extensions, 'inventory', inventory)
+    return client, inventory
+
+class TestInventory:
+    """TC-INV: Stock Reservation Tests"""
+    
+    def test_reserve_and_expire(self):
+        """TC-INV-001: Reservations hold stock until released, committed or expired"""
+        inventory = MemoryInventory(ttl=60)
+        assert inventory.reserve('a', 1, 5)  # Untracked products are unlimited
+        inventory.set_stock(1, 3)
+        assert inventory.reserve('a', 1, 2)
+        assert not inventory.reserve('b', 1, 2)
+        assert inventory.reserve('a', 1, 3)  # Raising one's own hold
+        assert inventory.reserve('a', 1, 0)
+        assert inventory.stock(1) == {'on_hand': 3, 'reserved': 0, 'available': 3}
+        inventory.ttl = 0
+        assert inventory.reserve('b', 1, 3)
+        assert inventory.reserve('c', 1, 3)  # b's hold has expired
+        assert inventory.commit('c', {1: 3, 2: 1}) == []
+        assert inventory.stock(1) == {'on_hand': 0, 'reserved': 0, 'available': 0}
+        assert inventory.commit('b', {1: 1}) == [1]
+    
+    @pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+    def test_hot_product_never_oversold(self, backend, tmp_path):
+        """TC-INV-002: Concurrent buyers of one product never sell more than its stock"""
+        inventory = MemoryInventory() if backend == 'memory' else SQLiteInventory(str(tmp_path / 'inv.db'))
+        inventory.set_stock(7, 10)
+        sold = []
+        
+        def buyer(index):
+            holder = f'buyer-{index}'
+            if inventory.reserve(holder, 7, 1) and not inventory.commit(holder, {7: 1}):
+                sold.append(holder)
+        
+        threads = [threading.Thread(target=buyer, args=(i,)) for i in range(25)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(sold) == 10
+        assert inventory.stock(7)['on_hand'] == 0
+    
+    def test_cart_reserves_and_checkout_commits(self, stocked):
+        """TC-INV-003: Adding to the cart reserves stock; checkout sells it and keeps a short cart"""
+        client, inventory = stocked
+        inventory.set_stock(1, 1)
+        client.get('/add_to_cart/1')
+        assert inventory.stock(1)['reserved'] == 1
+        with app.test_client() as other:
+            response = other.get('/add_to_cart/1', follow_redirects=True)
+            assert b'out of stock' in response.data
+            with other.session_transaction() as sess:
+                assert not sess.get('cart')
+        response = client.get('/checkout')
+        assert response.status_code == 200
+        assert inventory.stock(1) == {'on_hand': 0, 'reserved': 0, 'available': 0}
+        # A cart whose stock was sold elsewhere is kept at checkout
+        with client.session_transaction() as sess:
+            sess['cart'] = {'1': 1}
+        response = client.get('/checkout', follow_redirects=True)
+        assert b'not enough stock' in response.data
+        with client.session_transaction() as sess:
+            assert sess['cart'] == {'1': 1}
+    
+    def test_api_batch_is_all_or_nothing(self, stocked):
+        """TC-INV-004: A batch line without stock gets a 409 and releases the batch's other holds"""
+        client, inventory = stocked
+        inventory.set_stock(1, 5)
+        inventory.set_stock(2, 1)
+        response = client.post('/api/v1/cart/batch', json={'lines': [
+            {'product_id': 1, 'quantity': 2}, {'product_id': 2, 'quantity': 3}]})
+        assert response.status_code == 409
+        assert 'lines[1]' in response.get_json()['error']
+        assert inventory.stock(1)['reserved'] == 0
+        assert client.get('/api/v1/cart').get_json()['count'] == 0
+        assert client.post('/api/v1/cart/items', json={'product_id': 2, 'quantity': 2}).status_code == 409
+        assert client.post('/api/v1/cart/items', json={'product_id': 2}).status_code == 200
+        assert client.delete('/api/v1/cart/items/2').status_code == 200
+        assert inventory.stock(2)['available'] == 1
+    
+    @pytest.mark.parametrize('suffix', ['.csv', '.db'])
+    def test_stock_seeded_from_catalog(self, suffix, tmp_path):
+        """TC-INV-005: The catalog's stock column seeds untracked products, without undoing sales"""
+        path = tmp_path / f'products{suffix}'
+        
+        def write(rows):
+            if suffix == '.csv':
+                path.write_text('id,name,description,price,image,stock\n'
+                                + ''.join(f'{i},Item {i},,100,x.svg,{stock}\n' for i, stock in rows))
+            else:
+                conn = sqlite3.connect(path)
+                conn.execute('DROP TABLE IF EXISTS products')
+                conn.execute('CREATE TABLE products (id, name, description, price, image, stock)')
+                conn.executemany("INSERT INTO products VALUES (?, 'Item', '', 100, 'x.svg', ?)",
+                                 [(i, stock if stock != '' else None) for i, stock in rows])
+                conn.commit()
+                conn.close()
+        
+        write([(1, 2), (2, '')])
+        shop = Flask(__name__)
+        shop.extensions['inventory'] = inventory = MemoryInventory()
+        shop.config['CATALOG_RELOAD_INTERVAL'] = 0
+        watcher = init_catalog_source(shop, str(path))
+        assert inventory.levels() == {1: {'on_hand': 2, 'reserved': 0, 'available': 2}}
+        assert inventory.reserve('a', 1, 1) and inventory.commit('a', {1: 1}) == []
+        write([(1, 2), (2, ''), (3, 5)])
+        assert watcher.reload()
+        assert {pid: level['on_hand'] for pid, level in inventory.levels().items()} == {1: 1, 3: 5}
+        write([(1, -1)])
+        assert not watcher.reload()
+    
+    def test_workers_share_stock(self, monkeypatch, tmp_path):
+        """TC-INV-006: Serving with several workers moves stock to SQLite; memory stock has no CLI"""
+        monkeypatch.setenv('INVENTORY_STORE', '')
+        monkeypatch.setattr(serve, 'INSTANCE_DIR', str(tmp_path))
+        shop = Flask(__name__)
+        shop.extensions['inventory'] = memory = MemoryInventory()
+        memory.set_stock(4, 3)
+        assert serve.share_inventory(shop, 1) is memory
+        shared = serve.share_inventory(shop, 4)
+        assert isinstance(shared, SQLiteInventory) and shared.path == str(tmp_path / 'inventory.db')
+        assert os.environ['INVENTORY_STORE'] == f'sqlite:///{tmp_path / "inventory.db"}'
+        assert shared.stock(4)['on_hand'] == 3
+        monkeypatch.setitem(app.extensions, 'inventory', MemoryInventory())
+        result = app.test_cli_runner().invoke(args=['inventory', 'set', '4', '1'])
+        assert result.exit_code != 0 and 'server memory' in result.output
+        monkeypatch.setitem(app.extensions, 'inventory', shared)
+        assert app.test_cli_runner().invoke(args=['inventory', 'set', '4', '1']).exit_code == 0
+        assert shared.stock(4)['on_hand'] == 1
+
+
+@pytest.fixture(autouse=True)
+def order_log(monkeypatch, tmp_path):
+    """Fresh order log in a temporary directory (for every test: none writes to the real log)"""
+    log = OrderLog(str(tmp_path / 'orders.jsonl'))
+    monkeypatch.setitem(app.config, 'ORDER_LOG', log.path)
+    monkeypatch.setitem(app.extensions, 'orders', log)
+    return log
+
+def log_orders_on(log, monkeypatch, days):
+    """Append one single-line order per entry of ``days`` (ISO dates), in order"""
+    class FixedClock:
+        day = None
+        
+        @classmethod
+        def now(cls):
+            return datetime.datetime.fromisoformat(cls.day + 'T12:00:00')
+    
+    monkeypatch.setattr(orders, 'datetime', FixedClock)
+    for number, day in enumerate(days, start=1):
+        FixedClock.day = day
+        log.append([{'product_id': number, 'name': f'Item {number}', 'price': 100,
+                     'quantity': 1, 'subtotal': 100}], 100)
+
+class TestOrders:
+    """TC-ORDER: Order Log and Export Tests"""
+    
+    def test_checkout_records_order(self, client, order_log):
+        """TC-ORDER-001: Checkout appends the order's lines, subtotals and total to the log"""
+        client.get('/add_to_cart/1')
+        client.get('/add_to_cart/1')
+        client.get('/add_to_cart/3')
+        response = client.get('/checkout')
+        [order] = order_log.iter_orders()
+        assert order['total'] == 2 * 2500 + 3200
+        assert [(line['product_id'], line['quantity'], line['subtotal']) for line in order['lines']] == [
+            (1, 2, 5000), (3, 1, 3200)]
+        assert f'Order number: <strong>{order["id"]}</strong>'.encode() in response.data
+        assert order_log.get(order['id']) == order
+        assert order_log.get(order['id'] + 1) is None
+    
+    def test_date_range_uses_index(self, order_log, monkeypatch):
+        """TC-ORDER-002: Date ranges are read from the byte range given by the day index"""
+        log_orders_on(order_log, monkeypatch, ['2024-03-01', '2024-03-01', '2024-03-02', '2024-03-05'])
+        days, offsets = order_log.day_offsets()
+        assert days == ['2024-03-01', '2024-03-02', '2024-03-05']
+        select = lambda since, until: [o['lines'][0]['product_id'] for o in order_log.iter_orders(since, until)]
+        assert select(None, None) == [1, 2, 3, 4]
+        assert select('2024-03-02', None) == [3, 4]
+        assert select('2024-03-03', '2024-03-05') == [4]
+        assert select(None, '2024-03-01') == [1, 2]
+        assert select('2024-03-06', None) == []
+        assert order_log.span('2024-03-02', '2024-03-04')[0] == offsets[1]
+    
+    def test_export_endpoint_streams(self, client, order_log, monkeypatch):
+        """TC-ORDER-003: The export endpoint needs the token and streams CSV or JSON lines"""
+        log_orders_on(order_log, monkeypatch, ['2024-03-01'] * 50 + ['2024-03-02'])
+        assert client.get('/admin/orders/export').status_code == 404  # No ORDERS_TOKEN
+        monkeypatch.setitem(app.config, 'ORDERS_TOKEN', 'secret')
+        assert client.get('/admin/orders/export').status_code == 401
+        assert client.get('/admin/orders/export', headers={'Authorization': 'Bearer sécret'}).status_code == 401
+        auth = {'Authorization': 'Bearer secret'}
+        assert client.get('/admin/orders/export?since=yesterday', headers=auth).status_code == 400
+        response = client.get('/admin/orders/export?until=2024-03-01', headers=auth)
+        assert response.is_streamed
+        assert response.mimetype == 'text/csv'
+        rows = response.get_data(as_text=True).splitlines()
+        assert rows[0].startswith('order_id,timestamp,product_id') and len(rows) == 51
+        response = client.get('/admin/orders/export?format=jsonl&since=2024-03-02', headers=auth)
+        assert [json.loads(line)['lines'][0]['product_id'] for line in response.data.splitlines()] == [51]
+        # The ASGI entry point passes the export through in chunks
+        monkeypatch.setattr(orders, 'CHUNK_BYTES', 1024)
+        sent = []
+        scope = {'type': 'http', 'method': 'GET', 'path': '/admin/orders/export', 'query_string': b'format=jsonl',
+                 'headers': [(b'authorization', b'Bearer secret')], 'scheme': 'http',
+                 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234), 'http_version': '1.1'}
+        
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        
+        async def send(message):
+            sent.append(message)
+        
+        asyncio.run(application(scope, receive, send))
+        chunks = [message['body'] for message in sent[1:] if message['body']]
+        assert len(chunks) > 1
+        assert b''.join(chunks) == open(order_log.path, 'rb').read()
+    
+    def test_export_cli(self, order_log, monkeypatch, tmp_path):
+        """TC-ORDER-004: `flask orders export` writes the selected orders to a file"""
+        log_orders_on(order_log, monkeypatch, ['2024-03-01', '2024-03-02'])
+        target = tmp_path / 'orders.csv'
+        result = app.test_cli_runner().invoke(args=['orders', 'export', '--since', '2024-03-02', '-o', str(target)])
+        assert result.exit_code == 0, result.output
+        rows = target.read_text().splitlines()
+        assert len(rows) == 2 and rows[1].split(',')[2] == '2'
+
+
+def write_catalog_file(path, products, stamp_ns):
+    """Write ``products`` as CSV, JSONL or SQLite (by extension) with a given modification time"""
+    records = [Product.from_dict(p).to_dict() for p in products]
+    if path.suffix == '.csv':
+        with open(path, 'w', newline='') as target:
+            writer = csv.DictWriter(target, fieldnames=list(records[0]))
+            writer.writeheader()
+            writer.writerows(records)
+    elif path.suffix == '.jsonl':
+        path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    else:
+        conn = sqlite3.connect(path)
+        conn.execute('DROP TABLE IF EXISTS products')
+        conn.execute('CREATE TABLE products (id INTEGER PRIMARY KEY, name, description, price, image)')
+        conn.executemany('INSERT INTO products VALUES (:id, :name, :description, :price, :image)', records)
+        conn.commit()
+        conn.close()
+    os.utime(path, ns=(stamp_ns, stamp_ns))
+
+class TestCatalogSource:
+    """TC-CATSRC: Catalog File Loading and Hot Reload Tests"""
+    
+    @pytest.mark.parametrize('name', ['products.csv', 'products.jsonl', 'products.db'])
+    def test_load_formats(self, tmp_path, name):
+        """TC-CATSRC-001: CSV, JSONL and SQLite files load into an indexed catalog"""
+        path = tmp_path / name
+        write_catalog_file(path, PRODUCTS, 10 ** 18)
+        catalog = load_catalog(str(path), version=7)
+        assert list(catalog) == list(Catalog(PRODUCTS))
+        assert catalog.version == 7
+        assert catalog.get('3').price == 3200
+        assert [p.id for p in catalog.search('keyboard')[0]][0] == 2
+    
+    def test_invalid_files_rejected(self, tmp_path):
+        """TC-CATSRC-002: Bad records, duplicate ids and unknown formats are reported"""
+        bad = tmp_path / 'bad.jsonl'
+        bad.write_text('{"id": 1, "name": "A", "price": 100}\n{"id": 2, "name": "B", "price": "cheap"}\n')
+        with pytest.raises(ValueError, match='record 2'):
+            load_catalog(str(bad))
+        bad.write_text('{"id": 1, "name": "A", "price": 100}\n{"id": 1, "name": "B", "price": 200}\n')
+        with pytest.raises(ValueError, match='duplicate product id 1'):
+            load_catalog(str(bad))
+        with pytest.raises(ValueError, match='Unsupported'):
+            load_catalog(str(tmp_path / 'products.xml'))
+    
+    def test_watcher_swaps_snapshot(self, client, tmp_path, monkeypatch):
+        """TC-CATSRC-003: A settled change is loaded as a new snapshot under the next version"""
+        monkeypatch.setitem(app.extensions, 'catalog', app.extensions['catalog'])  # Restored afterwards
+        path = tmp_path / 'products.csv'
+        write_catalog_file(path, PRODUCTS, 10 ** 18)
+        watcher = CatalogWatcher(app, str(path), interval=0)
+        original = app.extensions['catalog']
+        assert not watcher.check()
+        renamed = [dict(p, name='Silent Mouse') if p['id'] == 1 else p for p in PRODUCTS]
+        write_catalog_file(path, renamed, 2 * 10 ** 18)
+        assert not watcher.check()  # Not settled yet
+        assert watcher.check()
+        current = app.extensions['catalog']
+        assert current is not original and current.version == original.version + 1
+        assert original.get(1).name == 'Wireless Mouse'  # In-flight requests keep their snapshot
+        assert b'Silent Mouse' in client.get('/products').data
+        assert not watcher.check()
+    
+    def test_failed_reload_keeps_snapshot(self, tmp_path, monkeypatch):
+        """TC-CATSRC-004: A file that fails to load leaves the current snapshot in place"""
+        monkeypatch.setitem(app.extensions, 'catalog', app.extensions['catalog'])
+        path = tmp_path / 'products.jsonl'
+        write_catalog_file(path, PRODUCTS, 10 ** 18)
+        watcher = CatalogWatcher(app, str(path), interval=0)
+        original = app.extensions['catalog']
+        path.write_text('{"id": 1}\n')
+        assert not watcher.check(settle=False)
+        assert app.extensions['catalog'] is original
+        assert watcher.failures == 1
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def analytics_backend(request, monkeypatch):
+    """Run with the vectorized NumPy path and with the plain-Python fallback"""
+    if request.param == 'numpy' and analytics.np is None:
+        pytest.skip('NumPy is not installed')
+    if request.param == 'python':
+        monkeypatch.setattr(analytics, 'np', None)
+    return request.param
+
+def votes_store(votes):
+    """RatingStore from {product_id: [scores]}"""
+    store = RatingStore()
+    for product_id, scores in votes.items():
+        for score in scores:
+            store.add(product_id, score)
+    return store
+
+class TestAnalytics:
+    """TC-ANALYTICS: Rating Analytics Tests"""
+    
+    def test_smoothed_ranking(self, analytics_backend):
+        """TC-ANALYTICS-001: Smoothed scores rank many good votes above a single perfect one"""
+        store = votes_store({1: [5], 2: [5] * 10 + [4] * 10, 3: [1] * 3})
+        report = rating_report(store, None)
+        assert report['backend'] == analytics_backend
+        assert (report['products_rated'], report['votes']) == (3, 24)
+        assert report['distribution'] == {1: 3, 2: 0, 3: 0, 4: 10, 5: 11}
+        ranking = top_rated(RatingColumns.from_store(store))
+        assert [row['product_id'] for row in ranking] == [2, 1, 3]
+        assert ranking[0] == {'product_id': 2, 'votes': 20, 'average': 4.5, 'smoothed': 4.417}
+        assert ranking[1]['average'] == 5.0 and ranking[1]['smoothed'] == pytest.approx(4.236, abs=1e-3)
+        assert top_rated(RatingColumns.from_store(RatingStore())) == []
+    
+    def test_trends(self, analytics_backend):
+        """TC-ANALYTICS-002: Votes are bucketed by time and grouped per product within the window"""
+        events = RatingEvents()
+        now = 1000000.0
+        for product_id, score, age in [(1, 5, 30), (1, 3, 90), (2, 4, 150), (2, 2, 170), (2, 5, 10), (3, 1, 900)]:
+            events.append(product_id, score, now - age)
+        buckets = vote_trend(events.columns(), 180, 3, now=now)
+        assert [(b['votes'], b['average']) for b in buckets] == [(2, 3.0), (1, 3.0), (2, 5.0)]
+        assert buckets[0]['start'] == now - 180
+        assert trending(events.columns(), 180, now=now) == [
+            {'product_id': 2, 'votes': 3, 'average': 3.67}, {'product_id': 1, 'votes': 2, 'average': 4.0}]
+        assert trending(events.columns(), 180, limit=1, now=now)[0]['product_id'] == 2
+    
+    def test_events_are_bounded(self):
+        """TC-ANALYTICS-003: The vote log keeps only the most recent votes"""
+        events = RatingEvents(max_events=8)
+        for n in range(20):
+            events.append(n, 5, float(n))
+        assert len(events) <= 8
+        product_ids, _, timestamps = events.columns()
+        assert list(product_ids)[-1] == 19 and list(timestamps) == sorted(timestamps)
+    
+    def test_report_endpoint(self, client, monkeypatch):
+        """TC-ANALYTICS-004: The admin report needs the token and includes votes posted to the site"""
+        events = RatingEvents()
+        monkeypatch.setitem(app.extensions, 'rating_events', events)
+        monkeypatch.setattr(PRODUCT_RATINGS, 'events', events)
+        PRODUCT_RATINGS.reset()
+        assert client.get('/admin/analytics/ratings').status_code == 404
+        monkeypatch.setitem(app.config, 'ANALYTICS_TOKEN', 'secret')
+        assert client.get('/admin/analytics/ratings').status_code == 401
+        assert client.get('/admin/analytics/ratings', headers={'Authorization': 'Bearer sécret'}).status_code == 401
+        client.post('/rate_product/6', data={'rating': '4'})
+        client.post('/api/v1/products/6/ratings', json={'rating': 5})
+        auth = {'Authorization': 'Bearer secret'}
+        assert client.get('/admin/analytics/ratings?buckets=0', headers=auth).status_code == 400
+        report = client.get('/admin/analytics/ratings?window=3600&buckets=4', headers=auth).get_json()
+        assert report['votes'] == 2 and len(events) == 2
+        assert report['top_rated'][0] == {'product_id': 6, 'name': 'Wireless Headphones', 'votes': 2,
+                                          'average': 4.5, 'smoothed': 4.5}
+        assert sum(bucket['votes'] for bucket in report['trend']['buckets']) == 2
+        assert report['trending'][0]['product_id'] == 6
+        PRODUCT_RATINGS.reset()
+    
+    def test_top_rated_sort_is_smoothed(self, client):
+        """TC-ANALYTICS-005: "Top rated" on /products orders by smoothed score"""
+        ratings = votes_store({4: [5], 7: [5] * 8 + [4] * 2, 3: [3] * 10})
+        page = paginate(Catalog(PRODUCTS), ratings, sort='rating', per_page=4)
+        assert [p.id for p in page.products] == [7, 4, 3, 1]  # 4 has the best raw average
+
+
+@pytest.fixture
+def recommender(client, monkeypatch, order_log):
+    """Client with an empty recommender that applies events as they arrive"""
+    recommender = Recommender(k=4, interval=None)
+    monkeypatch.setitem(app.extensions, 'recommendations', recommender)
+    return client, recommender
+
+class TestRecommendations:
+    """TC-REC: "Customers Also Bought" Tests"""
+    
+    def test_top_k_from_orders(self):
+        """TC-REC-001: Products bought together are recommended, normalized for popularity"""
+        recommender = Recommender(k=2, interval=None)
+        for basket in [[1, 2], [1, 2], [1, 3], [3, 4], [3, 5], [3, 6], [3, 1, 1]]:
+            recommender.record(basket)
+        # 3 sells with everything, so 2 (always bought with 1) ranks first for 1
+        assert recommender.recommend(1) == (2, 3)
+        assert recommender.recommend(2) == (1,)
+        assert recommender.recommend(1, limit=1) == (2,)
+        assert recommender.recommend(99) == ()
+        assert recommender.for_basket([1, 2]) == [3]
+        assert recommender.for_basket([2, 4], limit=1) == [1]
+        assert recommender.for_basket([]) == []
+    
+    def test_incremental_matches_rebuild(self):
+        """TC-REC-002: Incremental updates give the same top-k table as a full rebuild"""
+        rng = random.Random(7)
+        baskets = [[rng.randint(1, 40) for _ in range(rng.randint(2, 5))] for _ in range(1500)]
+        incremental = Recommender(k=5, interval=5.0, drift=0)
+        for start in range(0, len(baskets), 50):
+            for basket in baskets[start:start + 50]:
+                incremental.record(basket)
+            assert incremental.update() > 0
+        assert incremental.update() == 0
+        rebuilt = Recommender(k=5)
+        assert rebuilt.rebuild(baskets) == len(incremental)
+        assert all(incremental.recommend(p) == rebuilt.recommend(p) for p in range(1, 41))
+        # With the default drift, best-sellers' rows are re-ranked less often but stay close
+        drifted = Recommender(k=5, interval=5.0)
+        for basket in baskets:
+            drifted.record(basket)
+            drifted.update()
+        overlap = sum(len(set(drifted.recommend(p)) & set(rebuilt.recommend(p))) for p in range(1, 41))
+        assert overlap >= 0.9 * 5 * 40
+    
+    def test_liked_ratings_are_paired(self, recommender):
+        """TC-REC-003: Products a visitor rates 4+ are paired with the others they liked"""
+        client, recommender = recommender
+        client.post('/rate_product/1', data={'rating': '5'})
+        client.post('/rate_product/2', data={'rating': '2'})
+        assert len(recommender) == 0
+        client.post('/api/v1/products/3/ratings', json={'rating': 4})
+        assert recommender.recommend(3) == (1,) and recommender.recommend(1) == (3,)
+        version = recommender.version
+        client.post('/rate_product/3', data={'rating': '5'})  # Already liked: not counted twice
+        assert recommender.version == version
+        assert recommender._pairs[1][3] == 0.5
+    
+    def test_cart_shows_recommendations(self, recommender):
+        """TC-REC-004: Cart and product pages suggest products bought with the cart's contents"""
+        client, recommender = recommender
+        assert b'Customers also bought' not in client.get('/products').data
+        client.get('/add_to_cart/1')
+        client.get('/add_to_cart/2')
+        client.get('/checkout')
+        assert recommender.recommend(1) == (2,)
+        client.get('/add_to_cart/1')
+        section = re.compile(r'<section class="recommendations">.*?</section>', re.S)
+        assert 'addToCart(2,' in section.search(client.get('/cart').data.decode()).group()
+        first = client.get('/products')
+        assert 'addToCart(2,' in section.search(first.data.decode()).group()
+        recommender.record([1, 5])
+        second = client.get('/products', headers={'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 200
+        assert 'addToCart(5,' in section.search(second.data.decode()).group()
+        client.get('/checkout')
+        assert b'Customers also bought' not in client.get('/cart').data
+
 class TestNonFunctionalRequirements:
     """TC-NFR: Non-Functional Requirements Tests"""
     
@@ -427,6 +1948,88 @@ class TestNonFunctionalRequirements:
         assert app.secret_key is not None
         assert len(app.secret_key) > 0
 
+class TestCatalog:
+    """TC-CATALOG: Indexed Product Catalog Tests"""
+    
+    def test_catalog_lookup_by_id(self):
+        """TC-CATALOG-001: Products are resolved by int or string id"""
+        catalog = Catalog(PRODUCTS)
+        assert catalog.get(1).name == 'Wireless Mouse'
+        assert catalog.get('20').name == 'Docking Station'
+    
+    def test_catalog_unknown_id(self):
+        """TC-CATALOG-002: Unknown or malformed ids return None"""
+        catalog = Catalog(PRODUCTS)
+        assert catalog.get(999) is None
+        assert catalog.get('abc') is None
+    
+    def test_catalog_preserves_order(self):
+        """TC-CATALOG-003: Catalog iterates products in source order"""
+        catalog = Catalog(PRODUCTS)
+        assert [p.id for p in catalog] == [p['id'] for p in PRODUCTS]
+    
+    def test_product_record_compat(self):
+        """TC-CATALOG-004: Product records support attribute and key access"""
+        product = Product.from_dict(PRODUCTS[0])
+        assert product.price == product['price'] == PRODUCTS[0]['price']
+        assert product.to_dict() == PRODUCTS[0]
+        assert not hasattr(product, '__dict__')
+    
+    def test_cart_ignores_unknown_products(self, client):
+        """TC-CATALOG-005: Cart skips ids missing from the catalog"""
+        with client.session_transaction() as sess:
+            sess['cart'] = {'1': 2, '999': 1}
+        response = client.get('/cart')
+        assert response.status_code == 200
+        assert b'\xc2\xa55000' in response.data
+
+class TestSearch:
+    """TC-SEARCH: Inverted-Index Search Tests"""
+    
+    def test_search_matches_description(self, client):
+        """TC-SEARCH-001: Search also matches product descriptions"""
+        response = client.get('/products?search=ergonomics')
+        assert response.status_code == 200
+        assert b'Laptop Stand' in response.data
+        assert b'Wireless Mouse' not in response.data
+    
+    def test_search_partial_word(self):
+        """TC-SEARCH-002: Partial words match by prefix and infix"""
+        catalog = Catalog(PRODUCTS)
+        prefix, _ = catalog.search('keyb')
+        infix, _ = catalog.search('ouse')
+        assert 'Mechanical Keyboard' in [p.name for p in prefix]
+        assert 'Wireless Mouse' in [p.name for p in infix]
+    
+    def test_search_ranks_name_matches_first(self):
+        """TC-SEARCH-003: Name matches rank above description-only matches"""
+        catalog = Catalog(PRODUCTS)
+        results, total = catalog.search('mouse')
+        names = [p.name for p in results]
+        assert total == 3
+        assert names.index('Wireless Mouse') < names.index('Wrist Rest')
+        assert names.index('Gaming Mouse Pad') < names.index('Wrist Rest')
+    
+    def test_search_all_terms_required(self):
+        """TC-SEARCH-004: Multi-word queries require every term to match"""
+        catalog = Catalog(PRODUCTS)
+        results, total = catalog.search('wireless mouse')
+        assert total == 1
+        assert results[0].name == 'Wireless Mouse'
+    
+    def test_search_pagination(self):
+        """TC-SEARCH-005: Search results can be paginated"""
+        catalog = Catalog(PRODUCTS)
+        everything, total = catalog.search('usb')
+        page, page_total = catalog.search('usb', offset=2, limit=2)
+        assert page_total == total
+        assert page == everything[2:4]
+    
+    def test_search_no_results(self, client):
+        """TC-SEARCH-006: Unmatched queries show the no-results message"""
+        response = client.get('/products?search=zzzz')
+        assert b'No products found' in response.data
+
 class TestPerformance:
     """TC-PERF: Performance Tests"""
     